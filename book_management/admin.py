@@ -1,11 +1,14 @@
 from django.contrib import admin
 
-from book_management.models import Book, Author
+from book_management.models import Book, Author, IsbnMetadata, BackgroundJob, StoredFile
 from comment_management.models import Topic, Comment, Like, Bookmark
 from user_management.models import PlatformUser, Profile, FollowRelation
 
 admin.site.register(Author)
 admin.site.register(Book)
+admin.site.register(IsbnMetadata)
+admin.site.register(BackgroundJob)
+admin.site.register(StoredFile)
 admin.site.register(Topic)
 admin.site.register(Comment)
 admin.site.register(Like)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class BooksManagementConfig(AppConfig):
     name = 'book_management'
+
+    def ready(self):
+        import book_management.signals
@@ -0,0 +1,196 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.request import urlopen
+
+import isbnlib
+import isbnlib.config
+from django.conf import settings
+from googletrans import LANGUAGES
+from isbnlib import NotValidISBNError
+from isbnlib.dev import DataNotFoundAtServiceError, NoDataForSelectorError
+
+
+def normalize_isbn(isbn):
+    """
+    :param isbn: codice isbn_10 o isbn_13, anche con trattini o spazi.
+    :return: Codice isbn_13 senza separatori, None se il codice non è valido.
+    """
+    if not isbn:
+        return None
+
+    isbn = isbnlib.canonical(isbn)
+    if isbnlib.is_isbn10(isbn):
+        return isbnlib.to_isbn13(isbn)
+    if isbnlib.is_isbn13(isbn):
+        return isbn
+    return None
+
+
+def language_name(code):
+    """
+    :param code: Codice della lingua restituito dal provider.
+    :return: Nome della lingua, o il codice stesso se non è riconosciuto.
+    """
+    return LANGUAGES.get(code, code)
+
+
+def download(url, timeout, max_size):
+    """
+    Scarica un file con un timeout di connessione e lettura e un limite alla dimensione.
+    :return: Contenuto del file.
+    """
+    with urlopen(url, timeout=timeout) as response:
+        data = response.read(max_size + 1)
+    if len(data) > max_size:
+        raise ValueError("Il file %s supera la dimensione massima di %d byte." % (url, max_size))
+    return data
+
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    :return: Pool di thread condiviso per le richieste ai servizi online, creato al primo utilizzo.
+    """
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=settings.ISBN_METADATA_WORKERS,
+                                          thread_name_prefix='isbn-metadata')
+    return executor
+
+
+class IsbnlibProvider(object):
+    """
+    Provider dei metadati dei libri basato sui servizi online interrogati da isbnlib.
+    Metadati e copertina vengono richiesti in parallelo, entro un tempo massimo complessivo
+    (ISBN_METADATA_DEADLINE): se la copertina non arriva in tempo vengono restituiti i soli metadati.
+    Di default le richieste usano il pool di thread condiviso; chi esegue molte ricerche a sua volta in parallelo
+    (ad esempio l'importazione massiva) può assegnare a executor un pool dedicato.
+    """
+    executor = None
+
+    @staticmethod
+    def fetch_meta(isbn_13):
+        try:
+            return isbnlib.meta(isbn_13) or None
+        except (NotValidISBNError, DataNotFoundAtServiceError, NoDataForSelectorError):
+            return None
+
+    @staticmethod
+    def fetch_cover(isbn_13):
+        """
+        :return: Coppia (url della miniatura, contenuto della miniatura), None se il libro non ha copertina.
+        """
+        cover = isbnlib.cover(isbn_13)
+        if not cover or 'thumbnail' not in cover:
+            return None
+        url = cover['thumbnail']
+        timeout = min(settings.BOOK_COVER_DOWNLOAD_TIMEOUT, settings.ISBN_METADATA_DEADLINE)
+        return url, download(url, timeout, settings.BOOK_COVER_MAX_SIZE)
+
+    def fetch(self, isbn_13):
+        """
+        :param isbn_13: codice isbn_13 normalizzato.
+        :return: Dizionario con i metadati del libro, None se il libro non esiste. Il dizionario contiene anche
+            il contenuto della miniatura ('thumbnail') e, se la copertina non è arrivata in tempo, 'partial'.
+        Gli errori di rete e il superamento del tempo massimo per i metadati vengono propagati, in modo che non
+        vengano memorizzati come "libro non trovato".
+        """
+        # Le richieste di isbnlib non durano più del tempo massimo, così che una richiesta abbandonata liberi
+        # comunque il suo thread del pool.
+        isbnlib.config.seturlopentimeout(settings.ISBN_METADATA_DEADLINE)
+        isbnlib.config.setthreadstimeout(settings.ISBN_METADATA_DEADLINE)
+
+        executor = self.executor or get_executor()
+        meta_future = executor.submit(self.fetch_meta, isbn_13)
+        cover_future = executor.submit(self.fetch_cover, isbn_13)
+        _, not_done = wait([meta_future, cover_future], timeout=settings.ISBN_METADATA_DEADLINE)
+
+        # Le richieste non ancora iniziate vengono annullate: resterebbero in coda nel pool condiviso, ritardando
+        # le ricerche successive.
+        for future in not_done:
+            future.cancel()
+
+        if meta_future in not_done:
+            raise TimeoutError("Metadati del libro %s non ricevuti entro %s secondi." %
+                               (isbn_13, settings.ISBN_METADATA_DEADLINE))
+        book = meta_future.result()
+        if book is None:
+            return None
+
+        cover = None
+        partial = cover_future in not_done
+        if not partial:
+            try:
+                cover = cover_future.result()
+            except Exception:
+                partial = True
+
+        return {
+            'title': book['Title'],
+            'authors': book['Authors'],
+            'publisher': book['Publisher'],
+            'year': book['Year'],
+            'language': book['Language'],
+            'image_url': cover[0] if cover else "",
+            'thumbnail': cover[1] if cover else None,
+            'partial': partial,
+        }
+
+
+class InFlightCall(object):
+    """
+    Chiamata in corso condivisa tra più thread.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RequestCoalescer(object):
+    """
+    Fa sì che richieste concorrenti per la stessa chiave condividano un'unica esecuzione: il primo thread
+    esegue la funzione, gli altri attendono e ricevono lo stesso risultato (o la stessa eccezione).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def call(self, key, function):
+        """
+        :param key: Chiave della richiesta.
+        :param function: Funzione senza argomenti da eseguire.
+        :return: Risultato della funzione.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = InFlightCall()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+
+coalescer = RequestCoalescer()
@@ -0,0 +1,123 @@
+import logging
+import traceback
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from book_management.isbn import download
+from book_management.models import Book, BackgroundJob, IsbnMetadata, StoredFile
+from book_management.thumbnails import create_thumbnails
+from books_base_folder.storage import is_content_addressed
+
+logger = logging.getLogger(__name__)
+
+handlers = {}
+
+sources = {}
+
+
+def register(kind):
+    """
+    Decoratore che registra la funzione che esegue i lavori di un tipo. La funzione riceve la chiave del lavoro.
+    """
+    def decorator(function):
+        handlers[kind] = function
+        return function
+    return decorator
+
+
+def register_source(kind):
+    """
+    Decoratore che registra la funzione che elenca le chiavi dei lavori di un tipo ancora da eseguire, per i lavori
+    che non vengono accodati da chi li origina (ad esempio per non aggiungere scritture a una richiesta). Le chiavi
+    vengono accodate dal worker prima di eseguire i lavori in coda.
+    """
+    def decorator(function):
+        sources[kind] = function
+        return function
+    return decorator
+
+
+def enqueue_from_sources(kinds=None):
+    """
+    Accoda i lavori elencati dalle funzioni registrate con register_source.
+    :param kinds: Tipi di lavoro da considerare, None per tutti.
+    """
+    for kind, source in sources.items():
+        if kinds is None or kind in kinds:
+            BackgroundJob.enqueue_many(kind, source(), reset_done=True)
+
+
+def run_job(job):
+    """
+    Esegue un lavoro preso in carico e ne registra l'esito.
+    :return: True se il lavoro è stato completato, False altrimenti.
+    """
+    try:
+        handlers[job.kind](job.key)
+    except Exception:
+        logger.warning("Lavoro %s non riuscito (tentativo %d).", job, job.attempts + 1, exc_info=True)
+        job.mark_failed(traceback.format_exc())
+        return False
+
+    job.mark_done()
+    return True
+
+
+def run_pending(kinds=None, limit=None):
+    """
+    Esegue i lavori in coda finché ce ne sono di pronti.
+    :param kinds: Tipi di lavoro da eseguire, None per tutti quelli registrati.
+    :param limit: Numero massimo di lavori da eseguire, None per nessun limite.
+    :return: Coppia (lavori completati, lavori non riusciti).
+    """
+    enqueue_from_sources(kinds)
+    done = failed = 0
+    while limit is None or done + failed < limit:
+        job = BackgroundJob.claim(kinds or list(handlers))
+        if job is None:
+            break
+        if run_job(job):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
+
+
+@register(BackgroundJob.BOOK_COVER)
+def download_book_cover(book_id):
+    """
+    Scarica la copertina di un libro da cover_image_url e la sostituisce a quella di default. Se la miniatura è già
+    stata scaricata durante la ricerca dei metadati viene riutilizzata.
+    Il campo viene aggiornato con un UPDATE, senza sovrascrivere eventuali modifiche concorrenti agli altri campi,
+    solo se la copertina è ancora quella di default.
+    """
+    book = Book.objects.filter(pk=book_id).first()
+    if book is None or not book.cover_image_url or not book.cover_image_file_is_default:
+        return
+
+    data = IsbnMetadata.get_thumbnail(book.isbn_13, book.cover_image_url)
+    if data is None:
+        data = download(book.cover_image_url, settings.BOOK_COVER_DOWNLOAD_TIMEOUT, settings.BOOK_COVER_MAX_SIZE)
+    default_cover = book.cover_image_file.name
+    book.cover_image_file.save("book_%s" % book.isbn_10, ContentFile(data), save=False)
+    with transaction.atomic():
+        if Book.objects.filter(pk=book.pk, cover_image_file=default_cover)\
+                .update(cover_image_file=book.cover_image_file.name):
+            StoredFile.replace_reference(default_cover, book.cover_image_file.name)
+    create_book_cover_thumbnails(book.pk)
+
+
+@register(BackgroundJob.BOOK_COVER_THUMBNAILS)
+def create_book_cover_thumbnails(book_id):
+    """
+    Crea le miniature della copertina di un libro (BOOK_COVER_THUMBNAIL_SIZES, in WebP e JPEG) e ne registra le
+    larghezze nel libro, solo se nel frattempo la copertina non è cambiata.
+    """
+    book = Book.objects.filter(pk=book_id).only('cover_image_file').first()
+    if book is None or not is_content_addressed(book.cover_image_file.name):
+        return
+
+    widths = create_thumbnails(book.cover_image_file.name, settings.BOOK_COVER_THUMBNAIL_SIZES)
+    Book.objects.filter(pk=book.pk, cover_image_file=book.cover_image_file.name).update(cover_thumbnails=widths)
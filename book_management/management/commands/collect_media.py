@@ -0,0 +1,64 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from book_management.models import StoredFile
+from books_base_folder.storage import content_storage, is_content_addressed
+
+
+class Command(BaseCommand):
+    """
+    Garbage collection dell'archivio dei file indirizzato per contenuto.
+    """
+    help = "Elimina le copertine e le immagini dei profili non più utilizzate."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Ricalcola i contatori dei riferimenti prima di eliminare i file.")
+        parser.add_argument('--import-legacy', action='store_true',
+                            help="Sposta nell'archivio i file salvati con i vecchi percorsi (ad esempio "
+                                 "books_cover/book_<isbn>), unendo quelli con lo stesso contenuto.")
+        parser.add_argument('--grace', type=int, default=settings.MEDIA_GC_GRACE_PERIOD,
+                            help="Secondi dopo cui un file senza riferimenti può essere eliminato.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Elenca i file da eliminare senza eliminarli.")
+
+    def import_legacy(self):
+        """
+        Sposta nell'archivio i file dei campi in StoredFile.REFERENCES che non ne fanno ancora parte. I file di
+        default vengono lasciati dove sono.
+        :return: Numero di file spostati.
+        """
+        moved = 0
+        for app_label, model_name, field_name in StoredFile.REFERENCES:
+            model = apps.get_model(app_label, model_name)
+            default = model._meta.get_field(field_name).get_default()
+            rows = model.objects.exclude(**{field_name: default}).exclude(**{field_name: ""})\
+                .exclude(**{'%s__isnull' % field_name: True}).values_list('pk', field_name)
+
+            for pk, name in rows.iterator():
+                if is_content_addressed(name) or not content_storage.exists(name):
+                    continue
+                with content_storage.open(name) as file:
+                    new_name = content_storage.save(name, file)
+                with transaction.atomic():
+                    if model.objects.filter(pk=pk, **{field_name: name}).update(**{field_name: new_name}):
+                        StoredFile.replace_reference(name, new_name)
+                if not model.objects.filter(**{field_name: name}).exists():
+                    content_storage.delete(name)
+                moved += 1
+        return moved
+
+    def handle(self, *args, **options):
+        if options['import_legacy'] and not options['dry_run']:
+            self.stdout.write("File spostati nell'archivio: %d." % self.import_legacy())
+
+        if options['rebuild']:
+            self.stdout.write("File utilizzati: %d." % StoredFile.rebuild())
+
+        deleted = StoredFile.collect(options['grace'], dry_run=options['dry_run'])
+        for name in deleted:
+            self.stdout.write(name)
+        message = "File da eliminare: %d." if options['dry_run'] else "File eliminati: %d."
+        self.stdout.write(self.style.SUCCESS(message % len(deleted)))
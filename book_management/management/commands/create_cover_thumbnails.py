@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from book_management import jobs
+from book_management.models import Book
+from books_base_folder.storage import CONTENT_ADDRESSED_PREFIX
+
+
+class Command(BaseCommand):
+    """
+    Crea le miniature delle copertine dei libri già presenti.
+    """
+    help = "Crea le miniature WebP e JPEG delle copertine che non le hanno ancora."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="Ricrea le miniature anche per le copertine che le hanno già.")
+
+    def handle(self, *args, **options):
+        books = Book.objects.filter(cover_image_file__startswith=CONTENT_ADDRESSED_PREFIX)
+        if not options['force']:
+            books = books.filter(cover_thumbnails=[])
+
+        created = failed = 0
+        for pk in books.values_list('pk', flat=True).iterator():
+            try:
+                jobs.create_book_cover_thumbnails(pk)
+                created += 1
+            except Exception as e:
+                self.stderr.write("Miniature del libro %d non create: %s" % (pk, e))
+                failed += 1
+            if (created + failed) % 100 == 0:
+                self.stdout.write("Libri elaborati: %d." % (created + failed))
+
+        self.stdout.write(self.style.SUCCESS("Miniature create per %d libri, non riuscite: %d." % (created, failed)))
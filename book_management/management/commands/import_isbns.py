@@ -0,0 +1,91 @@
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from book_management.isbn import normalize_isbn
+from book_management.models import Book, IsbnMetadata
+
+
+class Command(BaseCommand):
+    """
+    Importazione massiva di libri a partire da un elenco di codici isbn.
+    """
+    help = "Importa i libri corrispondenti ai codici isbn letti da un file (uno per riga) o dallo standard input."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help="File con un codice isbn per riga, '-' o nessun valore per lo standard input.")
+        parser.add_argument('--workers', type=int, default=settings.ISBN_METADATA_WORKERS,
+                            help="Numero di ricerche contemporanee dei metadati.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Numero di codici elaborati e inseriti per ogni blocco.")
+
+    def read_isbns(self, stream):
+        """
+        :return: Generatore dei codici isbn_13 normalizzati e non ripetuti letti dal file. I codici non validi
+            vengono contati in self.invalid.
+        """
+        seen = set()
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            isbn_13 = normalize_isbn(line)
+            if isbn_13 is None:
+                self.invalid += 1
+            elif isbn_13 not in seen:
+                seen.add(isbn_13)
+                yield isbn_13
+
+    def import_batch(self, isbns, workers):
+        """
+        Importa un blocco di codici: esclude i libri già presenti, ne cerca i metadati in parallelo e inserisce
+        i libri trovati.
+        """
+        existing = set(Book.objects.filter(canonical_isbn__in=isbns).values_list('canonical_isbn', flat=True))
+        isbns = [isbn_13 for isbn_13 in isbns if isbn_13 not in existing]
+        self.existing += len(existing)
+
+        metadata = IsbnMetadata.lookup_many(isbns, workers)
+        found = {isbn_13: metadata[isbn_13] for isbn_13 in isbns if metadata.get(isbn_13) is not None}
+        self.not_found += len(isbns) - len(found)
+        created = Book.bulk_import(found)
+        self.created += created
+        self.existing += len(found) - created
+
+    def handle(self, *args, **options):
+        self.created = self.existing = self.not_found = self.invalid = 0
+        processed = 0
+        start = time.monotonic()
+
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        try:
+            batch = []
+            for isbn_13 in self.read_isbns(stream):
+                batch.append(isbn_13)
+                if len(batch) >= options['batch_size']:
+                    self.import_batch(batch, options['workers'])
+                    processed += len(batch)
+                    batch = []
+                    self.report(processed, start)
+            if batch:
+                self.import_batch(batch, options['workers'])
+                processed += len(batch)
+                self.report(processed, start)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            "Libri inseriti: %d, già presenti: %d, non trovati: %d, codici non validi: %d." %
+            (self.created, self.existing, self.not_found, self.invalid)))
+
+    def report(self, processed, start):
+        """
+        Stampa l'avanzamento dell'importazione e la velocità media.
+        """
+        elapsed = time.monotonic() - start
+        self.stdout.write("%d codici elaborati, %d libri inseriti in %.1f s (%.1f codici/s)." %
+                          (processed, self.created, elapsed, processed / elapsed if elapsed else 0))
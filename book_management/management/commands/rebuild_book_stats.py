@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from book_management.models import BookStats
+
+
+class Command(BaseCommand):
+    """
+    Ricostruisce da zero le statistiche aggregate dei libri a partire dai bookshelf degli utenti.
+    """
+    help = "Ricalcola voti e numero di lettori di tutti i libri."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Numero di righe inserite per ogni INSERT.")
+
+    def handle(self, *args, **options):
+        count = BookStats.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS("Statistiche ricostruite per %d libri." % count))
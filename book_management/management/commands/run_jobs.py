@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from book_management import jobs
+
+
+class Command(BaseCommand):
+    """
+    Worker della coda dei lavori in background (BackgroundJob).
+    """
+    help = "Esegue i lavori in background in coda, come il download delle copertine dei libri."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Esegue i lavori pronti e termina, invece di restare in attesa di nuovi lavori.")
+        parser.add_argument('--kind', action='append', dest='kinds',
+                            help="Tipo di lavoro da eseguire (ripetibile). Di default tutti i tipi registrati.")
+        parser.add_argument('--sleep', type=float, default=5,
+                            help="Secondi di attesa quando la coda è vuota.")
+
+    def handle(self, *args, **options):
+        while True:
+            done, failed = jobs.run_pending(options['kinds'])
+            if done or failed:
+                self.stdout.write("Lavori completati: %d, non riusciti: %d." % (done, failed))
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
@@ -0,0 +1,51 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:46
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def populate_stats(apps, schema_editor):
+    """
+    Inizializza le statistiche dei libri già presenti nei bookshelf.
+    """
+    Book = apps.get_model('book_management', 'Book')
+    BookStats = apps.get_model('book_management', 'BookStats')
+
+    books = Book.objects.filter(profile_books__isnull=False).annotate(
+        stats_rating_sum=Coalesce(Sum('profile_books__rating'), 0),
+        stats_rating_count=Count('profile_books__rating'),
+        stats_reading_count=Count('profile_books', filter=Q(profile_books__status='READING')),
+        stats_read_count=Count('profile_books', filter=Q(profile_books__status='READ')),
+        stats_must_read_count=Count('profile_books', filter=Q(profile_books__status='MUSTREAD')),
+    )
+    BookStats.objects.bulk_create([BookStats(book_id=book.pk,
+                                             rating_sum=book.stats_rating_sum,
+                                             rating_count=book.stats_rating_count,
+                                             reading_count=book.stats_reading_count,
+                                             read_count=book.stats_read_count,
+                                             must_read_count=book.stats_must_read_count) for book in books])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_management', '0003_auto_20200909_1114'),
+        ('user_management', '0031_profile_feed_fan_out_on_read'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookStats',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='book_management.book')),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_count', models.IntegerField(default=0)),
+                ('reading_count', models.IntegerField(default=0)),
+                ('read_count', models.IntegerField(default=0)),
+                ('must_read_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:02
+
+from django.db import migrations
+
+from books_base_folder.search import FullTextIndex
+
+
+BOOK_INDEX = FullTextIndex('book_management_book_fts', ['title', 'authors'])
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Crea la tabella FTS5 dell'indice full-text dei libri e indicizza i libri esistenti.
+    """
+    Book = apps.get_model('book_management', 'Book')
+
+    schema_editor.execute(BOOK_INDEX.create_sql)
+
+    using = schema_editor.connection.alias
+    authors = {}
+    for book_id, name in Book.authors.through.objects.using(using).values_list('book_id', 'author__name')\
+            .order_by('pk'):
+        authors.setdefault(book_id, []).append(name)
+    BOOK_INDEX.rebuild(((pk, [title, " ".join(authors.get(pk, []))])
+                        for pk, title in Book.objects.using(using).values_list('pk', 'title')), using=using)
+
+
+def drop_search_index(apps, schema_editor):
+    schema_editor.execute(BOOK_INDEX.drop_sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_management', '0004_bookstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_management', '0005_book_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IsbnMetadata',
+            fields=[
+                ('isbn_13', models.CharField(max_length=13, primary_key=True, serialize=False)),
+                ('found', models.BooleanField(default=False)),
+                ('metadata', models.JSONField(blank=True, null=True)),
+                ('fetch_date_time', models.DateTimeField()),
+            ],
+        ),
+    ]
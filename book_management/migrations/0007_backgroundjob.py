@@ -0,0 +1,50 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:55
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def enqueue_missing_covers(apps, schema_editor):
+    """
+    Accoda il download delle copertine dei libri che hanno un cover_image_url ma la copertina di default.
+    """
+    Book = apps.get_model('book_management', 'Book')
+    BackgroundJob = apps.get_model('book_management', 'BackgroundJob')
+
+    books = Book.objects.exclude(cover_image_url=None).exclude(cover_image_url="")\
+        .filter(cover_image_file='books_cover/default/default_cover.png').values_list('pk', flat=True)
+    BackgroundJob.objects.bulk_create([BackgroundJob(kind='BOOKCOVER', key=str(pk)) for pk in books],
+                                      ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_management', '0006_isbnmetadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('key', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('PENDING', 'In attesa'), ('RUNNING', 'In esecuzione'), ('DONE', 'Completato'), ('FAILED', 'Fallito')], default='PENDING', max_length=7)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_date_time', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('creation_date_time', models.DateTimeField(auto_now_add=True)),
+                ('last_update_date_time', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='backgroundjob',
+            index=models.Index(fields=['status', 'next_attempt_date_time'], name='job_status_next_attempt_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='backgroundjob',
+            unique_together={('kind', 'key')},
+        ),
+        migrations.RunPython(enqueue_missing_covers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_management', '0007_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='isbnmetadata',
+            name='partial',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='isbnmetadata',
+            name='thumbnail',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,121 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:01
+
+from datetime import timedelta
+
+import isbnlib
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from books_base_folder.search import FullTextIndex
+
+
+BOOK_INDEX = FullTextIndex('book_management_book_fts', ['title', 'authors'])
+
+
+def canonical(isbn):
+    if not isbn:
+        return None
+    isbn = isbnlib.canonical(isbn)
+    if isbnlib.is_isbn10(isbn):
+        return isbnlib.to_isbn13(isbn)
+    return isbn if isbnlib.is_isbn13(isbn) else None
+
+
+def merge_duplicate_books(apps, schema_editor):
+    """
+    Calcola il codice canonical_isbn dei libri esistenti e unisce i libri con lo stesso codice: per ciascun gruppo
+    resta il libro con la pk minore, che riceve ProfileBook, topic e contatori dei duplicati. Se un profilo ha
+    nel bookshelf sia il libro sia un duplicato, viene mantenuto il ProfileBook del libro che resta.
+    Statistiche e classifica dei libri coinvolti vengono ricalcolate.
+    """
+    Book = apps.get_model('book_management', 'Book')
+    BookStats = apps.get_model('book_management', 'BookStats')
+    BackgroundJob = apps.get_model('book_management', 'BackgroundJob')
+    ProfileBook = apps.get_model('user_management', 'ProfileBook')
+    Topic = apps.get_model('comment_management', 'Topic')
+    ActivityCounter = apps.get_model('comment_management', 'ActivityCounter')
+    LeaderboardEntry = apps.get_model('comment_management', 'LeaderboardEntry')
+
+    groups = {}
+    for pk, isbn_13, isbn_10 in Book.objects.values_list('pk', 'isbn_13', 'isbn_10').order_by('pk'):
+        isbn = canonical(isbn_13) or canonical(isbn_10)
+        if isbn is not None:
+            groups.setdefault(isbn, []).append(pk)
+
+    survivors = []
+    for isbn, pks in groups.items():
+        survivor, duplicates = pks[0], pks[1:]
+        if duplicates:
+            survivors.append(survivor)
+
+            for duplicate in duplicates:
+                # I ProfileBook dei profili che hanno già il libro restano sul duplicato e vengono eliminati
+                # insieme a esso.
+                owners = ProfileBook.objects.filter(book_id=survivor).values('profile_owner_id')
+                ProfileBook.objects.filter(book_id=duplicate).exclude(profile_owner_id__in=owners)\
+                    .update(book_id=survivor)
+            Topic.objects.filter(book_id__in=duplicates).update(book_id=survivor)
+
+            for counter in ActivityCounter.objects.filter(board='BOOKTOPICS', subject_id__in=duplicates):
+                target, _ = ActivityCounter.objects.get_or_create(board='BOOKTOPICS', day=counter.day,
+                                                                  subject_id=survivor)
+                target.count += counter.count
+                target.save()
+                counter.delete()
+
+            BackgroundJob.objects.filter(kind='BOOKCOVER', key__in=[str(pk) for pk in duplicates]).delete()
+            for duplicate in duplicates:
+                schema_editor.execute("DELETE FROM %s WHERE rowid = %%s" % BOOK_INDEX.table, [duplicate])
+            Book.objects.filter(pk__in=duplicates).delete()
+
+        Book.objects.filter(pk=survivor).update(canonical_isbn=isbn)
+
+    if not survivors:
+        return
+
+    books = Book.objects.filter(pk__in=survivors, profile_books__isnull=False).annotate(
+        stats_rating_sum=Coalesce(Sum('profile_books__rating'), 0),
+        stats_rating_count=Count('profile_books__rating'),
+        stats_reading_count=Count('profile_books', filter=Q(profile_books__status='READING')),
+        stats_read_count=Count('profile_books', filter=Q(profile_books__status='READ')),
+        stats_must_read_count=Count('profile_books', filter=Q(profile_books__status='MUSTREAD')),
+    )
+    stats = [BookStats(book_id=book.pk,
+                       rating_sum=book.stats_rating_sum,
+                       rating_count=book.stats_rating_count,
+                       reading_count=book.stats_reading_count,
+                       read_count=book.stats_read_count,
+                       must_read_count=book.stats_must_read_count) for book in books]
+    BookStats.objects.filter(book_id__in=survivors).delete()
+    BookStats.objects.bulk_create(stats)
+
+    LeaderboardEntry.objects.filter(board='BOOKTOPICS').delete()
+    for window, days in (('ALL', None), ('MONTH', 30), ('WEEK', 7)):
+        counters = ActivityCounter.objects.filter(board='BOOKTOPICS')
+        if days is not None:
+            counters = counters.filter(day__gte=timezone.localdate() - timedelta(days=days - 1))
+        scores = counters.order_by().values('subject_id').annotate(score=Sum('count'))\
+            .filter(score__gt=0).order_by('-score', 'subject_id')[:settings.LEADERBOARD_SIZE]
+        LeaderboardEntry.objects.bulk_create([LeaderboardEntry(board='BOOKTOPICS', window=window, score=row['score'],
+                                                               book_id=row['subject_id']) for row in scores])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_management', '0008_isbnmetadata_thumbnail'),
+        ('comment_management', '0007_leaderboards'),
+        ('user_management', '0032_profile_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='canonical_isbn',
+            field=models.CharField(blank=True, editable=False, max_length=13, null=True, unique=True),
+        ),
+        migrations.RunPython(merge_duplicate_books, migrations.RunPython.noop),
+    ]
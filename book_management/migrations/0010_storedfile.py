@@ -0,0 +1,27 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:05
+
+import books_base_folder.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_management', '0009_book_canonical_isbn'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('reference_count', models.IntegerField(default=0)),
+                ('last_update_date_time', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='cover_image_file',
+            field=models.ImageField(default='books_cover/default/default_cover.png', storage=books_base_folder.storage.ContentAddressedStorage(), upload_to='books_cover/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_management', '0010_storedfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='cover_thumbnails',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
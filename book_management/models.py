@@ -1,12 +1,27 @@
-from tempfile import NamedTemporaryFile
-from urllib.request import urlopen
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
-from django.core.files import File
-from django.db import models
-from django.db.models import Count, Avg
+import isbnlib
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, Sum, F, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
 from django.utils.translation import gettext_lazy as _
 
 import comment_management
+from book_management.isbn import normalize_isbn, coalescer, language_name
+from book_management.thumbnails import THUMBNAIL_FORMATS, thumbnail_name
+from books_base_folder.search import FullTextIndex, SearchResults
+from books_base_folder.storage import content_storage, is_content_addressed, CONTENT_ADDRESSED_PREFIX
+from books_base_folder.tracking import LoadedValuesMixin
+
+logger = logging.getLogger(__name__)
 
 
 class Author(models.Model):
@@ -19,9 +34,11 @@ class Author(models.Model):
         return self.name
 
 
-class Book(models.Model):
+class Book(LoadedValuesMixin, models.Model):
     """
     Model che contiene i dati di un libro.
+    Il libro è identificato dal codice canonical_isbn (isbn_13 senza separatori), unico e indicizzato: tutte le
+    ricerche per isbn passano da questo campo. È NULL solo per i libri inseriti con codici non validi.
     """
     title = models.CharField(max_length=150)
     authors = models.ManyToManyField(Author, related_name="book_authors")
@@ -30,15 +47,158 @@ class Book(models.Model):
     year = models.PositiveSmallIntegerField(blank=True, null=True)
     language = models.CharField(max_length=5, blank=True, null=True)
     cover_image_file = models.ImageField(default='books_cover/default/default_cover.png',
-                                         upload_to='books_cover/')
+                                         upload_to='books_cover/', storage=content_storage)
     cover_image_url = models.URLField(blank=True, null=True)
+    cover_thumbnails = models.JSONField(default=list, blank=True, editable=False)
 
     isbn_10 = models.CharField(max_length=20)
     isbn_13 = models.CharField(max_length=20)
+    canonical_isbn = models.CharField(max_length=13, unique=True, null=True, blank=True, editable=False)
+
+    search_index = FullTextIndex('book_management_book_fts', ['title', 'authors'])
 
     def __str__(self):
         return '%s di %s' % (self.title, self.authors)
 
+    @property
+    def search_document(self):
+        """
+        :return: Valori indicizzati per la ricerca full-text: titolo e nomi degli autori.
+        """
+        return [self.title, " ".join(self.authors.values_list('name', flat=True))]
+
+    @staticmethod
+    def from_metadata(isbn_13, metadata):
+        """
+        :param isbn_13: codice isbn_13 normalizzato.
+        :param metadata: Metadati del libro restituiti da IsbnMetadata.lookup.
+        :return: Oggetto Book non ancora salvato.
+        """
+        return Book(title=metadata['title'],
+                    publisher=metadata['publisher'],
+                    year=metadata['year'] or None,
+                    language=language_name(metadata['language']),
+                    cover_image_url=metadata['image_url'],
+                    isbn_10=isbnlib.to_isbn10(isbn_13),
+                    isbn_13=isbn_13,
+                    canonical_isbn=isbn_13)
+
+    @staticmethod
+    def get_by_isbn(isbn):
+        """
+        Cerca un libro a partire da un codice isbn_10 o isbn_13 con un'unica query sull'indice di canonical_isbn.
+        :param isbn: codice isbn_10 o isbn_13, anche con trattini o spazi.
+        :return: Libro corrispondente al codice, None se non esiste o se il codice non è valido.
+        """
+        isbn_13 = normalize_isbn(isbn)
+        if isbn_13 is None:
+            return None
+        return Book.objects.filter(canonical_isbn=isbn_13).first()
+
+    @staticmethod
+    def get_or_create_from_metadata(isbn_13, metadata):
+        """
+        :param isbn_13: codice isbn_13 normalizzato.
+        :param metadata: Metadati del libro restituiti da IsbnMetadata.lookup.
+        Il libro viene creato con save(), quindi con gli stessi signals e operazioni di salvataggio (copertina,
+        indice full-text) dei libri inseriti singolarmente. Se un inserimento concorrente dello stesso libro viola
+        il vincolo unique di canonical_isbn, viene restituito il libro inserito per primo.
+        :return: Coppia (libro, True se il libro è stato creato da questa chiamata).
+        """
+        book = Book.objects.filter(canonical_isbn=isbn_13).first()
+        if book is not None:
+            return book, False
+
+        try:
+            with transaction.atomic():
+                book = Book.from_metadata(isbn_13, metadata)
+                book.save()
+                book.authors.set([Author.objects.get_or_create(name=name)[0]
+                                  for name in dict.fromkeys(metadata['authors'] or [])])
+        except IntegrityError:
+            return Book.objects.get(canonical_isbn=isbn_13), False
+        return book, True
+
+    @staticmethod
+    def bulk_import(metadata_by_isbn):
+        """
+        Inserisce più libri con un numero costante di query: libri, autori mancanti e associazioni libro-autore
+        vengono creati con bulk_create. Poiché bulk_create non invia i signals, indice full-text e download delle
+        copertine vengono aggiornati esplicitamente.
+        I libri già presenti vengono ignorati. Se un inserimento concorrente dello stesso libro viola il vincolo
+        unique di canonical_isbn, la transazione viene annullata e ripetuta: al secondo tentativo il libro
+        risulta già presente.
+        :param metadata_by_isbn: Dizionario del tipo {isbn_13: metadati del libro}.
+        :return: Numero di libri inseriti.
+        """
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    existing = set(Book.objects.filter(canonical_isbn__in=list(metadata_by_isbn))
+                                   .values_list('canonical_isbn', flat=True))
+                    new_books = {isbn_13: metadata for isbn_13, metadata in metadata_by_isbn.items()
+                                 if isbn_13 not in existing}
+                    Book.insert_books(new_books)
+                return len(new_books)
+            except IntegrityError:
+                if attempt > 0:
+                    raise
+
+    @staticmethod
+    def insert_books(metadata_by_isbn):
+        """
+        Inserisce libri non ancora presenti, con autori, indice full-text e download delle copertine.
+        Deve essere chiamato in una transazione.
+        :param metadata_by_isbn: Dizionario del tipo {isbn_13: metadati del libro} di libri non ancora presenti.
+        """
+        if not metadata_by_isbn:
+            return
+
+        Book.objects.bulk_create([Book.from_metadata(isbn_13, metadata)
+                                  for isbn_13, metadata in metadata_by_isbn.items()])
+        books = dict(Book.objects.filter(canonical_isbn__in=list(metadata_by_isbn))
+                     .values_list('canonical_isbn', 'pk'))
+
+        names = {name for metadata in metadata_by_isbn.values() for name in metadata['authors'] or []}
+        authors = dict(Author.objects.filter(name__in=names).values_list('name', 'pk'))
+        Author.objects.bulk_create([Author(name=name) for name in names if name not in authors])
+        authors.update(Author.objects.filter(name__in=names - set(authors)).values_list('name', 'pk'))
+
+        Book.authors.through.objects.bulk_create([
+            Book.authors.through(book_id=books[isbn_13], author_id=authors[name])
+            for isbn_13, metadata in metadata_by_isbn.items()
+            for name in dict.fromkeys(metadata['authors'] or [])
+        ], batch_size=settings.FEED_BATCH_SIZE)
+
+        Book.search_index.update_many([(books[isbn_13], [metadata['title'], " ".join(metadata['authors'] or [])])
+                                       for isbn_13, metadata in metadata_by_isbn.items()])
+        BackgroundJob.enqueue_many(BackgroundJob.BOOK_COVER, [books[isbn_13]
+                                                              for isbn_13, metadata in metadata_by_isbn.items()
+                                                              if metadata['image_url']])
+
+    @staticmethod
+    def search(query, exclude=()):
+        """
+        Ricerca full-text dei libri per titolo e autori.
+        :param query: Testo della ricerca.
+        :param exclude: pk dei libri da escludere.
+        :return: Oggetto SearchResults con i libri in ordine di rilevanza, da paginare.
+        """
+        return SearchResults(Book.search_index, query, Book.objects.select_related('stats'), exclude)
+
+    @staticmethod
+    def rebuild_search_index():
+        """
+        Ricostruisce l'indice full-text dei libri leggendo titoli e autori con due sole query.
+        :return: Numero di libri indicizzati.
+        """
+        authors = {}
+        for book_id, name in Book.authors.through.objects.values_list('book_id', 'author__name').order_by('pk'):
+            authors.setdefault(book_id, []).append(name)
+
+        return Book.search_index.rebuild((pk, [title, " ".join(authors.get(pk, []))])
+                                         for pk, title in Book.objects.values_list('pk', 'title').iterator())
+
     @property
     def authors_str(self):
         """
@@ -63,27 +223,38 @@ class Book(models.Model):
         """
         return self.authors.all().count()
 
+    @property
+    def stats_or_empty(self):
+        """
+        :return: Statistiche aggregate del libro, oppure statistiche vuote se il libro non è mai stato inserito
+            in un bookshelf.
+        """
+        try:
+            return self.stats
+        except ObjectDoesNotExist:
+            return BookStats(book=self)
+
     @property
     def average_rating(self):
         """
         :return: Valutazione media degli utenti.
         """
-        average_rating = self.profile_books.exclude(rating=None).aggregate(avg_rating=Avg('rating'))['avg_rating']
-        return int(average_rating) if average_rating is not None else average_rating
+        stats = self.stats_or_empty
+        return stats.rating_sum // stats.rating_count if stats.rating_count > 0 else None
 
     @property
     def number_of_ratings(self):
         """
         :return: Numero di voti che ha ricevuto il libro.
         """
-        return self.profile_books.exclude(rating=None).count()
+        return self.stats_or_empty.rating_count
 
     @property
     def people_reading_count(self):
         """
         :return: Numero di persone che hanno letto il libro.
         """
-        return self.profile_books.exclude(status='READ').exclude(status='MUSTREAD').count()
+        return self.stats_or_empty.reading_count
 
     @property
     def topics_count(self):
@@ -112,25 +283,50 @@ class Book(models.Model):
         """
         :return: Numero di commenti relativi ai topic del libro.
         """
-        count = 0
-        for topic in self.topics.all():
-            count += topic.comments_count
-        return count
+        return self.topics.aggregate(count=Sum('num_comments'))['count'] or 0
 
     @property
     def is_top_5(self):
         """
         :return: True se il libro è nella Top5, False altrimenti.
         """
-        return True if self in self.get_top_5() else False
+        return self.leaderboard_entries.filter(
+            board=comment_management.models.ActivityCounter.BOOKS_BY_TOPICS,
+            window=comment_management.models.LeaderboardEntry.ALL).exists()
 
     @staticmethod
     def get_top_5():
         """
-        Cerca i 5 libri più popolari. La ricerca è basata sul numero di topic pubblicati per ciascun libro.
+        Legge i 5 libri più popolari dalla classifica materializzata. La classifica è basata sul numero di topic
+        pubblicati per ciascun libro.
         :return: 5 libri più popolari ordinati per numero di topic decrescente.
         """
-        return Book.objects.all().annotate(num_topics=Count('topics')).order_by('-num_topics')[:5]
+        return Book.objects.filter(
+            leaderboard_entries__board=comment_management.models.ActivityCounter.BOOKS_BY_TOPICS,
+            leaderboard_entries__window=comment_management.models.LeaderboardEntry.ALL,
+        ).order_by('-leaderboard_entries__score')[:5]
+
+    @property
+    def cover_srcset(self):
+        """
+        Property utilizzata nei template per l'attributo srcset delle copertine.
+        :return: Dizionario del tipo {estensione: srcset} con le miniature della copertina in ciascun formato,
+            vuoto se le miniature non sono ancora state create.
+        """
+        return {extension: ", ".join("%s %dw" % (content_storage.url(thumbnail_name(self.cover_image_file.name,
+                                                                                     width, extension)), width)
+                                     for width in self.cover_thumbnails)
+                for extension, __, __ in THUMBNAIL_FORMATS} if self.cover_thumbnails else {}
+
+    @property
+    def cover_thumbnail_url(self):
+        """
+        :return: Url della miniatura JPEG più piccola, per i browser che non supportano srcset, oppure url della
+            copertina originale se le miniature non sono ancora state create.
+        """
+        if not self.cover_thumbnails:
+            return self.cover_image_file.url
+        return content_storage.url(thumbnail_name(self.cover_image_file.name, self.cover_thumbnails[0], 'jpg'))
 
     @property
     def cover_image_file_is_default(self):
@@ -141,13 +337,525 @@ class Book(models.Model):
 
     def save(self, *args, **kwargs):
         """
-        Durante il salvataggio, controlla se è presente una cover_image_url.
-        In caso affermativo ne scarica l'immagine e la salva, assegnando il percorso al campo cover_image_file.
+        Durante il salvataggio, controlla se la cover_image_url è stata impostata o modificata.
+        In caso affermativo e se la copertina è ancora quella di default, accoda il download dell'immagine:
+        il libro viene salvato subito con la copertina di default, che viene sostituita a download completato.
+        Un download fallito non viene ritentato ai salvataggi successivi del libro, ma solo se cambia l'url.
+        Se non è ancora stato impostato, calcola il codice canonical_isbn a partire da isbn_13 o isbn_10.
+        Aggiorna i riferimenti alla copertina (StoredFile) nella stessa transazione. Se la copertina è cambiata,
+        le miniature della precedente non vengono più usate e la creazione delle nuove viene accodata.
+        """
+        if self.canonical_isbn is None:
+            self.canonical_isbn = normalize_isbn(self.isbn_13) or normalize_isbn(self.isbn_10)
+
+        tracked = StoredFile.is_tracked_save(self, 'cover_image_file', kwargs.get('update_fields'))
+        url_changed = self.field_changed('cover_image_url')
+        with transaction.atomic():
+            old_cover = StoredFile.saved_name(self, 'cover_image_file') if tracked else None
+            cover_changed = tracked and old_cover != self.cover_image_file.name
+            if cover_changed:
+                self.cover_thumbnails = []
+                if kwargs.get('update_fields') is not None:
+                    kwargs['update_fields'] = set(kwargs['update_fields']) | {'cover_thumbnails'}
+            super(Book, self).save(*args, **kwargs)
+            if tracked:
+                StoredFile.replace_reference(old_cover, self.cover_image_file.name)
+            if cover_changed and is_content_addressed(self.cover_image_file.name):
+                BackgroundJob.enqueue(BackgroundJob.BOOK_COVER_THUMBNAILS, self.pk)
+            if url_changed and self.cover_image_url and self.cover_image_file_is_default:
+                BackgroundJob.enqueue(BackgroundJob.BOOK_COVER, self.pk)
+        self.refresh_loaded_values(['cover_image_url', 'cover_image_file'])
+
+
+class BookStats(models.Model):
+    """
+    Model che contiene le statistiche aggregate di un libro: somma e numero dei voti, numero di profili per
+    ciascuno status del bookshelf. Viene aggiornato in modo incrementale a ogni salvataggio o eliminazione
+    di un ProfileBook, così che le pagine e le liste di libri non eseguano aggregazioni.
+    """
+    STATUS_COUNTERS = {
+        'READING': 'reading_count',
+        'READ': 'read_count',
+        'MUSTREAD': 'must_read_count',
+    }
+
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, related_name="stats", primary_key=True)
+
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+
+    reading_count = models.IntegerField(default=0)
+    read_count = models.IntegerField(default=0)
+    must_read_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "Statistiche di %s" % self.book.title
+
+    @staticmethod
+    def apply_changes(changes):
+        """
+        Applica alle statistiche le variazioni di uno o più ProfileBook, con un UPDATE con espressioni F()
+        per ogni libro coinvolto.
+        :param changes: Lista di coppie (stato precedente, stato attuale). Ogni stato è una tupla
+            (book_id, status, rating), oppure None se il ProfileBook non esisteva o è stato eliminato.
+        """
+        deltas = {}
+        for old_state, new_state in changes:
+            for state, sign in ((old_state, -1), (new_state, 1)):
+                if state is None or state[0] is None:
+                    continue
+                book_id, status, rating = state
+                book_deltas = deltas.setdefault(book_id, {})
+                if status in BookStats.STATUS_COUNTERS:
+                    counter = BookStats.STATUS_COUNTERS[status]
+                    book_deltas[counter] = book_deltas.get(counter, 0) + sign
+                if rating is not None:
+                    book_deltas['rating_sum'] = book_deltas.get('rating_sum', 0) + sign * rating
+                    book_deltas['rating_count'] = book_deltas.get('rating_count', 0) + sign
+
+        deltas = {book_id: {field: delta for field, delta in book_deltas.items() if delta != 0}
+                  for book_id, book_deltas in deltas.items()}
+        deltas = {book_id: book_deltas for book_id, book_deltas in deltas.items() if book_deltas}
+        if not deltas:
+            return
+
+        # Le righe mancanti vengono create solo per i libri che ricevono un contributo positivo: un libro senza
+        # statistiche non ha nulla da decrementare, e durante l'eliminazione a cascata di un libro non si deve
+        # ricreare la sua riga.
+        created = [book_id for book_id, book_deltas in deltas.items() if any(d > 0 for d in book_deltas.values())]
+        with transaction.atomic():
+            BookStats.objects.bulk_create([BookStats(book_id=book_id) for book_id in created], ignore_conflicts=True)
+            for book_id, book_deltas in deltas.items():
+                BookStats.objects.filter(book_id=book_id)\
+                    .update(**{field: F(field) + delta for field, delta in book_deltas.items()})
+
+    @staticmethod
+    def rebuild(batch_size=1000):
+        """
+        Ricalcola da zero le statistiche di tutti i libri con un'unica aggregazione sui ProfileBook.
+        :return: Numero di libri con statistiche.
+        """
+        books = Book.objects.filter(profile_books__isnull=False).annotate(
+            stats_rating_sum=Coalesce(Sum('profile_books__rating'), 0),
+            stats_rating_count=Count('profile_books__rating'),
+            stats_reading_count=Count('profile_books', filter=Q(profile_books__status='READING')),
+            stats_read_count=Count('profile_books', filter=Q(profile_books__status='READ')),
+            stats_must_read_count=Count('profile_books', filter=Q(profile_books__status='MUSTREAD')),
+        )
+
+        stats = [BookStats(book_id=book.pk,
+                           rating_sum=book.stats_rating_sum,
+                           rating_count=book.stats_rating_count,
+                           reading_count=book.stats_reading_count,
+                           read_count=book.stats_read_count,
+                           must_read_count=book.stats_must_read_count) for book in books.iterator()]
+
+        with transaction.atomic():
+            BookStats.objects.all().delete()
+            BookStats.objects.bulk_create(stats, batch_size=batch_size)
+
+        return len(stats)
+
+
+class IsbnMetadata(models.Model):
+    """
+    Model che contiene la cache locale dei metadati dei libri, indicizzata per codice isbn_13 normalizzato.
+    Vengono memorizzati anche i codici per cui il provider non ha trovato alcun libro ("non trovato"), con una
+    durata più breve, così che ricerche ripetute di codici inesistenti non interroghino ogni volta il provider.
+    """
+    isbn_13 = models.CharField(max_length=13, primary_key=True)
+    found = models.BooleanField(default=False)
+    partial = models.BooleanField(default=False)
+    metadata = models.JSONField(null=True, blank=True)
+    thumbnail = models.BinaryField(null=True, blank=True)
+    fetch_date_time = models.DateTimeField()
+
+    def __str__(self):
+        return self.isbn_13
+
+    @property
+    def is_fresh(self):
+        """
+        :return: True se i dati memorizzati non sono ancora scaduti, False altrimenti. I dati incompleti
+            (copertina non ricevuta in tempo) scadono come i "non trovato".
+        """
+        if self.found and not self.partial:
+            ttl = settings.ISBN_METADATA_TTL
+        else:
+            ttl = settings.ISBN_METADATA_NOT_FOUND_TTL
+        return timezone.now() - self.fetch_date_time < timedelta(seconds=ttl)
+
+    @staticmethod
+    def get_provider():
+        """
+        :return: Provider dei metadati configurato in ISBN_METADATA_PROVIDER.
+        """
+        return import_string(settings.ISBN_METADATA_PROVIDER)()
+
+    @staticmethod
+    def split_fetched(metadata):
+        """
+        Separa dai metadati restituiti dal provider la miniatura e l'indicazione di metadati parziali, memorizzate
+        in campi propri.
+        :param metadata: Metadati restituiti dal provider, None se il libro non esiste.
+        :return: Tripla (metadati senza miniatura, miniatura o None, True se i metadati sono parziali).
+        """
+        if metadata is None:
+            return None, None, False
+        metadata = dict(metadata)
+        thumbnail = metadata.pop('thumbnail', None)
+        partial = bool(metadata.pop('partial', False))
+        return metadata, thumbnail, partial
+
+    @staticmethod
+    def lookup(isbn):
+        """
+        Cerca i metadati di un libro, prima nella cache locale e poi presso il provider.
+        Le ricerche concorrenti dello stesso codice nello stesso processo condividono un'unica richiesta al provider.
+        Se il provider non è raggiungibile vengono restituiti gli eventuali dati scaduti.
+        :param isbn: codice isbn_10 o isbn_13 del libro.
+        :return: Dizionario con i metadati del libro, None se il codice non è valido o il libro non esiste.
+        """
+        isbn_13 = normalize_isbn(isbn)
+        if isbn_13 is None:
+            return None
+
+        cached = IsbnMetadata.objects.filter(pk=isbn_13).first()
+        if cached is not None and cached.is_fresh:
+            return cached.metadata if cached.found else None
+
+        def fetch():
+            try:
+                metadata = IsbnMetadata.get_provider().fetch(isbn_13)
+            except Exception:
+                logger.exception("Ricerca dei metadati del libro %s non riuscita.", isbn_13)
+                return cached.metadata if cached is not None and cached.found else None
+
+            metadata, thumbnail, partial = IsbnMetadata.split_fetched(metadata)
+            IsbnMetadata.objects.update_or_create(isbn_13=isbn_13, defaults={
+                'found': metadata is not None,
+                'partial': partial,
+                'metadata': metadata,
+                'thumbnail': thumbnail,
+                'fetch_date_time': timezone.now(),
+            })
+            return metadata
+
+        return coalescer.call(isbn_13, fetch)
+
+    @staticmethod
+    def lookup_many(isbns, workers):
+        """
+        Versione per grandi quantità di codici di lookup: legge la cache con una sola query, interroga il provider
+        per i codici mancanti o scaduti con un pool di workers thread e memorizza i risultati con un solo INSERT.
+        Le richieste parallele al provider usano un pool dedicato, per non esaurire quello condiviso con le
+        ricerche degli utenti.
+        :param isbns: Codici isbn_13 normalizzati.
+        :param workers: Numero di ricerche contemporanee presso il provider.
+        :return: Dizionario del tipo {isbn_13: metadati del libro, oppure None se il libro non esiste}
+        """
+        cached = IsbnMetadata.objects.filter(pk__in=isbns).defer('thumbnail').in_bulk()
+        results = {}
+        missing = []
+        for isbn_13 in isbns:
+            row = cached.get(isbn_13)
+            if row is not None and row.is_fresh:
+                results[isbn_13] = row.metadata if row.found else None
+            else:
+                missing.append(isbn_13)
+
+        if not missing:
+            return results
+
+        provider = IsbnMetadata.get_provider()
+
+        def fetch(isbn_13):
+            try:
+                return isbn_13, provider.fetch(isbn_13), False
+            except Exception:
+                logger.warning("Ricerca dei metadati del libro %s non riuscita.", isbn_13, exc_info=True)
+                return isbn_13, None, True
+
+        with ThreadPoolExecutor(max_workers=workers) as pool, \
+                ThreadPoolExecutor(max_workers=2 * workers) as lookups:
+            if hasattr(provider, 'executor'):
+                provider.executor = lookups
+            fetched = list(pool.map(fetch, missing))
+
+        now = timezone.now()
+        rows = []
+        for isbn_13, metadata, failed in fetched:
+            if failed:
+                row = cached.get(isbn_13)
+                results[isbn_13] = row.metadata if row is not None and row.found else None
+                continue
+
+            metadata, thumbnail, partial = IsbnMetadata.split_fetched(metadata)
+            rows.append(IsbnMetadata(isbn_13=isbn_13, found=metadata is not None, partial=partial,
+                                     metadata=metadata, thumbnail=thumbnail, fetch_date_time=now))
+            results[isbn_13] = metadata
+
+        with transaction.atomic():
+            IsbnMetadata.objects.filter(pk__in=[row.pk for row in rows]).delete()
+            IsbnMetadata.objects.bulk_create(rows)
+
+        return results
+
+    @staticmethod
+    def get_thumbnail(isbn, image_url=None):
+        """
+        :param isbn: codice isbn_10 o isbn_13 del libro.
+        :param image_url: Se indicato, la miniatura viene restituita solo se è stata scaricata da questo indirizzo.
+        :return: Contenuto della miniatura scaricata insieme ai metadati, None se non disponibile.
+        """
+        cached = IsbnMetadata.objects.filter(pk=normalize_isbn(isbn)).exclude(thumbnail=None)\
+            .values_list('metadata', 'thumbnail').first()
+        if cached is None or (image_url is not None and cached[0].get('image_url') != image_url):
+            return None
+        return bytes(cached[1])
+
+
+class BackgroundJob(models.Model):
+    """
+    Model che contiene la coda dei lavori da eseguire in background (comando run_jobs).
+    Un lavoro è identificato dal tipo e da una chiave (ad esempio la pk dell'oggetto da elaborare): accodare
+    più volte lo stesso lavoro ancora da eseguire non crea duplicati. I lavori falliti vengono ritentati con
+    attesa crescente (backoff esponenziale) fino a BACKGROUND_JOB_MAX_ATTEMPTS tentativi.
+    """
+    BOOK_COVER = 'BOOKCOVER'
+    BOOK_COVER_THUMBNAILS = 'COVERTHUMBS'
+    PROFILE_PICTURE = 'PROFILEPIC'
+
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+
+    STATUS_CHOICES = [
+        (PENDING, "In attesa"),
+        (RUNNING, "In esecuzione"),
+        (DONE, "Completato"),
+        (FAILED, "Fallito"),
+    ]
+
+    kind = models.CharField(max_length=20)
+    key = models.CharField(max_length=100)
+
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_date_time = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+
+    creation_date_time = models.DateTimeField(auto_now_add=True)
+    last_update_date_time = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "%s %s (%s)" % (self.kind, self.key, self.status)
+
+    @staticmethod
+    def enqueue(kind, key):
+        """
+        Accoda un lavoro. Se lo stesso lavoro è già in attesa o in esecuzione non viene duplicato; se era già stato
+        completato o era fallito viene rimesso in attesa con i tentativi azzerati. Va quindi chiamato solo quando
+        cambiano i dati da elaborare (ad esempio l'url della copertina), non a ogni salvataggio dell'oggetto,
+        altrimenti un lavoro fallito verrebbe ritentato senza limite.
+        """
+        key = str(key)
+        BackgroundJob.objects.bulk_create([BackgroundJob(kind=kind, key=key)], ignore_conflicts=True)
+        BackgroundJob.objects.filter(kind=kind, key=key, status__in=[BackgroundJob.DONE, BackgroundJob.FAILED])\
+            .update(status=BackgroundJob.PENDING, attempts=0, last_error="", next_attempt_date_time=timezone.now(),
+                    last_update_date_time=timezone.now())
+
+    @staticmethod
+    def enqueue_many(kind, keys, reset_done=False):
+        """
+        Accoda con un solo INSERT un lavoro per ciascuna chiave, ignorando quelli già presenti.
+        :param reset_done: Se True rimette in attesa anche i lavori già completati con le stesse chiavi, ma non
+            quelli falliti, che hanno esaurito i tentativi.
+        """
+        keys = [str(key) for key in keys]
+        BackgroundJob.objects.bulk_create([BackgroundJob(kind=kind, key=key) for key in keys],
+                                          batch_size=settings.FEED_BATCH_SIZE, ignore_conflicts=True)
+        if reset_done and keys:
+            BackgroundJob.objects.filter(kind=kind, key__in=keys, status=BackgroundJob.DONE)\
+                .update(status=BackgroundJob.PENDING, attempts=0, last_error="",
+                        next_attempt_date_time=timezone.now(), last_update_date_time=timezone.now())
+
+    @staticmethod
+    def claim(kinds=None):
+        """
+        Prende in carico il prossimo lavoro da eseguire. La presa in carico è un UPDATE condizionato sullo stato,
+        quindi più worker possono lavorare sulla stessa coda senza eseguire due volte lo stesso lavoro.
+        I lavori rimasti in esecuzione oltre BACKGROUND_JOB_LEASE secondi (worker interrotto) vengono ripresi.
+        :param kinds: Tipi di lavoro da considerare, None per tutti.
+        :return: Oggetto BackgroundJob preso in carico, None se non ci sono lavori da eseguire.
+        """
+        now = timezone.now()
+        due = BackgroundJob.objects.filter(
+            Q(status=BackgroundJob.PENDING, next_attempt_date_time__lte=now) |
+            Q(status=BackgroundJob.RUNNING,
+              last_update_date_time__lt=now - timedelta(seconds=settings.BACKGROUND_JOB_LEASE)))
+        if kinds:
+            due = due.filter(kind__in=kinds)
+
+        for job in due.order_by('next_attempt_date_time')[:10]:
+            claimed = BackgroundJob.objects.filter(pk=job.pk, status=job.status,
+                                                   last_update_date_time=job.last_update_date_time)\
+                .update(status=BackgroundJob.RUNNING, last_update_date_time=now)
+            if claimed:
+                job.status = BackgroundJob.RUNNING
+                job.last_update_date_time = now
+                return job
+        return None
+
+    def mark_done(self):
+        self.status = BackgroundJob.DONE
+        self.last_error = ""
+        self.save(update_fields=['status', 'last_error', 'last_update_date_time'])
+
+    def mark_failed(self, error):
+        """
+        Registra un tentativo fallito e pianifica il successivo con attesa BACKGROUND_JOB_RETRY_DELAY * 2^(n-1),
+        o segna il lavoro come fallito se i tentativi sono esauriti.
+        """
+        self.attempts += 1
+        self.last_error = error
+        if self.attempts >= settings.BACKGROUND_JOB_MAX_ATTEMPTS:
+            self.status = BackgroundJob.FAILED
+        else:
+            self.status = BackgroundJob.PENDING
+            self.next_attempt_date_time = timezone.now() + \
+                timedelta(seconds=settings.BACKGROUND_JOB_RETRY_DELAY * 2 ** (self.attempts - 1))
+        self.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_date_time',
+                                 'last_update_date_time'])
+
+    class Meta:
+        """
+        Un solo lavoro per tipo e chiave. L'indice (status, next_attempt_date_time) serve la ricerca dei lavori
+        da eseguire.
+        """
+        unique_together = ["kind", "key"]
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_date_time'], name='job_status_next_attempt_idx'),
+        ]
+
+
+class StoredFile(models.Model):
+    """
+    Model che conta i riferimenti ai file dell'archivio indirizzato per contenuto (ContentAddressedStorage).
+    Un file con lo stesso contenuto è condiviso da tutti gli oggetti che lo usano: il contatore viene aggiornato
+    a ogni salvataggio o eliminazione di un oggetto e i file senza riferimenti vengono eliminati da collect_media.
+    """
+    REFERENCES = [
+        ('book_management', 'Book', 'cover_image_file'),
+        ('user_management', 'Profile', 'picture'),
+    ]
+
+    name = models.CharField(max_length=100, primary_key=True)
+    reference_count = models.IntegerField(default=0)
+    last_update_date_time = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "%s (%d riferimenti)" % (self.name, self.reference_count)
+
+    @staticmethod
+    def saved_name(instance, field_name):
+        """
+        :return: Nome del file salvato nel database per il campo dell'oggetto, None se l'oggetto non è ancora
+            stato salvato. Per gli oggetti letti dal database (LoadedValuesMixin) viene usato il valore letto, senza
+            eseguire query.
+        """
+        if instance.pk is None:
+            return None
+        loaded_name = instance.loaded_value(field_name) if isinstance(instance, LoadedValuesMixin) else None
+        if loaded_name is not None:
+            return loaded_name
+        return type(instance)._default_manager.filter(pk=instance.pk).values_list(field_name, flat=True).first()
+
+    @staticmethod
+    def is_tracked_save(instance, field_name, update_fields=None):
+        """
+        :return: True se il salvataggio dell'oggetto scrive il campo, False se il campo non è stato caricato
+            (deferred) o è escluso da update_fields.
+        """
+        return field_name not in instance.get_deferred_fields() and \
+            (update_fields is None or field_name in update_fields)
+
+    @staticmethod
+    def replace_reference(old_name, new_name):
+        """
+        Sposta un riferimento da un file a un altro. I file che non appartengono all'archivio (ad esempio le
+        immagini di default) vengono ignorati.
+        :param old_name: Nome del file usato in precedenza, None se non c'era alcun file.
+        :param new_name: Nome del file usato ora, None se non c'è alcun file.
+        """
+        if old_name == new_name:
+            return
+        StoredFile.update_references({name: delta for name, delta in ((old_name, -1), (new_name, 1))
+                                      if is_content_addressed(name)})
+
+    @staticmethod
+    def update_references(deltas):
+        """
+        Applica le variazioni dei contatori con un UPDATE con espressioni F() per ogni file.
+        :param deltas: Dizionario del tipo {nome del file: variazione}.
+        """
+        if not deltas:
+            return
+
+        with transaction.atomic():
+            StoredFile.objects.bulk_create([StoredFile(name=name) for name, delta in deltas.items() if delta > 0],
+                                           ignore_conflicts=True)
+            for name, delta in deltas.items():
+                StoredFile.objects.filter(name=name).update(reference_count=F('reference_count') + delta,
+                                                            last_update_date_time=timezone.now())
+
+    @staticmethod
+    def rebuild():
+        """
+        Ricalcola da zero i contatori leggendo i file usati da tutti i campi in REFERENCES.
+        :return: Numero di file utilizzati.
+        """
+        counts = Counter()
+        for app_label, model_name, field_name in StoredFile.REFERENCES:
+            model = apps.get_model(app_label, model_name)
+            counts.update(model.objects.filter(**{'%s__startswith' % field_name: CONTENT_ADDRESSED_PREFIX})
+                          .values_list(field_name, flat=True).iterator())
+
+        with transaction.atomic():
+            StoredFile.objects.exclude(name__in=list(counts)).update(reference_count=0)
+            StoredFile.objects.bulk_create([StoredFile(name=name) for name in counts], ignore_conflicts=True,
+                                           batch_size=settings.FEED_BATCH_SIZE)
+            for name, count in counts.items():
+                StoredFile.objects.filter(name=name).exclude(reference_count=count).update(reference_count=count)
+
+        return len(counts)
+
+    @staticmethod
+    def collect(grace_period, dry_run=False):
+        """
+        Elimina i file senza riferimenti, compresi quelli presenti nell'archivio ma mai registrati (ad esempio
+        scritti da una transazione poi annullata). Un file viene eliminato solo se non è stato scritto o riutilizzato
+        negli ultimi grace_period secondi, così da non eliminare file appena salvati il cui riferimento non è ancora
+        stato registrato.
+        :param dry_run: Se True, i file da eliminare vengono solo elencati.
+        :return: Lista dei file eliminati.
         """
-        if self.cover_image_url and self.cover_image_file == self._meta.get_field('cover_image_file').get_default():
-            img_temp = NamedTemporaryFile(delete=True)
-            img_temp.write(urlopen(self.cover_image_url).read())
-            img_temp.flush()
-            self.cover_image_file.save(f"book_{self.isbn_10}", File(img_temp))
-        super(Book, self).save(*args, **kwargs)
+        cutoff = timezone.now() - timedelta(seconds=grace_period)
+        candidates = set(StoredFile.objects.filter(reference_count__lte=0, last_update_date_time__lt=cutoff)
+                         .values_list('name', flat=True))
+        registered = set(StoredFile.objects.values_list('name', flat=True))
+        candidates.update(name for name in content_storage.list_content_addressed() if name not in registered)
 
+        deleted = []
+        for name in sorted(candidates):
+            if not content_storage.is_expired(name, grace_period):
+                continue
+            if not dry_run:
+                with transaction.atomic():
+                    StoredFile.objects.filter(name=name, reference_count__lte=0).delete()
+                    if StoredFile.objects.filter(name=name).exists():
+                        continue
+                    content_storage.delete(name)
+            deleted.append(name)
+        return deleted
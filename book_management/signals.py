@@ -0,0 +1,53 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from book_management.models import Book, Author, StoredFile
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, **kwargs):
+    """
+    Aggiorna l'indice full-text al salvataggio di un libro.
+    """
+    Book.search_index.update(instance.pk, instance.search_document)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    """
+    Rimuove il libro eliminato dall'indice full-text.
+    """
+    Book.search_index.delete(instance.pk)
+
+
+@receiver(post_delete, sender=Book)
+def release_book_cover(sender, instance, **kwargs):
+    """
+    Rimuove il riferimento alla copertina del libro eliminato.
+    """
+    StoredFile.replace_reference(instance.cover_image_file.name, None)
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def index_book_authors(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Aggiorna l'indice full-text quando cambiano gli autori di un libro.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        Book.search_index.update(instance.pk, instance.search_document)
+    elif pk_set:
+        for book in Book.objects.filter(pk__in=pk_set):
+            Book.search_index.update(book.pk, book.search_document)
+
+
+@receiver(post_save, sender=Author)
+def index_author_books(sender, instance, created, **kwargs):
+    """
+    Aggiorna l'indice full-text dei libri di un autore quando il suo nome viene modificato.
+    """
+    if not created:
+        for book in instance.book_authors.all():
+            Book.search_index.update(book.pk, book.search_document)
@@ -1 +1,781 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO, BytesIO
 
+import isbnlib
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, transaction, connection
+from django.db.models.signals import post_save
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from book_management import jobs
+from book_management.isbn import RequestCoalescer, IsbnlibProvider, normalize_isbn
+from book_management.models import Book, BookStats, Author, IsbnMetadata, BackgroundJob, StoredFile
+from book_management.thumbnails import thumbnail_name
+from books_base_folder.storage import content_storage, CONTENT_ADDRESSED_PREFIX
+from books_base_folder.views import content_addressed_media
+from user_management.models import Profile, ProfileBook
+
+
+class BookStatsTest(TestCase):
+    """
+    Test delle statistiche aggregate dei libri.
+    """
+
+    def setUp(self):
+        """
+        Setup di un ambiente di test. Crea i seguenti oggetti a scopo di test:
+            - Due utenti con profilo
+            - Libro
+        """
+        self.profiles = []
+        for username in ('john', 'paul'):
+            user = get_user_model().objects.create_user(username, '%s@thebeatles.com' % username, 'password')
+            self.profiles.append(Profile.objects.create(first_name=username, last_name="Beatle", user=user))
+
+        self.book = Book.objects.create(
+            title="Libro di prova",
+            publisher="Editore di prova",
+            year="2020",
+            language="Italiano",
+            isbn_10="1234567890",
+            isbn_13="1234567890123",
+        )
+
+    def get_book(self):
+        return Book.objects.select_related('stats').get(pk=self.book.pk)
+
+    def test_book_without_stats(self):
+        """
+        Test di un libro che non è in nessun bookshelf.
+        """
+        book = self.get_book()
+        self.assertIsNone(book.average_rating)
+        self.assertEquals(book.number_of_ratings, 0)
+        self.assertEquals(book.people_reading_count, 0)
+
+    def test_incremental_update(self):
+        """
+        Test dell'aggiornamento delle statistiche al salvataggio, al cambio di status e all'eliminazione
+        di un ProfileBook.
+        """
+        first = ProfileBook.objects.create(profile_owner=self.profiles[0], book=self.book, status='READ', rating=80)
+        second = ProfileBook.objects.create(profile_owner=self.profiles[1], book=self.book, status='READING')
+
+        book = self.get_book()
+        self.assertEquals((book.average_rating, book.number_of_ratings, book.people_reading_count), (80, 1, 1))
+
+        second.status = 'READ'
+        second.rating = 50
+        second.save()
+        book = self.get_book()
+        self.assertEquals((book.average_rating, book.number_of_ratings, book.people_reading_count), (65, 2, 0))
+
+        second = ProfileBook.objects.get(pk=second.pk)
+        second.status = 'MUSTREAD'
+        second.save()
+        book = self.get_book()
+        self.assertEquals((book.average_rating, book.number_of_ratings, book.stats.must_read_count), (80, 1, 1))
+
+        first.delete()
+        self.profiles[1].user.delete()
+        book = self.get_book()
+        self.assertEquals((book.stats.rating_sum, book.stats.rating_count, book.stats.read_count,
+                           book.stats.must_read_count), (0, 0, 0, 0))
+
+    def test_rebuild_book_stats(self):
+        """
+        Test del comando rebuild_book_stats a partire da statistiche disallineate.
+        """
+        ProfileBook.objects.create(profile_owner=self.profiles[0], book=self.book, status='READ', rating=90)
+        ProfileBook.objects.create(profile_owner=self.profiles[1], book=self.book, status='READ', rating=70)
+        BookStats.objects.all().delete()
+
+        call_command('rebuild_book_stats', stdout=StringIO())
+        book = self.get_book()
+        self.assertEquals((book.average_rating, book.number_of_ratings, book.stats.read_count), (80, 2, 2))
+
+    def test_book_delete(self):
+        """
+        Test dell'eliminazione di un libro presente in un bookshelf.
+        """
+        ProfileBook.objects.create(profile_owner=self.profiles[0], book=self.book, status='READ', rating=90)
+        self.book.delete()
+        self.assertFalse(BookStats.objects.exists())
+
+
+@override_settings(SEARCH_PAGE_SIZE=2)
+class SearchTest(TestCase):
+    """
+    Test della ricerca full-text di libri e profili.
+    """
+
+    def setUp(self):
+        """
+        Setup di un ambiente di test. Crea i seguenti oggetti a scopo di test:
+            - Due utenti con profilo
+            - Tre libri con autore
+        """
+        self.client = Client()
+        self.user = get_user_model().objects.create_user('john', 'lennon@thebeatles.com', 'johnpassword')
+        self.profile = Profile.objects.create(first_name="John", last_name="Lennon", user=self.user)
+        self.other_user = get_user_model().objects.create_user('paul', 'mccartney@thebeatles.com', 'paulpassword')
+        self.other_profile = Profile.objects.create(first_name="Paul", last_name="McCartney", user=self.other_user)
+
+        self.author = Author.objects.create(name="Umberto Eco")
+        self.books = []
+        for title in ("Il nome della rosa", "Il pendolo di Foucault", "Numero zero"):
+            book = Book.objects.create(title=title, isbn_10="1234567890", isbn_13="1234567890123")
+            book.authors.add(self.author)
+            self.books.append(book)
+
+    def test_book_search(self):
+        """
+        Test della ricerca dei libri per titolo, autore e prefisso, e dell'aggiornamento dell'indice.
+        """
+        self.assertEquals(list(Book.search("rosa")[0:10]), [self.books[0]])
+        self.assertEquals(Book.search("eco").count(), 3)
+        self.assertEquals(list(Book.search("pend fouc")[0:10]), [self.books[1]])
+        self.assertEquals(Book.search("eco", exclude=[self.books[0].pk]).count(), 2)
+        excluded = Book.objects.filter(title__startswith="Il").values_list('pk', flat=True)
+        self.assertEquals(list(Book.search("eco", exclude=excluded)[0:10]), [self.books[2]])
+        self.assertEquals(Book.search('" OR *').count(), 0)
+
+        self.author.name = "Anonimo"
+        self.author.save()
+        self.assertEquals(Book.search("eco").count(), 0)
+
+        self.books[2].delete()
+        self.assertEquals(Book.search("anonimo").count(), 2)
+
+    def test_profile_search(self):
+        """
+        Test della ricerca dei profili, esclusi quelli di utenti disattivati.
+        """
+        self.assertEquals(list(Profile.search("mccartney")[0:10]), [self.other_profile])
+        self.assertEquals(list(Profile.search("john")[0:10]), [self.profile])
+
+        self.other_user.is_active = False
+        self.other_user.save()
+        self.assertEquals(Profile.search("paul").count(), 0)
+
+    def test_search_view(self):
+        """
+        Test della pagina di ricerca: risultati paginati separatamente per libri e profili e esclusione del profilo
+        dell'utente.
+        """
+        self.client.login(username='john', password='johnpassword')
+        response = self.client.get(reverse('search'), {'search': 'eco'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.context['books_count'], 3)
+        self.assertEquals(len(response.context['books']), 2)
+        self.assertTrue(response.context['books'].has_next())
+        first_page = list(response.context['books'])
+
+        response = self.client.get(reverse('search'), {'search': 'eco', 'books_page': 2, 'profiles_page': 3})
+        self.assertEquals(sorted(first_page + list(response.context['books']), key=lambda book: book.pk), self.books)
+        self.assertFalse(response.context['books'].has_next())
+        self.assertContains(response, 'books_page=1&profiles_page=1')
+        self.assertNotContains(response, 'books_page=3')
+
+        response = self.client.get(reverse('search'), {'search': 'john'})
+        self.assertEquals(response.context['profiles_count'], 0)
+
+
+def create_thumbnail():
+    """
+    :return: Immagine PNG 1x1 usata come miniatura nei test.
+    """
+    image = BytesIO()
+    Image.new('RGB', (1, 1)).save(image, 'PNG')
+    return image.getvalue()
+
+
+THUMBNAIL = create_thumbnail()
+
+
+class StubProvider(object):
+    """
+    Provider dei metadati locale, usato nei test al posto dei servizi online.
+    """
+    books = {
+        '9788845292613': {
+            'title': "Il nome della rosa",
+            'authors': ["Umberto Eco"],
+            'publisher': "Bompiani",
+            'year': "1980",
+            'language': 'it',
+            'image_url': "http://copertine.invalid/rosa.png",
+            'thumbnail': THUMBNAIL,
+        },
+    }
+    calls = []
+    fail = False
+
+    def fetch(self, isbn_13):
+        StubProvider.calls.append(isbn_13)
+        if StubProvider.fail:
+            raise IOError("Provider non raggiungibile")
+        return StubProvider.books.get(isbn_13)
+
+
+@override_settings(ISBN_METADATA_PROVIDER='book_management.tests.StubProvider')
+class IsbnMetadataTest(TestCase):
+    """
+    Test della cache locale dei metadati dei libri.
+    """
+
+    def setUp(self):
+        StubProvider.calls = []
+        StubProvider.fail = False
+
+    def test_normalize_isbn(self):
+        """
+        Test della normalizzazione dei codici isbn_10 e isbn_13.
+        """
+        self.assertEquals(normalize_isbn("88-452-9261-4"), '9788845292613')
+        self.assertEquals(normalize_isbn("978 88 452 9261 3"), '9788845292613')
+        self.assertIsNone(normalize_isbn("1234"))
+        self.assertIsNone(normalize_isbn(None))
+
+    def test_lookup_cache(self):
+        """
+        Test della memorizzazione dei metadati: isbn_10 e isbn_13 dello stesso libro condividono la stessa riga.
+        """
+        metadata = IsbnMetadata.lookup("8845292614")
+        self.assertEquals(metadata['title'], "Il nome della rosa")
+        self.assertEquals(IsbnMetadata.lookup("9788845292613"), metadata)
+        self.assertEquals(StubProvider.calls, ['9788845292613'])
+
+        IsbnMetadata.objects.update(fetch_date_time=timezone.now() - timedelta(days=31))
+        IsbnMetadata.lookup("9788845292613")
+        self.assertEquals(len(StubProvider.calls), 2)
+
+    def test_isbn_thumbnail(self):
+        """
+        Test della miniatura scaricata con i metadati, che il browser mantiene in cache quanto i metadati.
+        """
+        get_user_model().objects.create_user('john', 'lennon@thebeatles.com', 'johnpassword')
+        self.client.login(username='john', password='johnpassword')
+        IsbnMetadata.lookup("9788845292613")
+
+        response = self.client.get(reverse('book_management:isbn-thumbnail', kwargs={'isbn': '9788845292613'}))
+        self.assertEquals(response.content, THUMBNAIL)
+        self.assertEquals(response['Cache-Control'], 'private, max-age=%d' % settings.ISBN_METADATA_TTL)
+
+    def test_lookup_not_found(self):
+        """
+        Test della memorizzazione dei codici non trovati, con durata più breve.
+        """
+        self.assertIsNone(IsbnMetadata.lookup("9780000000002"))
+        self.assertIsNone(IsbnMetadata.lookup("9780000000002"))
+        self.assertEquals(len(StubProvider.calls), 1)
+        self.assertFalse(IsbnMetadata.objects.get(pk='9780000000002').found)
+
+        IsbnMetadata.objects.update(fetch_date_time=timezone.now() - timedelta(days=2))
+        IsbnMetadata.lookup("9780000000002")
+        self.assertEquals(len(StubProvider.calls), 2)
+
+        self.assertIsNone(IsbnMetadata.lookup("1234"))
+        self.assertEquals(len(StubProvider.calls), 2)
+
+    def test_lookup_provider_error(self):
+        """
+        Test di un errore del provider: vengono restituiti i dati scaduti e non viene memorizzato "non trovato".
+        """
+        IsbnMetadata.lookup("9788845292613")
+        IsbnMetadata.objects.update(fetch_date_time=timezone.now() - timedelta(days=31))
+        StubProvider.fail = True
+
+        with self.assertLogs('book_management.models', 'ERROR'):
+            self.assertEquals(IsbnMetadata.lookup("9788845292613")['title'], "Il nome della rosa")
+            self.assertIsNone(IsbnMetadata.lookup("9780000000002"))
+        self.assertTrue(IsbnMetadata.objects.get(pk='9788845292613').found)
+        self.assertFalse(IsbnMetadata.objects.filter(pk='9780000000002').exists())
+
+    def test_request_coalescing(self):
+        """
+        Test della condivisione di un'unica esecuzione tra richieste concorrenti per la stessa chiave.
+        """
+        coalescer = RequestCoalescer()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "metadati"
+
+        def worker():
+            results.append(coalescer.call('9788845292613', fetch))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEquals(len(calls), 1)
+        self.assertEquals(results, ["metadati"] * 5)
+
+    def test_ajax_search_book(self):
+        """
+        Test della ricerca di un libro tramite AJAX con i metadati letti dalla cache.
+        """
+        get_user_model().objects.create_user('john', 'lennon@thebeatles.com', 'johnpassword')
+        client = Client()
+        client.login(username='john', password='johnpassword')
+
+        for _ in range(2):
+            response = client.get(reverse('book_management:ajax-search-book'), {'isbn_code': '8845292614'})
+            self.assertEquals(response.json()['book_title'], "Il nome della rosa")
+        self.assertEquals(len(StubProvider.calls), 1)
+
+        response = client.get(response.json()['book_cover_url'])
+        self.assertEquals(response['Content-Type'], 'image/png')
+        self.assertEquals(response.content, THUMBNAIL)
+
+    def test_cover_job_reuses_thumbnail(self):
+        """
+        Test del riutilizzo della miniatura scaricata con i metadati da parte del download della copertina.
+        """
+        IsbnMetadata.lookup("8845292614")
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            book = Book.objects.create(title="Il nome della rosa", cover_image_url="http://copertine.invalid/rosa.png",
+                                       isbn_10="8845292614", isbn_13="9788845292613")
+            self.assertEquals(jobs.run_pending(), (1, 0))
+            book.refresh_from_db()
+            with book.cover_image_file.open('rb') as cover:
+                self.assertEquals(cover.read(), THUMBNAIL)
+
+
+class SlowProvider(IsbnlibProvider):
+    """
+    Provider con tempi di risposta simulati, usato per i test della ricerca parallela.
+    """
+    meta_delay = 0
+    cover_delay = 0
+    cover_calls = []
+
+    @staticmethod
+    def fetch_meta(isbn_13):
+        time.sleep(SlowProvider.meta_delay)
+        return {'Title': "Titolo", 'Authors': ["Autore"], 'Publisher': "", 'Year': "2020", 'Language': 'it'}
+
+    @staticmethod
+    def fetch_cover(isbn_13):
+        SlowProvider.cover_calls.append(isbn_13)
+        time.sleep(SlowProvider.cover_delay)
+        return "http://copertine.invalid/copertina.png", THUMBNAIL
+
+
+@override_settings(ISBN_METADATA_DEADLINE=0.5)
+class ParallelLookupTest(TestCase):
+    """
+    Test della ricerca parallela di metadati e copertina entro il tempo massimo.
+    """
+
+    def fetch(self, meta_delay, cover_delay):
+        SlowProvider.meta_delay = meta_delay
+        SlowProvider.cover_delay = cover_delay
+        return SlowProvider().fetch('9788845292613')
+
+    def test_parallel_fetch(self):
+        """
+        Test di metadati e copertina che, richiesti in sequenza, supererebbero il tempo massimo.
+        """
+        metadata = self.fetch(0.3, 0.3)
+        self.assertFalse(metadata['partial'])
+        self.assertEquals(metadata['thumbnail'], THUMBNAIL)
+
+    def test_partial_result(self):
+        """
+        Test dei soli metadati quando la copertina non arriva in tempo.
+        """
+        metadata = self.fetch(0, 1)
+        self.assertTrue(metadata['partial'])
+        self.assertEquals((metadata['title'], metadata['image_url']), ("Titolo", ""))
+
+    def test_metadata_timeout(self):
+        """
+        Test dei metadati che non arrivano in tempo: errore, che non viene memorizzato come "non trovato".
+        """
+        with self.assertRaises(TimeoutError):
+            self.fetch(1, 0)
+
+    def test_abandoned_requests_cancelled(self):
+        """
+        Test delle richieste non ancora iniziate allo scadere del tempo massimo: vengono annullate, invece di
+        restare in coda nel pool.
+        """
+        SlowProvider.meta_delay = 1
+        SlowProvider.cover_delay = 0
+        SlowProvider.cover_calls = []
+        provider = SlowProvider()
+        provider.executor = ThreadPoolExecutor(max_workers=1)
+
+        with self.assertRaises(TimeoutError):
+            provider.fetch('9788845292613')
+        provider.executor.shutdown(wait=True)
+        self.assertEquals(SlowProvider.cover_calls, [])
+
+
+class BookCoverJobTest(TestCase):
+    """
+    Test del download in background delle copertine dei libri.
+    """
+
+    def setUp(self):
+        """
+        Setup di un ambiente di test: cartella media temporanea e immagine di copertina servita tramite file://.
+        """
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root.name, BACKGROUND_JOB_MAX_ATTEMPTS=2)
+        self.settings_override.enable()
+
+        self.cover_path = os.path.join(self.media_root.name, 'cover.png')
+        with open(self.cover_path, 'wb') as cover:
+            cover.write(THUMBNAIL)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_root.cleanup()
+
+    def create_book(self, cover_image_url):
+        return Book.objects.create(title="Libro di prova", cover_image_url=cover_image_url,
+                                   isbn_10="1234567890", isbn_13="1234567890123")
+
+    def test_cover_download(self):
+        """
+        Test del salvataggio del libro con copertina di default e della sostituzione a download completato.
+        """
+        book = self.create_book('file://' + self.cover_path)
+        self.assertTrue(book.cover_image_file_is_default)
+
+        book.save()
+        self.assertEquals(BackgroundJob.objects.filter(kind=BackgroundJob.BOOK_COVER, key=str(book.pk)).count(), 1)
+
+        self.assertEquals(jobs.run_pending(), (1, 0))
+        book.refresh_from_db()
+        self.assertFalse(book.cover_image_file_is_default)
+        with book.cover_image_file.open('rb') as cover:
+            self.assertEquals(cover.read(), THUMBNAIL)
+        self.assertEquals(BackgroundJob.objects.get().status, BackgroundJob.DONE)
+
+        book.save()
+        self.assertEquals(jobs.run_pending(), (0, 0))
+
+    def test_cover_thumbnails(self):
+        """
+        Test della creazione delle miniature WebP e JPEG dopo il download della copertina, senza ingrandimenti.
+        """
+        for size, widths in (((300, 450), [64, 128, 256]), ((100, 150), [64, 100])):
+            cover = BytesIO()
+            Image.new('RGB', size, 'red').save(cover, 'PNG')
+            with open(self.cover_path, 'wb') as cover_file:
+                cover_file.write(cover.getvalue())
+
+            Book.objects.all().delete()
+            book = self.create_book('file://' + self.cover_path)
+            self.assertEquals(book.cover_srcset, {})
+            self.assertEquals(jobs.run_pending(), (1, 0))
+
+            book.refresh_from_db()
+            self.assertEquals(book.cover_thumbnails, widths)
+            self.assertIn("-%d.webp %dw" % (widths[-1], widths[-1]), book.cover_srcset['webp'])
+            for width in widths:
+                name = thumbnail_name(book.cover_image_file.name, width, 'webp')
+                with content_storage.open(name) as thumbnail:
+                    self.assertEquals(Image.open(thumbnail).size[0], width)
+
+        call_command('create_cover_thumbnails', '--force', stdout=StringIO())
+        self.assertEquals(Book.objects.get().cover_thumbnails, [64, 100])
+
+    def test_cover_download_retry(self):
+        """
+        Test dei tentativi ripetuti con attesa crescente e del fallimento definitivo del lavoro, che viene ritentato
+        solo se cambia l'url della copertina.
+        """
+        book = self.create_book('file://' + os.path.join(self.media_root.name, 'inesistente.png'))
+
+        with self.assertLogs('book_management.jobs', 'WARNING'):
+            self.assertEquals(jobs.run_pending(), (0, 1))
+        job = BackgroundJob.objects.get()
+        self.assertEquals((job.status, job.attempts), (BackgroundJob.PENDING, 1))
+        self.assertGreater(job.next_attempt_date_time, timezone.now())
+        self.assertEquals(jobs.run_pending(), (0, 0))
+
+        BackgroundJob.objects.update(next_attempt_date_time=timezone.now())
+        with self.assertLogs('book_management.jobs', 'WARNING'):
+            self.assertEquals(jobs.run_pending(), (0, 1))
+        self.assertEquals(BackgroundJob.objects.get().status, BackgroundJob.FAILED)
+
+        book.save()
+        Book.objects.get(pk=book.pk).save()
+        job = BackgroundJob.objects.get()
+        self.assertEquals((job.status, job.attempts), (BackgroundJob.FAILED, 2))
+
+        book.cover_image_url = 'file://' + self.cover_path
+        book.save()
+        job = BackgroundJob.objects.get()
+        self.assertEquals((job.status, job.attempts), (BackgroundJob.PENDING, 0))
+        self.assertEquals(jobs.run_pending(), (1, 0))
+
+
+def make_isbn_13(number):
+    """
+    :return: Codice isbn_13 valido costruito a partire da un numero.
+    """
+    body = '97888%07d' % number
+    check = (10 - sum((3 if i % 2 else 1) * int(digit) for i, digit in enumerate(body)) % 10) % 10
+    return body + str(check)
+
+
+class CatalogueProvider(object):
+    """
+    Provider locale che restituisce metadati generati per qualunque codice, tranne quelli in not_found.
+    """
+    not_found = set()
+
+    def fetch(self, isbn_13):
+        if isbn_13 in CatalogueProvider.not_found:
+            return None
+        return {
+            'title': "Libro %s" % isbn_13,
+            'authors': ["Autore comune", "Autore %s" % isbn_13[-4:]],
+            'publisher': "Editore",
+            'year': "2020",
+            'language': 'it',
+            'image_url': "http://copertine.invalid/%s.png" % isbn_13,
+        }
+
+
+@override_settings(ISBN_METADATA_PROVIDER='book_management.tests.CatalogueProvider')
+class ImportIsbnsTest(TestCase):
+    """
+    Test dell'importazione massiva di libri.
+    """
+
+    def test_import_isbns(self):
+        """
+        Test del comando import_isbns: libri già presenti, non trovati, codici non validi o ripetuti.
+        """
+        isbns = [make_isbn_13(i) for i in range(5)]
+        CatalogueProvider.not_found = {isbns[4]}
+        Book.objects.create(title="Già presente", isbn_10="", isbn_13=isbns[0])
+
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as isbn_file:
+            isbn_file.write("\n".join(isbns + ["1234", isbns[1], ""]))
+        try:
+            out = StringIO()
+            call_command('import_isbns', isbn_file.name, '--workers', '2', '--batch-size', '2', stdout=out)
+        finally:
+            os.remove(isbn_file.name)
+
+        self.assertIn("Libri inseriti: 3, già presenti: 1, non trovati: 1, codici non validi: 1.", out.getvalue())
+        book = Book.objects.get(isbn_13=isbns[1])
+        self.assertEquals(book.title, "Libro %s" % isbns[1])
+        self.assertEquals(book.authors.count(), 2)
+        self.assertEquals(Author.objects.filter(name="Autore comune").count(), 1)
+        self.assertEquals(list(Book.search(isbns[2][-4:])[0:10]), [Book.objects.get(isbn_13=isbns[2])])
+        self.assertEquals(BackgroundJob.objects.filter(kind=BackgroundJob.BOOK_COVER).count(), 3)
+
+    def test_bulk_import_queries(self):
+        """
+        Test del numero di query dell'inserimento, indipendente dal numero di libri.
+        """
+        def metadata(numbers):
+            return {make_isbn_13(i): CatalogueProvider().fetch(make_isbn_13(i)) for i in numbers}
+
+        Book.bulk_import(metadata(range(1)))
+        with self.assertNumQueries(12):
+            Book.bulk_import(metadata(range(10, 12)))
+        with self.assertNumQueries(12):
+            Book.bulk_import(metadata(range(20, 60)))
+
+
+@override_settings(ISBN_METADATA_PROVIDER='book_management.tests.CatalogueProvider')
+class BookIdentityTest(TestCase):
+    """
+    Test dell'identificazione dei libri tramite il codice canonical_isbn.
+    """
+
+    def test_get_by_isbn(self):
+        """
+        Test della ricerca di un libro con codici isbn_10 e isbn_13, anche con trattini o spazi.
+        """
+        book = Book.objects.create(title="Il nome della rosa", isbn_10="", isbn_13="978-88-452-9261-3")
+        self.assertEquals(book.canonical_isbn, '9788845292613')
+
+        for isbn in ("8845292614", "88-452-9261-4", "9788845292613", " 978 88 452 9261 3 "):
+            with self.assertNumQueries(1):
+                self.assertEquals(Book.get_by_isbn(isbn), book)
+        with self.assertNumQueries(0):
+            self.assertIsNone(Book.get_by_isbn("1234"))
+
+    def test_duplicate_books(self):
+        """
+        Test del vincolo unique: lo stesso libro non può essere inserito due volte, neanche con un codice diverso.
+        """
+        isbn_13 = make_isbn_13(1)
+        metadata = CatalogueProvider().fetch(isbn_13)
+
+        saved = []
+        post_save.connect(lambda instance, **kwargs: saved.append(instance.pk), sender=Book, weak=False,
+                          dispatch_uid='test_duplicate_books')
+        try:
+            book, created = Book.get_or_create_from_metadata(isbn_13, metadata)
+        finally:
+            post_save.disconnect(sender=Book, dispatch_uid='test_duplicate_books')
+        self.assertTrue(created)
+        self.assertEquals(saved, [book.pk])
+        self.assertEquals(list(Book.search("autore comune")[0:10]), [book])
+        self.assertTrue(BackgroundJob.objects.filter(kind=BackgroundJob.BOOK_COVER, key=str(book.pk)).exists())
+        self.assertEquals(Book.get_or_create_from_metadata(isbn_13, metadata), (book, False))
+        self.assertEquals(Book.bulk_import({isbn_13: metadata}), 0)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Book.objects.create(title="Duplicato", isbn_10=isbnlib.to_isbn10(isbn_13), isbn_13="")
+        self.assertEquals(Book.objects.count(), 1)
+
+    def test_ajax_search_existing_book(self):
+        """
+        Test della ricerca AJAX di un libro già presente, inserito con il solo codice isbn_13.
+        """
+        book = Book.objects.create(title="Il nome della rosa", isbn_10="", isbn_13="9788845292613")
+        get_user_model().objects.create_user('john', 'lennon@thebeatles.com', 'johnpassword')
+        client = Client()
+        client.login(username='john', password='johnpassword')
+
+        response = client.get(reverse('book_management:ajax-search-book'), {'isbn_code': '88-452-9261-4'})
+        self.assertEquals(response.json(), {'found': False, 'already_exists': True, 'book_pk': book.pk})
+
+
+class MediaStoreTest(TestCase):
+    """
+    Test dell'archivio dei file indirizzato per contenuto e del conteggio dei riferimenti.
+    """
+
+    def setUp(self):
+        """
+        Setup di un ambiente di test: cartella media temporanea e un utente.
+        """
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root.name)
+        self.settings_override.enable()
+        self.user = get_user_model().objects.create_user('john', 'lennon@thebeatles.com', 'johnpassword')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_root.cleanup()
+
+    def create_book(self, number):
+        book = Book.objects.create(title="Libro %d" % number, isbn_10="", isbn_13=make_isbn_13(number))
+        book.cover_image_file.save("book_%d.png" % number, ContentFile(THUMBNAIL))
+        return book
+
+    def test_deduplication(self):
+        """
+        Test della memorizzazione unica di copertine identiche e del contatore dei riferimenti.
+        """
+        books = [self.create_book(i) for i in range(2)]
+        name = books[0].cover_image_file.name
+        self.assertEquals(books[1].cover_image_file.name, name)
+        self.assertTrue(name.startswith('cas/') and name.endswith('.png'))
+        self.assertEquals(StoredFile.objects.get(name=name).reference_count, 2)
+
+        book = Book.objects.get(pk=books[0].pk)
+        book.title = "Titolo modificato"
+        with CaptureQueriesContext(connection) as queries:
+            book.save()
+        self.assertFalse([query for query in queries if 'SELECT "book_management_book"."cover_image_file"'
+                          in query['sql']])
+
+        books[0].delete()
+        self.assertEquals(StoredFile.objects.get(name=name).reference_count, 1)
+        self.assertEquals(StoredFile.collect(grace_period=0), [])
+
+        books[1].cover_image_file = Book._meta.get_field('cover_image_file').get_default()
+        books[1].save()
+        self.assertEquals(StoredFile.objects.get(name=name).reference_count, 0)
+        self.assertEquals(StoredFile.collect(grace_period=0), [name])
+        self.assertFalse(os.path.exists(os.path.join(self.media_root.name, name)))
+
+    def test_profile_picture(self):
+        """
+        Test dell'elaborazione in background dell'immagine del profilo, caricata con un'unica scrittura nel
+        database, e della ricostruzione dei contatori.
+        """
+        profile = Profile.objects.create(first_name="John", last_name="Lennon", user=self.user)
+        default_picture = profile.picture.name
+        image = BytesIO()
+        Image.new('RGB', (1600, 1200)).save(image, 'JPEG')
+
+        profile = Profile.objects.get(pk=profile.pk)
+        profile.picture = SimpleUploadedFile('john.jpg', image.getvalue())
+        with CaptureQueriesContext(connection) as queries:
+            profile.save()
+        writes = [query['sql'] for query in queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE', 'REPLACE'))]
+        self.assertEquals(len(writes), 1)
+        self.assertTrue(writes[0].startswith('UPDATE "user_management_profile"'))
+
+        uploaded = Profile.objects.get(pk=profile.pk).pending_picture
+        self.assertTrue(content_storage.exists(uploaded))
+        self.assertEquals(Profile.objects.get(pk=profile.pk).picture.name, default_picture)
+
+        self.assertEquals(jobs.run_pending(), (1, 0))
+        profile.refresh_from_db()
+        self.assertIsNone(profile.pending_picture)
+        with profile.picture.open('rb') as picture:
+            self.assertEquals(Image.open(picture).size, (300, 300))
+        self.assertEquals(profile.picture_variants, [64, 128])
+        self.assertIn("-64.webp 64w", profile.picture_srcset['webp'])
+        self.assertFalse(StoredFile.objects.filter(name=uploaded).exists())
+        self.assertEquals(StoredFile.objects.get(name=profile.picture.name).reference_count, 1)
+        self.assertEquals(jobs.run_pending(), (0, 0))
+
+        profile.picture = SimpleUploadedFile('john.jpg', image.getvalue())
+        profile.save()
+        self.assertEquals(jobs.run_pending(), (1, 0))
+        self.assertEquals(BackgroundJob.objects.get(kind=BackgroundJob.PROFILE_PICTURE).attempts, 0)
+        self.assertEquals(Profile.objects.get(pk=profile.pk).pending_picture, None)
+
+        StoredFile.objects.update(reference_count=5)
+        self.assertEquals(StoredFile.rebuild(), 1)
+        self.assertEquals(StoredFile.objects.get(name=profile.picture.name).reference_count, 1)
+        self.assertEquals(StoredFile.collect(grace_period=-1), [uploaded])
+
+    def test_orphans_and_cache_headers(self):
+        """
+        Test dell'eliminazione dei file mai registrati e degli header di cache dei file serviti.
+        """
+        book = self.create_book(1)
+        orphan = content_storage.save("orfano.png", ContentFile(b"file orfano"))
+        self.assertEquals(StoredFile.collect(grace_period=60), [])
+        self.assertEquals(StoredFile.collect(grace_period=0), [orphan])
+
+        path = book.cover_image_file.name[len(CONTENT_ADDRESSED_PREFIX):]
+        response = content_addressed_media(RequestFactory().get(book.cover_image_file.url), path)
+        self.assertEquals(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEquals(b"".join(response.streaming_content), THUMBNAIL)
@@ -0,0 +1,52 @@
+import logging
+from io import BytesIO
+
+from PIL import Image
+from django.core.files.base import ContentFile
+
+from books_base_folder.storage import content_storage, derivative_name
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_FORMATS = [
+    ('webp', 'WEBP', 'image/webp'),
+    ('jpg', 'JPEG', 'image/jpeg'),
+]
+
+
+def thumbnail_name(name, width, extension):
+    """
+    :param name: Nome della copertina originale nell'archivio.
+    :return: Nome della miniatura larga width pixel nel formato indicato dall'estensione.
+    """
+    return derivative_name(name, width, extension)
+
+
+def create_thumbnails(name, sizes):
+    """
+    Crea le miniature della copertina in tutti i formati di THUMBNAIL_FORMATS. Le immagini non vengono mai
+    ingrandite: vengono create solo le larghezze minori di quella dell'originale, più una miniatura alla
+    larghezza originale se questa è minore della più piccola richiesta.
+    :param name: Nome della copertina originale nell'archivio.
+    :param sizes: Larghezze delle miniature in pixel.
+    :return: Larghezze delle miniature create, in ordine crescente. Lista vuota se il file non è un'immagine.
+    """
+    with content_storage.open(name) as file:
+        try:
+            image = Image.open(file)
+            image.load()
+        except IOError:
+            logger.warning("La copertina %s non è un'immagine valida.", name)
+            return []
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    widths = sorted({min(size, image.width) for size in sizes})
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        thumbnail = image.resize((width, height), Image.LANCZOS) if width < image.width else image
+        for extension, image_format, _ in THUMBNAIL_FORMATS:
+            output = BytesIO()
+            thumbnail.save(output, format=image_format, quality=80)
+            content_storage.save_derivative(thumbnail_name(name, width, extension), ContentFile(output.getvalue()))
+    return widths
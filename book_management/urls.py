@@ -6,4 +6,5 @@ app_name = 'book_management'
 urlpatterns = [
     path('new', views.NewBookView.as_view(), name='new-book'),
     path('ajax-search-book', views.ajax_search_book, name='ajax-search-book'),
+    path('isbn-thumbnail/<str:isbn>', views.isbn_thumbnail, name='isbn-thumbnail'),
 ]
\ No newline at end of file
@@ -1,16 +1,16 @@
-import urllib
+from io import BytesIO
 
-import isbnlib
+from PIL import Image
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import JsonResponse, HttpResponseServerError
-from django.urls import reverse_lazy
+from django.http import JsonResponse, HttpResponseServerError, HttpResponse, Http404
+from django.urls import reverse_lazy, reverse
 from django.views.generic import FormView
 
-from isbnlib import NotValidISBNError
-from googletrans import LANGUAGES
 from book_management.forms import NewBookCrispyForm
-from book_management.models import Book, Author
+from book_management.isbn import normalize_isbn, language_name
+from book_management.models import Book, IsbnMetadata
 
 
 class BookData:
@@ -23,34 +23,22 @@ class BookData:
 
     def __init__(self, isbn):
         """
-        Inizializza i metadati del libro a partire dal suo isbn.
+        Inizializza i metadati del libro a partire dal suo isbn, letti dalla cache locale dei metadati.
         :param isbn: codice isbn_10 o isbn_13 del libro
         """
         self.isbn = isbn
-        try:
-            self.book = isbnlib.meta(isbn)
-        except NotValidISBNError:
-            self.metadata = {'found': False}
+        self.book = IsbnMetadata.lookup(isbn)
 
         if self.book:
-            language = LANGUAGES[self.book['Language']]
-
-            image_url = ""
-            has_cover_image = False
-            book_cover = isbnlib.cover(self.isbn)
-            if book_cover:
-                image_url = book_cover['thumbnail']
-                has_cover_image = True
-
             self.metadata = {
                 'found': True,
-                'has_cover_image': has_cover_image,
-                'title': self.book['Title'],
-                'authors': self.book['Authors'],
-                'publisher': self.book['Publisher'],
-                'year': self.book['Year'],
-                'language': language,
-                'image_url': image_url,
+                'has_cover_image': bool(self.book['image_url']),
+                'title': self.book['title'],
+                'authors': self.book['authors'],
+                'publisher': self.book['publisher'],
+                'year': self.book['year'],
+                'language': language_name(self.book['language']),
+                'image_url': self.book['image_url'],
             }
         else:
             self.metadata = {'found': False}
@@ -71,11 +59,12 @@ def ajax_search_book(request):
     """
     isbn = request.GET.get('isbn_code')
 
-    if Book.objects.filter(isbn_10=isbnlib.to_isbn10(isbn)).exists():
+    existing_book = Book.get_by_isbn(isbn)
+    if existing_book is not None:
         data = {
             'found': False,
             'already_exists': True,
-            'book_pk': Book.objects.get(isbn_10=isbnlib.to_isbn10(isbn)).pk,
+            'book_pk': existing_book.pk,
         }
         return JsonResponse(data)
 
@@ -83,12 +72,14 @@ def ajax_search_book(request):
     book_metadata = book.get_metadata()
 
     if book_metadata['found']:
-        if book_metadata['has_cover_image']:
-            urllib.request.urlretrieve(book_metadata['image_url'], 'static/img/book.jpeg')
+        cover_url = book_metadata['image_url']
+        if IsbnMetadata.get_thumbnail(isbn, book_metadata['image_url']) is not None:
+            cover_url = reverse('book_management:isbn-thumbnail', kwargs={'isbn': normalize_isbn(isbn)})
 
         data = {
             'found': True,
             'has_cover_image': book_metadata['has_cover_image'],
+            'book_cover_url': cover_url,
             'book_title': book_metadata['title'] if book_metadata['title'] else "-",
             'book_authors': book_metadata['authors'] if book_metadata['authors'] else "-",
             'book_publisher': book_metadata['publisher'] if book_metadata['publisher'] else "-",
@@ -102,6 +93,29 @@ def ajax_search_book(request):
     return JsonResponse(data)
 
 
+@login_required
+def isbn_thumbnail(request, isbn):
+    """
+    Restituisce la miniatura della copertina scaricata durante la ricerca dei metadati del libro, così che la pagina
+    di inserimento non debba scaricarla di nuovo.
+    :param request: Richiesta HTTP.
+    :param isbn: codice isbn_13 del libro.
+    :return: Immagine della copertina.
+    """
+    thumbnail = IsbnMetadata.get_thumbnail(isbn)
+    if thumbnail is None:
+        raise Http404
+
+    try:
+        content_type = Image.MIME[Image.open(BytesIO(thumbnail)).format]
+    except (IOError, KeyError):
+        content_type = 'application/octet-stream'
+
+    response = HttpResponse(thumbnail, content_type=content_type)
+    response['Cache-Control'] = 'private, max-age=%d' % settings.ISBN_METADATA_TTL
+    return response
+
+
 class NewBookView(LoginRequiredMixin, FormView):
     """
     View per l'inserimento di un nuovo libro.
@@ -124,24 +138,8 @@ class NewBookView(LoginRequiredMixin, FormView):
         book_metadata = book_data.get_metadata()
 
         if book_metadata['found']:
-            if not Book.objects.filter(isbn_10=isbnlib.to_isbn10(isbn)).exists():
-                self.book = Book(title=book_metadata['title'],
-                                 publisher=book_metadata['publisher'],
-                                 year=book_metadata['year'],
-                                 language=book_metadata['language'],
-                                 cover_image_url=book_metadata['image_url'],
-                                 isbn_10=isbnlib.to_isbn10(isbn),
-                                 isbn_13=isbnlib.to_isbn13(isbn))
-                self.book.save()
-
-                for author in book_metadata['authors']:
-                    if Author.objects.filter(name=author).exists():
-                        a = Author.objects.get(name=author)
-                    else:
-                        a = Author(name=author)
-                        a.save()
-                    self.book.authors.add(a)
-            else:
+            self.book, created = Book.get_or_create_from_metadata(normalize_isbn(isbn), book_data.book)
+            if not created:
                 return HttpResponseServerError()
         else:
             return HttpResponseServerError()
@@ -0,0 +1,95 @@
+import math
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache, DEFAULT_CACHE_ALIAS
+from django.core.checks import register, Tags, Warning
+from django.db import transaction
+
+# Backend di cache privati di ciascun processo: una versione assegnata in un worker non sarebbe vista dagli altri.
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+class FragmentVersions(object):
+    """
+    Versioni, memorizzate in cache, degli oggetti che compaiono in frammenti di template salvati in cache.
+    La versione di un oggetto fa parte della chiave dei frammenti che lo mostrano: quando l'oggetto cambia
+    (tramite signals) riceve una nuova versione, e i frammenti precedenti non vengono più letti e scadono da soli.
+    Una versione rimossa dalla cache viene sostituita da una nuova, quindi non può mai far leggere un frammento
+    non aggiornato.
+    Le versioni devono stare in una cache condivisa da tutti i processi (vedi CACHES e check_shared_cache): con
+    una cache per processo le modifiche fatte in un worker non invaliderebbero i frammenti degli altri.
+    Ogni versione contiene l'istante in cui è stata creata: per REPLICA_MAX_LAG secondi le repliche possono non
+    contenere ancora la modifica che l'ha creata, e i frammenti con quella versione non vanno riempiti con dati letti
+    dalle repliche (vedi is_recent).
+    """
+
+    def __init__(self, namespace):
+        """
+        :param namespace: Prefisso delle chiavi in cache, distinto per ciascun tipo di oggetto.
+        """
+        self.namespace = namespace
+
+    def key(self, pk):
+        return 'fragment_version:%s:%s' % (self.namespace, pk)
+
+    @staticmethod
+    def new_version():
+        # L'istante viene arrotondato per eccesso, così che una versione non risulti mai più vecchia del vero.
+        return '%x.%s' % (math.ceil(time.time()), uuid.uuid4().hex[:8])
+
+    @staticmethod
+    def is_recent(version):
+        """
+        :return: True se la versione è stata creata negli ultimi REPLICA_MAX_LAG secondi, cioè se le repliche possono
+            non contenere ancora la modifica che l'ha creata.
+        """
+        created = int(version.split('.')[0], 16)
+        return created >= time.time() - settings.REPLICA_MAX_LAG
+
+    def get_many(self, pks):
+        """
+        Legge con un'unica richiesta alla cache le versioni di più oggetti, creando quelle mancanti.
+        :param pks: pk degli oggetti.
+        :return: Dizionario pk -> versione.
+        """
+        keys = {self.key(pk): pk for pk in pks}
+        versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+
+        missing = {key: self.new_version() for key, pk in keys.items() if pk not in versions}
+        if missing:
+            cache.set_many(missing, None)
+            versions.update({keys[key]: version for key, version in missing.items()})
+        return versions
+
+    def touch(self, pk):
+        """
+        Assegna una nuova versione all'oggetto, invalidando i frammenti che lo mostrano, subito e di nuovo al termine
+        della transazione corrente, così che un frammento con i dati precedenti alla modifica, salvato da una
+        richiesta concorrente, non venga più letto.
+        """
+        key = self.key(pk)
+        cache.set(key, self.new_version(), None)
+        transaction.on_commit(lambda: cache.set(key, self.new_version(), None))
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Controllo di deploy (check --deploy): la cache predefinita deve essere condivisa tra i processi, perché versioni
+    dei frammenti e riepiloghi dei bookshelf vengono invalidati solo nella cache del processo che esegue la modifica.
+    """
+    backend = settings.CACHES.get(DEFAULT_CACHE_ALIAS, {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Warning(
+            "La cache '%s' usa %s, privata di ciascun processo." % (DEFAULT_CACHE_ALIAS, backend),
+            hint="Configura in CACHES una cache condivisa (su file, database o memcached): con più worker le "
+                 "invalidazioni delle card dei topic e dei riepiloghi dei bookshelf non raggiungono gli altri "
+                 "processi.",
+            id='books_base_folder.W001',
+        )]
+    return []
@@ -0,0 +1,208 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections, DatabaseError
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+slow_queries_logger = logging.getLogger('books_base_folder.slow_queries')
+
+FINGERPRINT_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+FINGERPRINT_LISTS = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+FINGERPRINT_SPACES = re.compile(r"\s+")
+EXPLAINABLE_QUERIES = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+
+# Piani di esecuzione già calcolati dal processo, per impronta: il piano di una stessa forma di query non cambia da
+# una richiesta all'altra, e una query lenta eseguita spesso non deve essere spiegata ogni volta.
+EXPLAIN_CACHE_SIZE = 1000
+explained_plans = {}
+
+
+def fingerprint(sql):
+    """
+    Impronta di una query: il testo SQL senza valori letterali e con le liste IN ridotte a un solo elemento, così
+    che la stessa query eseguita con parametri diversi (ad esempio una volta per ogni oggetto di una lista) abbia
+    sempre la stessa impronta.
+    :param sql: Testo della query, con i parametri indicati da %s.
+    :return: Impronta della query.
+    """
+    sql = FINGERPRINT_LITERALS.sub('%s', sql)
+    sql = FINGERPRINT_LISTS.sub('(%s, ...)', sql)
+    return FINGERPRINT_SPACES.sub(' ', sql).strip()
+
+
+def explain(connection, sql, params):
+    """
+    :param connection: Connessione al database su cui è stata eseguita la query.
+    :return: Righe del piano di esecuzione della query (EXPLAIN QUERY PLAN su SQLite), o None se la query non può
+        essere spiegata.
+    """
+    if not EXPLAINABLE_QUERIES.match(sql):
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("%s %s" % (connection.ops.explain_query_prefix(), sql), params)
+            return [str(row[-1]) for row in cursor.fetchall()]
+    except DatabaseError:
+        return None
+
+
+def log_slow_queries(view_name, slow_queries):
+    """
+    Scrive nel log books_base_folder.slow_queries (SLOW_QUERY_LOG_FILE) una riga JSON per ogni query lenta, con la
+    sua impronta, la view che l'ha eseguita e il piano di esecuzione. Il comando slow_query_report aggrega il log.
+    :param slow_queries: Lista delle query lente registrate da QueryRecorder.
+    """
+    for alias, sql, params, many, duration in slow_queries:
+        sql_fingerprint = fingerprint(sql)
+        if sql_fingerprint not in explained_plans:
+            if len(explained_plans) >= EXPLAIN_CACHE_SIZE:
+                explained_plans.clear()
+            explained_plans[sql_fingerprint] = None if many else explain(connections[alias], sql, params)
+
+        slow_queries_logger.warning(json.dumps({
+            'date': timezone.now().isoformat(timespec='seconds'),
+            'view': view_name,
+            'duration': duration * 1000,
+            'fingerprint': sql_fingerprint,
+            'sql': sql,
+            'plan': explained_plans[sql_fingerprint],
+        }))
+
+
+class QueryRecorder(object):
+    """
+    Context manager che registra le query eseguite su tutte le connessioni al database, con la loro durata.
+    Usato dal middleware QueryInstrumentationMiddleware per ogni richiesta e da QueryBudgetMixin nei test.
+    """
+
+    def __init__(self, slow_threshold=None):
+        """
+        :param slow_threshold: Durata (in millisecondi) oltre la quale una query viene registrata, con i suoi
+            parametri, tra le query lente (slow). Se None le query lente non vengono registrate.
+        """
+        self.queries = []
+        self.slow = []
+        self.slow_threshold = slow_threshold
+        self.stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries.append((sql, duration))
+            if self.slow_threshold is not None and duration * 1000 >= self.slow_threshold:
+                self.slow.append((context['connection'].alias, sql, params, many, duration))
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.close()
+
+    @property
+    def count(self):
+        """
+        :return: Numero di query eseguite.
+        """
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        """
+        :return: Tempo totale (in millisecondi) trascorso nel database.
+        """
+        return sum(duration for _, duration in self.queries) * 1000
+
+    @property
+    def duplicates(self):
+        """
+        :return: Lista delle coppie (impronta, numero di esecuzioni) delle query eseguite più di una volta, a partire
+            dalla più ripetuta: sono le candidate a N+1.
+        """
+        counts = Counter(fingerprint(sql) for sql, _ in self.queries)
+        return [(sql, count) for sql, count in counts.most_common() if count > 1]
+
+    @property
+    def duplicates_count(self):
+        """
+        :return: Numero di esecuzioni ripetute (oltre la prima) di una stessa query.
+        """
+        return sum(count - 1 for _, count in self.duplicates)
+
+    def report(self, limit=None):
+        """
+        :param limit: Numero massimo di query ripetute da elencare.
+        :return: Riepilogo testuale: numero di query, tempo nel database e query ripetute.
+        """
+        lines = ["%d query, %.1f ms, %d ripetute" % (self.count, self.duration, self.duplicates_count)]
+        lines += ["  %dx %s" % (count, sql) for sql, count in self.duplicates[:limit]]
+        return "\n".join(lines)
+
+
+class QueryInstrumentationMiddleware(object):
+    """
+    Middleware che misura, per ogni richiesta, numero di query, tempo nel database e query ripetute.
+    In modalità debug le misure vengono restituite negli header X-Query-Count, X-Query-Time e X-Duplicate-Queries
+    della risposta. Con QUERY_INSTRUMENTATION vengono scritte nel log books_base_folder.instrumentation indicando il
+    nome dell'URL della view (ad esempio user_management:bookshelf), così che le misure possano essere raggruppate
+    per view.
+    Le query più lente di SLOW_QUERY_THRESHOLD vengono scritte, con il loro piano di esecuzione, nel log delle query
+    lente (vedi log_slow_queries), anche fuori dalla modalità debug e senza QUERY_INSTRUMENTATION: il piano viene
+    calcolato dopo la risposta, fuori dalla misura della richiesta.
+    Non viene usato se header, log e log delle query lente sono tutti disattivati.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DEBUG and not settings.QUERY_INSTRUMENTATION and settings.SLOW_QUERY_THRESHOLD is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder(settings.SLOW_QUERY_THRESHOLD) as recorder:
+            response = self.get_response(request)
+
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        if settings.QUERY_INSTRUMENTATION:
+            logger.info("%s %s: %s", request.method, view_name or request.path,
+                        recorder.report(settings.QUERY_INSTRUMENTATION_DUPLICATES_LIMIT))
+        if recorder.slow:
+            log_slow_queries(view_name or request.path, recorder.slow)
+
+        if settings.DEBUG:
+            response['X-Query-Count'] = recorder.count
+            response['X-Query-Time'] = "%.1f" % recorder.duration
+            response['X-Duplicate-Queries'] = recorder.duplicates_count
+        return response
+
+
+class QueryBudgetMixin(object):
+    """
+    Mixin per i TestCase che verifica il numero massimo di query eseguite da una richiesta. In caso di errore il
+    messaggio elenca le query ripetute, così da individuare subito l'N+1 che ha superato il limite.
+    """
+
+    def assertQueryBudget(self, budget, url, method='get', **kwargs):
+        """
+        Esegue la richiesta con il client del test e verifica che non esegua più di budget query.
+        :param budget: Numero massimo di query.
+        :param url: URL della richiesta.
+        :param method: Metodo del client di test da usare (get, post, ...).
+        :return: Risposta alla richiesta.
+        """
+        with QueryRecorder() as recorder:
+            response = getattr(self.client, method)(url, **kwargs)
+
+        self.assertLessEqual(recorder.count, budget, "Budget di query superato per %s: %s" % (url, recorder.report()))
+        return response
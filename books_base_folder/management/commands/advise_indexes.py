@@ -0,0 +1,279 @@
+import json
+import os
+import re
+import tempfile
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, models, DatabaseError, DEFAULT_DB_ALIAS, migrations
+from django.db.migrations.autodetector import MigrationAutodetector
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+
+from books_base_folder.instrumentation import fingerprint, explain
+from books_base_folder.sqlite_backend.backup import backup_database
+
+# Indici candidati valutati se non ne vengono indicati altri con --candidate: filtri e ordinamenti più frequenti
+# delle pagine principali, in forma composta e, dove la query legge solo poche colonne, coprente.
+DEFAULT_CANDIDATES = [
+    'user_management.ProfileBook:profile_owner,status',
+    'user_management.ProfileBook:profile_owner,status,book',
+    'user_management.FollowRelation:user_following,starting_follow_date_time',
+    'user_management.FollowRelation:profile_followed,starting_follow_date_time',
+    'comment_management.Topic:user_owner,-id',
+    'comment_management.Topic:book,-id',
+    'comment_management.Like:topic,user_owner',
+    'comment_management.Comment:user_owner,creation_date_time',
+]
+
+
+def parse_candidate(candidate):
+    """
+    :param candidate: Indice nella forma app_label.Model:campo,-campo,... (il segno meno indica ordine decrescente).
+    :return: Coppia (modello, indice), con il nome generato come farebbe Django.
+    """
+    try:
+        model_name, fields = candidate.split(':')
+        model = apps.get_model(model_name)
+    except (ValueError, LookupError):
+        raise CommandError("Indice candidato non valido: %s." % candidate)
+    index = models.Index(fields=fields.split(','))
+    index.set_name_with_model(model)
+    return model, index
+
+
+class Workload(object):
+    """
+    Carico di lavoro registrato da run_bench --capture, rieseguito su una copia del database. Le query sono
+    raggruppate per impronta, così che l'effetto di un indice possa essere misurato solo sulle forme di query che
+    lo usano.
+    """
+
+    def __init__(self, queries):
+        """
+        :param queries: Lista delle query (SQL, parametri, executemany).
+        """
+        self.shapes = {}
+        for sql, params, many in queries:
+            self.shapes.setdefault(fingerprint(sql), []).append((sql, params, many))
+
+    @staticmethod
+    def load(path):
+        with open(path) as file:
+            records = [json.loads(line) for line in file if line.strip()]
+        return Workload([(record['sql'], record['params'], record['many']) for record in records])
+
+    @property
+    def count(self):
+        return sum(len(queries) for queries in self.shapes.values())
+
+    def replay(self, database, repeat, shapes=None):
+        """
+        Esegue le query del carico, raggruppate per impronta, in una transazione annullata al termine così che le
+        scritture non modifichino la copia, repeat volte. Le impronte con query che falliscono (ad esempio
+        inserimenti già presenti nella copia) vengono escluse dal carico.
+        :param database: Connessione al database su cui eseguire le query.
+        :param shapes: Impronte da eseguire (tutte se None).
+        :return: Dizionario dei tempi (in millisecondi) per impronta, il minimo tra le ripetizioni.
+        """
+        shapes = list(self.shapes) if shapes is None else shapes
+        timings = {}
+        for _ in range(repeat):
+            failed = set()
+            database.set_autocommit(False)
+            try:
+                with database.cursor() as cursor:
+                    for shape in shapes:
+                        start = time.perf_counter()
+                        try:
+                            for sql, params, many in self.shapes[shape]:
+                                if many:
+                                    cursor.executemany(sql, params)
+                                else:
+                                    cursor.execute(sql, params)
+                                    cursor.fetchall()
+                        except DatabaseError:
+                            failed.add(shape)
+                            continue
+                        elapsed = (time.perf_counter() - start) * 1000
+                        timings[shape] = min(timings.get(shape, elapsed), elapsed)
+            finally:
+                database.rollback()
+                database.set_autocommit(True)
+
+            if failed:
+                for shape in failed:
+                    del self.shapes[shape]
+                return self.replay(database, repeat, [shape for shape in shapes if shape not in failed])
+        return timings
+
+    def plans(self, database):
+        """
+        :return: Dizionario dei piani di esecuzione per impronta, calcolati sulla prima query di ciascuna.
+        """
+        plans = {}
+        for shape, queries in self.shapes.items():
+            sql, params, many = queries[0]
+            plans[shape] = None if many else explain(database, sql, params)
+        return plans
+
+    def writes(self, table):
+        """
+        :return: Impronte delle scritture sulla tabella, rallentate da ogni indice aggiunto alla tabella.
+        """
+        pattern = re.compile(r'^\s*(INSERT INTO|UPDATE|DELETE FROM) "%s"' % re.escape(table), re.IGNORECASE)
+        return [shape for shape in self.shapes if pattern.match(shape)]
+
+
+class Command(BaseCommand):
+    """
+    Consigliere di indici: riesegue un carico di lavoro registrato (run_bench --capture) su una copia del database,
+    con e senza ciascun indice candidato, composto o coprente. Gli indici che riducono di almeno --min-gain il tempo
+    delle query che li usano vengono poi misurati insieme sull'intero carico, e per quelli può essere generata una
+    migrazione (da riportare anche in Meta.indexes dei modelli).
+    Le scritture del carico sono comprese nella misura, così che un indice che rallenta gli inserimenti più di
+    quanto acceleri le letture non venga consigliato.
+    Supporta solo SQLite, di cui copia il database con l'API di backup.
+    """
+    help = "Misura l'effetto di indici candidati su un carico di lavoro registrato e genera la migrazione."
+
+    def add_arguments(self, parser):
+        parser.add_argument('workload', help="File JSON Lines con le query registrate da run_bench --capture.")
+        parser.add_argument('--candidate', action='append', dest='candidates',
+                            help="Indice candidato, nella forma app_label.Model:campo,-campo (ripetibile). "
+                                 "Se omesso vengono valutati gli indici candidati predefiniti.")
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="Esecuzioni del carico per ogni misura (viene considerata la più veloce).")
+        parser.add_argument('--min-gain', type=float, default=5,
+                            help="Riduzione percentuale minima del tempo delle query che usano l'indice perché "
+                                 "venga consigliato.")
+        parser.add_argument('--top', type=int, default=3, help="Impronte più accelerate mostrate per ogni indice.")
+        parser.add_argument('--write-migrations', action='store_true',
+                            help="Scrive una migrazione con gli indici consigliati per ciascuna app.")
+        parser.add_argument('--migrations-dir',
+                            help="Directory in cui scrivere le migrazioni (predefinita: quella di ciascuna app).")
+
+    def handle(self, *args, **options):
+        if connections[DEFAULT_DB_ALIAS].vendor != 'sqlite':
+            raise CommandError("advise_indexes supporta solo SQLite.")
+
+        workload = Workload.load(options['workload'])
+        candidates = [parse_candidate(candidate) for candidate in options['candidates'] or DEFAULT_CANDIDATES]
+        if not workload.shapes:
+            raise CommandError("Il carico di lavoro è vuoto.")
+
+        with tempfile.TemporaryDirectory() as directory:
+            database = self.copy_database(os.path.join(directory, 'advisor.sqlite3'))
+            try:
+                winners = self.evaluate(database, workload, candidates, options)
+            finally:
+                database.close()
+
+        if winners and options['write_migrations']:
+            self.write_migrations(winners, options['migrations_dir'])
+
+    def evaluate(self, database, workload, candidates, options):
+        """
+        Misura ciascun indice candidato sulle sole impronte il cui piano di esecuzione cambia con l'indice e sulle
+        scritture della sua tabella, eseguite con e senza l'indice: le altre query non ne sono influenzate e ne
+        coprirebbero l'effetto con la loro variabilità.
+        :return: Lista delle coppie (modello, indice) consigliate.
+        """
+        total = sum(workload.replay(database, options['repeat']).values())
+        self.stdout.write("Carico di lavoro: %d query in %d impronte, %.1f ms senza indici aggiuntivi." %
+                          (workload.count, len(workload.shapes), total))
+        plans = workload.plans(database)
+
+        winners = []
+        for model, index in candidates:
+            label = "%s(%s)" % (model._meta.label, ", ".join(index.fields))
+            if index.fields in [declared.fields for declared in model._meta.indexes]:
+                self.stdout.write("     -   %s: già presente in Meta.indexes" % label)
+                continue
+            if not self.create_index(database, model, index):
+                continue
+            affected = [shape for shape, plan in workload.plans(database).items() if plan != plans.get(shape)]
+            affected += [shape for shape in workload.writes(model._meta.db_table) if shape not in affected]
+            if not affected:
+                self.drop_index(database, index)
+                self.stdout.write("     -   %s: non usato dal carico di lavoro" % label)
+                continue
+
+            with_index = workload.replay(database, options['repeat'], affected)
+            self.drop_index(database, index)
+            without_index = workload.replay(database, options['repeat'], with_index)
+            before, after = sum(without_index.values()), sum(with_index.values())
+
+            gain = (before - after) / before * 100 if before else 0
+            recommended = gain >= options['min_gain']
+            style = self.style.SUCCESS if recommended else self.style.NOTICE
+            self.stdout.write(style("%+6.1f%%  %s: %d impronte, da %.1f a %.1f ms (%.1f%% del carico)" %
+                                    (-gain, label, len(with_index), before, after, (before - after) / total * 100)))
+            savings = sorted(((without_index[shape] - with_index[shape], shape) for shape in with_index),
+                             reverse=True)
+            for saving, shape in savings[:options['top']]:
+                self.stdout.write("         %+.1f ms  %s" % (-saving, shape))
+            if recommended:
+                winners.append((model, index))
+
+        if winners:
+            for model, index in winners:
+                self.create_index(database, model, index)
+            combined = sum(workload.replay(database, options['repeat'], list(workload.shapes)).values())
+            self.stdout.write(self.style.SUCCESS("Carico di lavoro con gli indici consigliati: %.1f ms (%+.1f%%)." %
+                                                 (combined, (combined - total) / total * 100)))
+        else:
+            self.stdout.write("Nessun indice consigliato.")
+        return winners
+
+    @staticmethod
+    def copy_database(path):
+        """
+        Copia il database in path.
+        :return: Connessione alla copia, con lo stesso backend (e quindi le stesse funzioni SQL) del database.
+        """
+        connection = connections[DEFAULT_DB_ALIAS]
+        backup_database(connection, path)
+        return type(connection)(dict(connection.settings_dict, NAME=path), alias='index_advisor')
+
+    def create_index(self, database, model, index):
+        """
+        Crea l'indice sulla copia del database.
+        :return: True se l'indice è stato creato.
+        """
+        try:
+            with database.cursor() as cursor:
+                cursor.execute(str(index.create_sql(model, database.schema_editor(collect_sql=True))))
+        except DatabaseError as error:
+            self.stderr.write("Impossibile creare %s: %s" % (index.name, error))
+            return False
+        return True
+
+    @staticmethod
+    def drop_index(database, index):
+        with database.cursor() as cursor:
+            cursor.execute("DROP INDEX %s" % database.ops.quote_name(index.name))
+
+    def write_migrations(self, winners, directory):
+        """
+        Scrive, per ogni app, una migrazione che aggiunge gli indici consigliati, dipendente dall'ultima migrazione
+        dell'app.
+        """
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        by_app = {}
+        for model, index in winners:
+            by_app.setdefault(model._meta.app_label, []).append(migrations.AddIndex(model._meta.model_name, index))
+
+        for app_label, operations in by_app.items():
+            leaves = loader.graph.leaf_nodes(app_label)
+            number = max((MigrationAutodetector.parse_number(name) or 0 for _, name in leaves), default=0) + 1
+            migration = migrations.Migration('%04d_advised_indexes' % number, app_label)
+            migration.operations = operations
+            migration.dependencies = leaves
+
+            writer = MigrationWriter(migration)
+            path = writer.path if directory is None else os.path.join(directory, writer.filename)
+            with open(path, 'w') as file:
+                file.write(writer.as_string())
+            self.stdout.write(self.style.SUCCESS("Migrazione scritta in %s." % path))
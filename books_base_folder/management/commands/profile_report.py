@@ -0,0 +1,57 @@
+import os
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books_base_folder.profiling import ViewProfile, make_token
+
+
+class Command(BaseCommand):
+    """
+    Report dei profili delle richieste raccolti da ProfilingMiddleware, aggregati per nome dell'URL.
+    """
+    help = "Elenca le funzioni più costose di ogni view profilata ed esporta gli stack per i flame graph."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view', help="Nome dell'URL della view (ad esempio user_management:bookshelf).")
+        parser.add_argument('--limit', type=int, default=15, help="Numero di funzioni elencate per view.")
+        parser.add_argument('--collapsed', metavar='DIRECTORY',
+                            help="Esporta in DIRECTORY un file di stack in formato collapsed per ogni view, "
+                                 "da convertire in flame graph con flamegraph.pl o speedscope.")
+        parser.add_argument('--token', action='store_true',
+                            help="Stampa un valore firmato dell'header %s che richiede la profilazione della "
+                                 "richiesta." % settings.REQUEST_PROFILING_HEADER)
+        parser.add_argument('--clear', action='store_true', help="Elimina i profili raccolti.")
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write("%s: %s" % (settings.REQUEST_PROFILING_HEADER, make_token()))
+            return
+
+        if options['clear']:
+            shutil.rmtree(settings.REQUEST_PROFILING_DIR, ignore_errors=True)
+            self.stdout.write(self.style.SUCCESS("Profili eliminati."))
+            return
+
+        profiles = ViewProfile.load_all()
+        if options['view']:
+            profiles = [profile for profile in profiles if profile.view_name == options['view']]
+            if not profiles:
+                raise CommandError("Nessun profilo per la view %s." % options['view'])
+
+        for profile in sorted(profiles, key=lambda profile: profile.duration, reverse=True):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                "%s: %d richieste, durata media %.1f ms, %d campioni" %
+                (profile.view_name, profile.requests, profile.duration / profile.requests, profile.samples_count)))
+            for function, own, total in profile.hottest(options['limit']):
+                self.stdout.write("  %5.1f%% %5.1f%%  %s" % (own * 100 / profile.samples_count,
+                                                            total * 100 / profile.samples_count, function))
+
+        if options['collapsed']:
+            os.makedirs(options['collapsed'], exist_ok=True)
+            for profile in profiles:
+                path = os.path.join(options['collapsed'], "%s.collapsed" % profile.view_name.replace(':', '_'))
+                with open(path, 'w') as file:
+                    file.write(profile.collapsed())
+            self.stdout.write(self.style.SUCCESS("Stack esportati in %s." % options['collapsed']))
@@ -0,0 +1,224 @@
+import json
+import math
+import multiprocessing
+import random
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from book_management.models import Book
+from books_base_folder.instrumentation import QueryRecorder
+from comment_management.models import Topic
+from user_management.models import Profile
+
+
+def percentile(values, rank):
+    """
+    :return: Percentile rank (nearest-rank) dei valori, già ordinati.
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(rank / 100 * len(values)) - 1)]
+
+
+def run_requests(username, requests, warmup, capture=False):
+    """
+    Esegue le richieste con il client di test di Django, autenticato come username se indicato.
+    Le prime warmup richieste di ciascuna view vengono eseguite ma non misurate.
+    :param requests: Lista di coppie (nome dell'URL, URL).
+    :param capture: Se True vengono registrate anche tutte le query eseguite dalle richieste misurate, con i loro
+        parametri.
+    :return: Lista delle misure (nome dell'URL, status code, durata in millisecondi, numero di query) e lista delle
+        query registrate (nome dell'URL, SQL, parametri, executemany).
+    """
+    host = next((host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')), 'localhost')
+    client = Client(HTTP_HOST=host)
+    if username is not None:
+        client.force_login(get_user_model().objects.get(username=username))
+
+    warmed = {}
+    results = []
+    workload = []
+    for name, url in requests:
+        start = time.perf_counter()
+        # Con soglia nulla tutte le query vengono registrate come lente, quindi con i loro parametri.
+        with QueryRecorder(0 if capture else None) as recorder:
+            response = client.get(url)
+        duration = (time.perf_counter() - start) * 1000
+
+        if warmed.get(name, 0) < warmup:
+            warmed[name] = warmed.get(name, 0) + 1
+            continue
+        results.append((name, response.status_code, duration, recorder.count))
+        workload.extend((name, sql, params, many) for _, sql, params, many, _ in recorder.slow)
+    return results, workload
+
+
+def run_requests_process(username, requests, warmup, capture):
+    """
+    Esegue run_requests in un processo figlio, chiudendo al termine le sue connessioni al database.
+    """
+    try:
+        return run_requests(username, requests, warmup, capture)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    """
+    Benchmark delle pagine principali: le richieste vengono eseguite con il client di test di Django (senza server
+    HTTP) da più processi in parallelo, ciascuno autenticato come un utente diverso, su libri, topic e profili scelti
+    a caso tra quelli presenti (ad esempio generati con seed_bench).
+    Per ogni view vengono riportati i percentili 50, 95 e 99 della latenza e il numero medio di query; i risultati
+    possono essere salvati in JSON e confrontati con quelli di un'esecuzione precedente.
+    """
+    help = "Misura latenza e numero di query delle pagine principali."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help="Numero di richieste misurate per view.")
+        parser.add_argument('--processes', type=int, default=4, help="Numero di processi paralleli.")
+        parser.add_argument('--warmup', type=int, default=3,
+                            help="Richieste non misurate per view all'avvio di ciascun processo.")
+        parser.add_argument('--prefix', default='bench',
+                            help="Prefisso degli username con cui autenticarsi (vedi seed_bench).")
+        parser.add_argument('--anonymous', action='store_true', help="Esegue le richieste senza autenticazione.")
+        parser.add_argument('--seed', type=int, default=0, help="Seme del generatore casuale.")
+        parser.add_argument('--output', help="File JSON in cui salvare i risultati.")
+        parser.add_argument('--compare', help="File JSON di un'esecuzione precedente con cui confrontare i risultati.")
+        parser.add_argument('--capture',
+                            help="File JSON Lines in cui registrare tutte le query eseguite, con i loro parametri, "
+                                 "da usare come carico di lavoro di advise_indexes.")
+
+    def get_requests(self, rng, count):
+        """
+        :return: Lista di coppie (nome dell'URL, URL), count per ciascuna view.
+        """
+        books = list(Book.objects.values_list('pk', flat=True))
+        topics = list(Topic.objects.values_list('pk', flat=True))
+        profiles = list(Profile.objects.values_list('user_id', flat=True))
+        words = [title.split()[0] for title in Book.objects.values_list('title', flat=True)[:100] if title.split()]
+        if not books or not topics or not profiles or not words:
+            raise CommandError("Servono libri, topic e profili: eseguire prima seed_bench.")
+
+        views = {
+            'home': lambda: reverse('home'),
+            'view-public-book': lambda: reverse('view-public-book', kwargs={'pk': rng.choice(books)}),
+            'comment_management:view-topic':
+                lambda: reverse('comment_management:view-topic', kwargs={'pk': rng.choice(topics)}),
+            'user_management:view-profile':
+                lambda: reverse('user_management:view-profile', kwargs={'pk': rng.choice(profiles)}),
+            'user_management:bookshelf':
+                lambda: reverse('user_management:bookshelf', kwargs={'pk': rng.choice(profiles)}),
+            'search': lambda: "%s?search=%s" % (reverse('search'), rng.choice(words)),
+            'statistics': lambda: reverse('statistics'),
+        }
+        return [(name, url()) for name, url in views.items() for _ in range(count)]
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        processes = max(1, options['processes'])
+
+        requests = self.get_requests(rng, options['requests'])
+        rng.shuffle(requests)
+        warmup = [(name, url) for name, url in dict(requests).items()] * options['warmup']
+        chunks = [warmup + requests[i::processes] for i in range(processes)]
+
+        usernames = [None] * processes
+        if not options['anonymous']:
+            usernames = list(Profile.objects.filter(user__username__startswith='%s_' % options['prefix'])
+                             .values_list('user__username', flat=True)[:processes])
+            if not usernames:
+                raise CommandError("Nessun utente con prefisso '%s'." % options['prefix'])
+            usernames = [usernames[i % len(usernames)] for i in range(processes)]
+
+        start = time.perf_counter()
+        capture = bool(options['capture'])
+        arguments = [(username, chunk, options['warmup'], capture) for username, chunk in zip(usernames, chunks)]
+        if processes == 1:
+            results = [run_requests(*arguments[0])]
+        else:
+            # I processi figli non devono condividere le connessioni al database del processo principale.
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(processes) as pool:
+                results = pool.starmap(run_requests_process, arguments)
+        elapsed = time.perf_counter() - start
+
+        report = self.get_report([measure for measures, _ in results for measure in measures], options, elapsed)
+        self.print_report(report)
+
+        if capture:
+            with open(options['capture'], 'w') as file:
+                for _, workload in results:
+                    for name, sql, params, many in workload:
+                        file.write(json.dumps({'view': name, 'sql': sql, 'params': params, 'many': many},
+                                              default=str) + '\n')
+            self.stdout.write(self.style.SUCCESS("Query registrate in %s." % options['capture']))
+
+        if options['compare']:
+            with open(options['compare']) as file:
+                self.print_comparison(report, json.load(file))
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(self.style.SUCCESS("Risultati salvati in %s." % options['output']))
+
+    @staticmethod
+    def get_report(measures, options, elapsed):
+        """
+        :param measures: Lista delle misure (nome dell'URL, status code, durata in millisecondi, numero di query).
+        :return: Dizionario serializzabile in JSON con i parametri dell'esecuzione e le misure aggregate per view.
+        """
+        by_view = {}
+        for name, status, duration, queries in measures:
+            by_view.setdefault(name, []).append((status, duration, queries))
+
+        views = {}
+        for name, view_measures in sorted(by_view.items()):
+            durations = sorted(duration for _, duration, _ in view_measures)
+            queries = [count for _, _, count in view_measures]
+            views[name] = {
+                'requests': len(view_measures),
+                'errors': sum(1 for status, _, _ in view_measures if status >= 400),
+                'p50': percentile(durations, 50),
+                'p95': percentile(durations, 95),
+                'p99': percentile(durations, 99),
+                'mean': sum(durations) / len(durations),
+                'queries': sum(queries) / len(queries),
+                'max_queries': max(queries),
+            }
+
+        return {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'options': {name: options[name] for name in ('requests', 'processes', 'warmup', 'anonymous', 'seed')},
+            'elapsed': elapsed,
+            'throughput': len(measures) / elapsed if elapsed else None,
+            'views': views,
+        }
+
+    def print_report(self, report):
+        self.stdout.write("%-32s %8s %8s %8s %8s %8s %6s" % ("view", "p50 ms", "p95 ms", "p99 ms", "query", "max q",
+                                                          "errori"))
+        for name, view in report['views'].items():
+            self.stdout.write("%-32s %8.1f %8.1f %8.1f %8.1f %8d %6d" % (
+                name, view['p50'], view['p95'], view['p99'], view['queries'], view['max_queries'], view['errors']))
+        self.stdout.write("Richieste al secondo: %.1f." % report['throughput'])
+
+    def print_comparison(self, report, baseline):
+        """
+        Stampa la variazione percentuale di p50, p95 e numero medio di query rispetto a un'esecuzione precedente.
+        """
+        self.stdout.write("\nConfronto con l'esecuzione del %s:" % baseline['date'])
+        for name, view in report['views'].items():
+            previous = baseline['views'].get(name)
+            if previous is None:
+                continue
+            changes = ["%s %+.0f%%" % (field, (view[field] - previous[field]) / previous[field] * 100)
+                       if previous[field] else "%s -" % field for field in ('p50', 'p95', 'queries')]
+            self.stdout.write("%-32s %s" % (name, "  ".join(changes)))
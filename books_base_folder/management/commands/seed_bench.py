@@ -0,0 +1,235 @@
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from book_management.models import Book
+from comment_management.models import Topic, Comment, Like, Bookmark
+from user_management.models import Profile, ProfileBook, FollowRelation
+
+FIRST_NAMES = ["Marco", "Giulia", "Luca", "Sara", "Paolo", "Anna", "Davide", "Elena", "Matteo", "Chiara"]
+LAST_NAMES = ["Rossi", "Bianchi", "Verdi", "Russo", "Ferrari", "Esposito", "Romano", "Colombo", "Ricci", "Greco"]
+WORDS = ["lettura", "romanzo", "capitolo", "finale", "personaggi", "trama", "autore", "stile", "storia", "libro",
+         "pagine", "consiglio", "opinione", "scrittura", "dialoghi", "ambientazione", "ritmo", "colpo", "scena"]
+
+
+def zipf_weights(count, exponent):
+    """
+    :return: Pesi cumulativi di una distribuzione di Zipf su count elementi: il primo elemento è il più popolare.
+    """
+    return list(accumulate(1 / (rank ** exponent) for rank in range(1, count + 1)))
+
+
+def sample(rng, population, cumulative_weights, k):
+    """
+    Estrae fino a k elementi distinti da population, con probabilità proporzionale ai pesi.
+    :return: Lista degli elementi estratti.
+    """
+    k = min(k, len(population))
+    chosen = set()
+    while len(chosen) < k:
+        chosen.update(rng.choices(population, cum_weights=cumulative_weights, k=2 * (k - len(chosen))))
+    return list(chosen)[:k]
+
+
+def text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def isbn_13(number):
+    """
+    :return: Codice isbn_13 valido corrispondente al numero.
+    """
+    digits = "978%09d" % number
+    check = (10 - sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(digits)) % 10) % 10
+    return digits + str(check)
+
+
+class Command(BaseCommand):
+    """
+    Genera dati sintetici per i benchmark (vedi run_bench), con volumi configurabili e una distribuzione realistica:
+    pochi utenti e libri molto popolari (distribuzione di Zipf) ricevono la maggior parte di follow, topic,
+    commenti e like. I dati vengono inseriti con bulk_create, che non invia i signals: statistiche dei libri,
+    contatori dei topic, classifiche, indici full-text e feed vengono poi ricostruiti con i rispettivi comandi.
+    """
+    help = "Genera utenti, libri, bookshelf, topic, commenti e like sintetici per i benchmark."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help="Numero di utenti, ciascuno con profilo.")
+        parser.add_argument('--books', type=int, default=2000, help="Numero di libri.")
+        parser.add_argument('--authors', type=int, default=500, help="Numero di autori.")
+        parser.add_argument('--follows', type=int, default=20, help="Numero medio di profili seguiti per utente.")
+        parser.add_argument('--shelf', type=int, default=30, help="Numero medio di libri nel bookshelf.")
+        parser.add_argument('--topics', type=int, default=5000, help="Numero di topic.")
+        parser.add_argument('--comments', type=int, default=20000, help="Numero di commenti.")
+        parser.add_argument('--likes', type=int, default=50000, help="Numero di like (e un quinto di bookmark).")
+        parser.add_argument('--days', type=int, default=60,
+                            help="Numero di giorni su cui vengono distribuite le date di topic e commenti.")
+        parser.add_argument('--skew', type=float, default=1.0, help="Esponente della distribuzione di Zipf.")
+        parser.add_argument('--seed', type=int, default=0, help="Seme del generatore casuale.")
+        parser.add_argument('--prefix', default='bench', help="Prefisso degli username generati.")
+        parser.add_argument('--password', default='bench', help="Password di tutti gli utenti generati.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+        user_model = get_user_model()
+        if user_model.objects.filter(username__startswith='%s_' % prefix).exists():
+            raise CommandError("Esistono già utenti con prefisso '%s': usare un altro --prefix." % prefix)
+
+        with transaction.atomic():
+            users = self.create_users(rng, user_model, prefix, options)
+            books = self.create_books(rng, options)
+            self.create_follows(rng, users, options)
+            self.create_shelves(rng, users, books, options)
+            topics = self.create_topics(rng, users, books, options)
+            self.create_interactions(rng, users, topics, options)
+
+        for command in ('rebuild_book_stats', 'reconcile_topic_counters', 'rebuild_search_index', 'rebuild_feeds'):
+            call_command(command, stdout=self.stdout)
+        call_command('refresh_leaderboards', rebuild_counters=True, stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Generati %d utenti, %d libri e %d topic (password: %s)." %
+            (len(users), len(books), len(topics), options['password'])))
+
+    def create_users(self, rng, user_model, prefix, options):
+        """
+        :return: pk degli utenti creati, dal più attivo e seguito al meno attivo.
+        """
+        password = make_password(options['password'])
+        user_model.objects.bulk_create([
+            user_model(username='%s_%d' % (prefix, i), email='%s_%d@bench.invalid' % (prefix, i), password=password)
+            for i in range(options['users'])
+        ], batch_size=settings.FEED_BATCH_SIZE)
+        users = dict(user_model.objects.filter(username__startswith='%s_' % prefix).values_list('username', 'pk'))
+        users = [users['%s_%d' % (prefix, i)] for i in range(options['users'])]
+
+        Profile.objects.bulk_create([
+            Profile(user_id=user_id, first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                    description=text(rng, 12))
+            for user_id in users
+        ], batch_size=settings.FEED_BATCH_SIZE)
+        self.profiles = dict(Profile.objects.filter(user__username__startswith='%s_' % prefix)
+                             .values_list('user_id', 'pk'))
+        self.stdout.write("Utenti: %d." % len(users))
+        return users
+
+    def create_books(self, rng, options):
+        """
+        :return: pk dei libri creati, dal più popolare al meno popolare.
+        """
+        first = Book.objects.count()
+        authors = ["%s %s %d" % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), i) for i in range(options['authors'])]
+        metadata = {}
+        for i in range(options['books']):
+            metadata[isbn_13(first + i)] = {
+                'title': text(rng, rng.randint(1, 5)),
+                'authors': rng.sample(authors, min(len(authors), rng.choice([1, 1, 1, 2, 3]))),
+                'publisher': rng.choice(LAST_NAMES) + " Editore",
+                'year': rng.randint(1900, 2020),
+                'language': rng.choice(['it', 'it', 'en']),
+                'image_url': None,
+            }
+
+        isbns = list(metadata)
+        books = []
+        for start in range(0, len(isbns), settings.FEED_BATCH_SIZE):
+            batch = isbns[start:start + settings.FEED_BATCH_SIZE]
+            existing = set(Book.objects.filter(canonical_isbn__in=batch).values_list('canonical_isbn', flat=True))
+            batch = [isbn for isbn in batch if isbn not in existing]
+            Book.insert_books({isbn: metadata[isbn] for isbn in batch})
+            pks = dict(Book.objects.filter(canonical_isbn__in=batch).values_list('canonical_isbn', 'pk'))
+            books.extend(pks[isbn] for isbn in batch)
+        self.stdout.write("Libri: %d." % len(books))
+        return books
+
+    def create_follows(self, rng, users, options):
+        weights = zipf_weights(len(users), options['skew'])
+        relations = []
+        for user_id in users:
+            count = int(rng.expovariate(1 / options['follows'])) if options['follows'] else 0
+            followed = sample(rng, users, weights, count)
+            relations.extend(FollowRelation(user_following_id=user_id, profile_followed_id=self.profiles[followed_id])
+                             for followed_id in followed if followed_id != user_id)
+        FollowRelation.objects.bulk_create(relations, batch_size=settings.FEED_BATCH_SIZE)
+        self.stdout.write("Follow: %d." % len(relations))
+
+    def create_shelves(self, rng, users, books, options):
+        weights = zipf_weights(len(books), options['skew'])
+        today = timezone.localdate()
+        statuses = [ProfileBook.READ] * 6 + [ProfileBook.READING] * 2 + [ProfileBook.MUST_READ] * 2
+        profile_books = []
+        for user_id in users:
+            count = int(rng.expovariate(1 / options['shelf'])) if options['shelf'] else 0
+            shelf = sample(rng, books, weights, count)
+            for book_id in shelf:
+                profile_book = ProfileBook(profile_owner_id=self.profiles[user_id], book_id=book_id,
+                                           status=rng.choice(statuses), rating=rng.randint(0, 10) * 10,
+                                           start_reading_date=today - timedelta(days=rng.randint(0, 1000)))
+                profile_book.apply_status_rules()
+                profile_books.append(profile_book)
+        ProfileBook.objects.bulk_create(profile_books, batch_size=settings.FEED_BATCH_SIZE)
+        self.stdout.write("Libri nei bookshelf: %d." % len(profile_books))
+
+    def create_topics(self, rng, users, books, options):
+        """
+        :return: pk dei topic creati.
+        """
+        authors = rng.choices(users, cum_weights=zipf_weights(len(users), options['skew']), k=options['topics'])
+        topic_books = rng.choices(books, cum_weights=zipf_weights(len(books), options['skew']), k=options['topics'])
+        first = Topic.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        Topic.objects.bulk_create([
+            Topic(user_owner_id=user_id, book_id=book_id, title=text(rng, rng.randint(3, 8)),
+                  message="<p>%s</p>" % text(rng, rng.randint(20, 200)))
+            for user_id, book_id in zip(authors, topic_books)
+        ], batch_size=settings.FEED_BATCH_SIZE)
+        topics = list(Topic.objects.filter(pk__gt=first).values_list('pk', flat=True))
+        self.spread_dates(rng, Topic, topics, options['days'])
+        self.stdout.write("Topic: %d." % len(topics))
+        return topics
+
+    def create_interactions(self, rng, users, topics, options):
+        if not topics:
+            return
+        user_weights = zipf_weights(len(users), options['skew'])
+        topic_weights = zipf_weights(len(topics), options['skew'])
+
+        first = Comment.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        commenters = rng.choices(users, cum_weights=user_weights, k=options['comments'])
+        commented = rng.choices(topics, cum_weights=topic_weights, k=options['comments'])
+        Comment.objects.bulk_create([Comment(user_owner_id=user_id, topic_id=topic_id, message=text(rng, 15))
+                                     for user_id, topic_id in zip(commenters, commented)],
+                                    batch_size=settings.FEED_BATCH_SIZE)
+        self.spread_dates(rng, Comment, Comment.objects.filter(pk__gt=first).values_list('pk', flat=True),
+                          options['days'])
+
+        for model, count in ((Like, options['likes']), (Bookmark, options['likes'] // 5)):
+            pairs = set(zip(rng.choices(users, cum_weights=user_weights, k=count),
+                            rng.choices(topics, cum_weights=topic_weights, k=count)))
+            model.objects.bulk_create([model(user_owner_id=user_id, topic_id=topic_id) for user_id, topic_id in pairs],
+                                      batch_size=settings.FEED_BATCH_SIZE, ignore_conflicts=True)
+        self.stdout.write("Commenti: %d, like: %d." % (options['comments'], options['likes']))
+
+    @staticmethod
+    def spread_dates(rng, model, pks, days):
+        """
+        Distribuisce le date di creazione degli oggetti sugli ultimi days giorni, con un UPDATE per giorno
+        (bulk_create imposta sempre la data corrente nei campi auto_now_add).
+        """
+        by_day = {}
+        for pk in pks:
+            by_day.setdefault(rng.randrange(days) if days > 0 else 0, []).append(pk)
+
+        now = timezone.now()
+        for day, day_pks in by_day.items():
+            for start in range(0, len(day_pks), settings.FEED_BATCH_SIZE):
+                model.objects.filter(pk__in=day_pks[start:start + settings.FEED_BATCH_SIZE])\
+                    .update(creation_date_time=now - timedelta(days=day, seconds=rng.randrange(86400)))
@@ -0,0 +1,67 @@
+import glob
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """
+    Report del log delle query lente (vedi books_base_folder.instrumentation.log_slow_queries): le query vengono
+    raggruppate per impronta e ordinate per tempo totale, cioè frequenza per durata media, così che in cima compaiano
+    le forme di query che costano di più al database, anche se nessuna singola esecuzione è particolarmente lenta.
+    Per ogni impronta vengono riportati le view che la eseguono e il piano di esecuzione, in cui le righe SCAN
+    indicano una scansione completa della tabella o dell'indice.
+    """
+    help = "Classifica le query lente per tempo totale, con view e piano di esecuzione."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=settings.SLOW_QUERY_LOG_FILE,
+                            help="Log delle query lente (vengono letti anche i file ruotati).")
+        parser.add_argument('--view', help="Considera solo le query eseguite dalla view con questo nome dell'URL.")
+        parser.add_argument('--limit', type=int, default=10, help="Numero di impronte riportate.")
+
+    @staticmethod
+    def load(path, view=None):
+        """
+        :return: Dizionario delle query lente del log per impronta, con numero di esecuzioni, tempo totale e massimo
+            (in millisecondi), view e ultimo piano di esecuzione.
+        """
+        shapes = {}
+        for file_name in sorted(glob.glob(glob.escape(path) + '*')):
+            with open(file_name) as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if view is not None and record['view'] != view:
+                        continue
+                    shape = shapes.setdefault(record['fingerprint'], {
+                        'count': 0, 'total': 0, 'max': 0, 'views': Counter(), 'plan': None,
+                    })
+                    shape['count'] += 1
+                    shape['total'] += record['duration']
+                    shape['max'] = max(shape['max'], record['duration'])
+                    shape['views'][record['view']] += 1
+                    shape['plan'] = record['plan'] or shape['plan']
+        return shapes
+
+    def handle(self, *args, **options):
+        shapes = self.load(options['file'], options['view'])
+        if not shapes:
+            self.stdout.write("Nessuna query lenta registrata.")
+            return
+
+        ranking = sorted(shapes.items(), key=lambda item: item[1]['total'], reverse=True)
+        for position, (sql, shape) in enumerate(ranking[:options['limit']], start=1):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                "%d. %d esecuzioni, totale %.0f ms, media %.1f ms, massimo %.1f ms" %
+                (position, shape['count'], shape['total'], shape['total'] / shape['count'], shape['max'])))
+            self.stdout.write("   View: %s" % ", ".join("%s (%d)" % view for view in shape['views'].most_common()))
+            self.stdout.write("   %s" % sql)
+            for row in shape['plan'] or ["piano di esecuzione non disponibile"]:
+                if row.startswith('SCAN'):
+                    self.stdout.write(self.style.WARNING("     %s" % row))
+                else:
+                    self.stdout.write("     %s" % row)
@@ -0,0 +1,144 @@
+import json
+import logging
+import multiprocessing
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS, OperationalError
+from django.test import Client
+from django.urls import reverse
+
+from books_base_folder.management.commands.run_bench import percentile
+from comment_management.models import Topic
+from user_management.models import Profile, ProfileBook
+
+
+def run_operations(username, seconds, write_ratio, seed, plain):
+    """
+    Esegue per seconds secondi richieste miste di lettura e scrittura, autenticato come username: like, follow e
+    spostamenti nel bookshelf (le view Ajax delle pagine) alternati alla lettura di topic e bookshelf.
+    :param plain: Se True usa le opzioni predefinite del backend sqlite3 di Django (transazioni DEFERRED, attesa
+        dei lock di 5 secondi e nessun PRAGMA).
+    :return: Lista delle misure (operazione, durata in millisecondi, errore o None).
+    """
+    # Ogni processo apre le proprie connessioni al database. Gli errori vengono contati nel report, non scritti nel
+    # log delle richieste.
+    connections.close_all()
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    if plain:
+        connections[DEFAULT_DB_ALIAS].settings_dict['OPTIONS'] = {}
+        connections[DEFAULT_DB_ALIAS].transaction_mode = 'DEFERRED'
+        connections[DEFAULT_DB_ALIAS].init_command = ''
+
+    rng = random.Random(seed)
+    host = next((host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')), 'localhost')
+    client = Client(HTTP_HOST=host)
+    user = get_user_model().objects.get(username=username)
+    client.force_login(user)
+
+    topics = list(Topic.objects.values_list('pk', flat=True)[:200])
+    profiles = list(Profile.objects.exclude(user=user).values_list('user_id', flat=True)[:200])
+    books = list(ProfileBook.objects.filter(profile_owner__user=user).values_list('book_id', flat=True))
+    statuses = [ProfileBook.READ, ProfileBook.READING, ProfileBook.MUST_READ]
+
+    operations = {
+        'like': lambda: client.post(reverse('comment_management:ajax-save-like'),
+                                    {'topic_primary_key': rng.choice(topics)}),
+        'follow': lambda: client.post(reverse('user_management:ajax-save-follow'), {'user': rng.choice(profiles)}),
+        'bookshelf': lambda: client.post(
+            reverse('user_management:ajax-update-bookshelf'),
+            json.dumps({'operations': [{'action': 'move', 'book': book, 'status': rng.choice(statuses)}
+                                       for book in rng.sample(books, min(len(books), 3))]}),
+            content_type='application/json'),
+        'topic': lambda: client.get(reverse('comment_management:view-topic', kwargs={'pk': rng.choice(topics)})),
+        'shelf': lambda: client.get(reverse('user_management:bookshelf', kwargs={'pk': user.pk})),
+    }
+    writes = ['like', 'follow'] + (['bookshelf'] if books else [])
+    reads = ['topic', 'shelf']
+
+    measures = []
+    deadline = time.perf_counter() + seconds
+    try:
+        while time.perf_counter() < deadline:
+            name = rng.choice(writes if rng.random() < write_ratio else reads)
+            start = time.perf_counter()
+            error = None
+            try:
+                status = operations[name]().status_code
+                if status >= 400:
+                    error = "HTTP %d" % status
+            except OperationalError as exception:
+                error = str(exception)
+            measures.append((name, (time.perf_counter() - start) * 1000, error))
+    finally:
+        connections.close_all()
+    return measures
+
+
+class Command(BaseCommand):
+    """
+    Test di carico concorrente del database: più processi, ciascuno autenticato come un utente diverso (ad esempio
+    generato con seed_bench), eseguono insieme richieste di lettura e di scrittura per un tempo stabilito, e vengono
+    contati gli errori "database is locked".
+    Con --plain i processi usano le opzioni predefinite del backend sqlite3 di Django e il database in modalità
+    rollback journal, per confrontare i risultati con quelli della configurazione di DATABASES.
+    """
+    help = "Esegue letture e scritture concorrenti da più processi e conta gli errori di lock del database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8, help="Numero di processi paralleli.")
+        parser.add_argument('--seconds', type=float, default=10, help="Durata del test.")
+        parser.add_argument('--write-ratio', type=float, default=0.5, help="Frazione delle richieste di scrittura.")
+        parser.add_argument('--prefix', default='bench',
+                            help="Prefisso degli username con cui autenticarsi (vedi seed_bench).")
+        parser.add_argument('--seed', type=int, default=0, help="Seme del generatore casuale.")
+        parser.add_argument('--plain', action='store_true',
+                            help="Usa le opzioni predefinite del backend sqlite3 di Django.")
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if connection.vendor != 'sqlite':
+            raise CommandError("stress_db supporta solo SQLite.")
+        processes = max(1, options['processes'])
+        usernames = list(get_user_model().objects.filter(username__startswith='%s_' % options['prefix'])
+                         .values_list('username', flat=True)[:processes])
+        if len(usernames) < processes:
+            raise CommandError("Servono almeno %d utenti con prefisso '%s'." % (processes, options['prefix']))
+
+        # Il journal mode è una proprietà del file del database: viene impostato prima di avviare i processi (e
+        # reimpostato da init_command alla prima connessione successiva).
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode=%s" % ('DELETE' if options['plain'] else 'WAL'))
+            journal_mode = cursor.fetchone()[0]
+        connections.close_all()
+
+        arguments = [(username, options['seconds'], options['write_ratio'], options['seed'] + i, options['plain'])
+                     for i, username in enumerate(usernames)]
+        start = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            results = pool.starmap(run_operations, arguments)
+        elapsed = time.perf_counter() - start
+
+        by_operation = {}
+        for name, duration, error in (measure for measures in results for measure in measures):
+            by_operation.setdefault(name, []).append((duration, error))
+
+        transaction_mode = 'DEFERRED' if options['plain'] else getattr(connection, 'transaction_mode', 'DEFERRED')
+        self.stdout.write("%d processi, journal mode %s, transazioni %s." % (processes, journal_mode, transaction_mode))
+        self.stdout.write("%-12s %8s %8s %8s %8s" % ("operazione", "numero", "p50 ms", "p99 ms", "errori"))
+        total = errors = 0
+        for name, measures in sorted(by_operation.items()):
+            durations = sorted(duration for duration, _ in measures)
+            failed = [error for _, error in measures if error]
+            total += len(measures)
+            errors += len(failed)
+            self.stdout.write("%-12s %8d %8.1f %8.1f %8d" % (name, len(measures), percentile(durations, 50),
+                                                            percentile(durations, 99), len(failed)))
+        locked = sum(1 for measures in by_operation.values() for _, error in measures
+                     if error and 'locked' in error)
+        self.stdout.write("Operazioni al secondo: %.1f." % (total / elapsed))
+        style = self.style.SUCCESS if not errors else self.style.ERROR
+        self.stdout.write(style("Errori: %d, di cui \"database is locked\": %d." % (errors, locked)))
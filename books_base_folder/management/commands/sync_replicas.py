@@ -0,0 +1,66 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from books_base_folder.sqlite_backend.backup import backup_database
+
+
+class Command(BaseCommand):
+    """
+    Aggiorna le repliche SQLite (DATABASE_REPLICAS) copiando il database principale. Ogni replica viene scritta in un
+    file temporaneo e poi sostituita con un rename atomico: le connessioni già aperte continuano a leggere la copia
+    precedente, le nuove leggono quella aggiornata.
+    Le copie vengono ripetute ogni REPLICA_SYNC_INTERVAL secondi: il ritardo delle repliche resta così entro
+    REPLICA_MAX_LAG, la durata per cui ReadYourWritesMiddleware mantiene le letture sul database principale. Le copie
+    più lunghe di REPLICA_SYNC_MAX_DURATION vengono segnalate, perché superano il ritardo previsto.
+    Le copie vengono convertite in modalità rollback journal, perché un file WAL rimasto da una copia precedente non
+    venga applicato alla nuova (le repliche sono in sola lettura).
+    """
+    help = "Copia il database principale nelle repliche SQLite."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help="Secondi tra una copia e la successiva (default REPLICA_SYNC_INTERVAL). Un intervallo "
+                                 "diverso va riportato in REPLICA_SYNC_INTERVAL.")
+        parser.add_argument('--once', action='store_true',
+                            help="Esegue la copia una sola volta.")
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError("sync_replicas supporta solo SQLite: le altre repliche vanno aggiornate con la "
+                               "replicazione del database.")
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("Nessuna replica configurata in DATABASE_REPLICAS.")
+
+        interval = settings.REPLICA_SYNC_INTERVAL if options['interval'] is None else options['interval']
+        while True:
+            start = time.perf_counter()
+            for alias in settings.DATABASE_REPLICAS:
+                self.sync(primary, alias)
+            duration = time.perf_counter() - start
+            self.stdout.write("Repliche aggiornate in %.0f ms." % (duration * 1000))
+            if duration > settings.REPLICA_SYNC_MAX_DURATION:
+                self.stderr.write("La copia ha superato REPLICA_SYNC_MAX_DURATION (%s s): il ritardo delle repliche "
+                                  "può superare REPLICA_MAX_LAG." % settings.REPLICA_SYNC_MAX_DURATION)
+            if options['once']:
+                break
+            time.sleep(interval)
+
+    @staticmethod
+    def sync(primary, alias):
+        path = str(connections[alias].settings_dict['NAME'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = path + '.sync'
+        backup_database(primary, temporary)
+
+        copy = type(primary)(dict(primary.settings_dict, NAME=temporary, OPTIONS={}), alias='replica_sync')
+        try:
+            with copy.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            copy.close()
+        os.replace(temporary, path)
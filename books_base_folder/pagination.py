@@ -0,0 +1,106 @@
+from django.core import signing
+from django.core.exceptions import SuspiciousOperation
+from django.db.models import Q
+from django.http import JsonResponse
+from django.template.loader import render_to_string
+
+
+class KeysetPaginationMixin(object):
+    """
+    Mixin per ListView che sostituisce la paginazione per offset con una paginazione keyset (a cursore).
+    Ogni pagina viene letta filtrando sulla chiave dell'ultimo elemento della pagina precedente, quindi il costo
+    di una pagina resta costante a qualunque profondità di scorrimento.
+    Il cursore è opaco: contiene i valori della chiave firmati, così da non poter essere manipolato.
+    Le richieste Ajax con un cursore ricevono il frammento HTML della pagina successiva e il nuovo cursore.
+    """
+    paginate_by = 20
+    keyset = ('-pk',)
+    fragment_template_name = None
+    cursor_salt = 'books_base_folder.pagination'
+
+    next_cursor = None
+
+    def encode_cursor(self, obj):
+        """
+        :return: Cursore opaco con i valori della chiave dell'oggetto.
+        """
+        values = []
+        for field in self.keyset:
+            value = getattr(obj, field.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return signing.dumps(values, salt=self.cursor_salt, compress=True)
+
+    def decode_cursor(self, cursor):
+        """
+        :return: Valori della chiave contenuti nel cursore, None se il cursore è assente.
+        """
+        if not cursor:
+            return None
+
+        try:
+            values = signing.loads(cursor, salt=self.cursor_salt)
+        except signing.BadSignature:
+            raise SuspiciousOperation("Cursore di paginazione non valido.")
+
+        if not isinstance(values, list) or len(values) != len(self.keyset):
+            raise SuspiciousOperation("Cursore di paginazione non valido.")
+
+        opts = self.model._meta
+        return [(opts.pk if field.lstrip('-') == 'pk' else opts.get_field(field.lstrip('-'))).to_python(value)
+                for field, value in zip(self.keyset, values)]
+
+    def get_keyset_filter(self, values):
+        """
+        Costruisce il confronto lessicografico tra la chiave e i valori del cursore:
+        (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...
+        I campi con '-' vengono confrontati con minore stretto.
+        """
+        condition = Q()
+        for i, field in enumerate(self.keyset):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            clause = Q(**{'%s__%s' % (field.lstrip('-'), lookup): values[i]})
+            for previous_field, previous_value in zip(self.keyset[:i], values[:i]):
+                clause &= Q(**{previous_field.lstrip('-'): previous_value})
+            condition |= clause
+        return condition
+
+    def get_keyset_page(self, queryset, cursor, page_size):
+        """
+        :return: Al più page_size elementi del queryset successivi al cursore.
+        """
+        if cursor is not None:
+            queryset = queryset.filter(self.get_keyset_filter(cursor))
+        return queryset.order_by(*self.keyset)[:page_size]
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Legge un elemento in più della dimensione della pagina per sapere se esiste una pagina successiva.
+        """
+        cursor = self.decode_cursor(self.request.GET.get('cursor'))
+        object_list = list(self.get_keyset_page(queryset, cursor, page_size + 1))
+
+        is_paginated = len(object_list) > page_size
+        object_list = object_list[:page_size]
+        self.next_cursor = self.encode_cursor(object_list[-1]) if is_paginated else None
+
+        return None, None, object_list, is_paginated
+
+    def get_context_data(self, **kwargs):
+        """
+        Salva il cursore della pagina successiva nel context.
+        """
+        context = super(KeysetPaginationMixin, self).get_context_data(**kwargs)
+        context['next_cursor'] = self.next_cursor
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        """
+        :return: Frammento HTML della pagina e cursore successivo se la richiesta è una richiesta Ajax
+            di "carica altri", la pagina completa altrimenti.
+        """
+        if self.request.GET.get('cursor') and self.request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({
+                'html': render_to_string(self.fragment_template_name, context, request=self.request),
+                'next_cursor': context['next_cursor'],
+            })
+        return super(KeysetPaginationMixin, self).render_to_response(context, **response_kwargs)
@@ -0,0 +1,195 @@
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+
+TOKEN_SALT = 'books_base_folder.profiling'
+TOKEN_VALUE = 'profile'
+UNSAFE_FILE_CHARACTERS = re.compile(r'[^\w.-]')
+
+
+def make_token():
+    """
+    :return: Valore firmato dell'header REQUEST_PROFILING_HEADER che richiede la profilazione di una richiesta,
+        valido per REQUEST_PROFILING_TOKEN_MAX_AGE secondi.
+    """
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(TOKEN_VALUE)
+
+
+def is_valid_token(token):
+    try:
+        return signing.TimestampSigner(salt=TOKEN_SALT)\
+            .unsign(token, max_age=settings.REQUEST_PROFILING_TOKEN_MAX_AGE) == TOKEN_VALUE
+    except signing.BadSignature:
+        return False
+
+
+def frame_label(frame):
+    """
+    :return: Nome della funzione del frame, preceduto dal modulo (ad esempio django.template.base:Template.render).
+    """
+    code = frame.f_code
+    return "%s:%s" % (frame.f_globals.get('__name__', code.co_filename), getattr(code, 'co_qualname', code.co_name))
+
+
+def profile_path(view_name):
+    """
+    :return: Percorso del file con i profili delle richieste della view.
+    """
+    return os.path.join(settings.REQUEST_PROFILING_DIR, UNSAFE_FILE_CHARACTERS.sub('_', view_name) + '.jsonl')
+
+
+class StackSampler(object):
+    """
+    Profiler a campionamento: un thread legge ogni interval secondi lo stack del thread profilato e conta quante
+    volte compare ciascuno stack. A differenza di cProfile non rallenta il codice profilato, e gli stack raccolti
+    danno sia le funzioni più costose sia i dati per i flame graph.
+    Usato come context manager attorno al codice da profilare.
+    """
+
+    def __init__(self, interval):
+        """
+        :param interval: Intervallo di campionamento in secondi.
+        """
+        self.interval = interval
+        self.samples = Counter()
+        self.target = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.target)
+        stack = []
+        while frame is not None:
+            stack.append(frame_label(frame))
+            frame = frame.f_back
+        if stack:
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.target = threading.get_ident()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+class ProfilingMiddleware(object):
+    """
+    Middleware che profila, con StackSampler, una frazione casuale delle richieste (REQUEST_PROFILING_SAMPLE_RATE) e
+    le richieste con un header REQUEST_PROFILING_HEADER firmato (vedi make_token e il comando profile_report).
+    Ogni richiesta profilata viene aggiunta, come riga JSON con data, durata e stack campionati, al file della sua
+    view in REQUEST_PROFILING_DIR: il comando profile_report aggrega i profili per nome dell'URL.
+    Attivo solo con REQUEST_PROFILING = True.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        token = request.headers.get(settings.REQUEST_PROFILING_HEADER)
+        if token is not None:
+            return is_valid_token(token)
+        return random.random() < settings.REQUEST_PROFILING_SAMPLE_RATE
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        with StackSampler(settings.REQUEST_PROFILING_INTERVAL) as sampler:
+            response = self.get_response(request)
+        duration = (time.perf_counter() - start) * 1000
+
+        view_name = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        record = json.dumps({
+            'view': view_name,
+            'date': timezone.now().isoformat(timespec='seconds'),
+            'path': request.path,
+            'duration': duration,
+            'interval': settings.REQUEST_PROFILING_INTERVAL,
+            'samples': sampler.samples,
+        })
+        os.makedirs(settings.REQUEST_PROFILING_DIR, exist_ok=True)
+        # Un'unica write in modalità append, così che le righe di processi diversi non si mescolino.
+        fd = os.open(profile_path(view_name), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, (record + '\n').encode())
+        finally:
+            os.close(fd)
+        return response
+
+
+class ViewProfile(object):
+    """
+    Profilo aggregato di tutte le richieste profilate di una view.
+    """
+
+    def __init__(self, view_name, records):
+        self.view_name = view_name
+        self.requests = len(records)
+        self.duration = sum(record['duration'] for record in records)
+        self.samples = Counter()
+        for record in records:
+            self.samples.update(record['samples'])
+
+    @staticmethod
+    def load_all():
+        """
+        :return: Lista dei profili delle view presenti in REQUEST_PROFILING_DIR.
+        """
+        profiles = []
+        directory = settings.REQUEST_PROFILING_DIR
+        if not os.path.isdir(directory):
+            return profiles
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.endswith('.jsonl'):
+                with open(os.path.join(directory, file_name)) as file:
+                    records = [json.loads(line) for line in file if line.strip()]
+                if records:
+                    profiles.append(ViewProfile(records[0]['view'], records))
+        return profiles
+
+    @property
+    def samples_count(self):
+        return sum(self.samples.values())
+
+    def hottest(self, limit):
+        """
+        Funzioni in cui le richieste hanno trascorso più tempo.
+        :param limit: Numero di funzioni da restituire.
+        :return: Lista di terne (funzione, campioni in cui la funzione era in esecuzione, campioni in cui la funzione
+            era nello stack), a partire dalla funzione con più campioni in esecuzione.
+        """
+        own, total = Counter(), Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [(frame, count, total[frame]) for frame, count in own.most_common(limit)]
+
+    def collapsed(self):
+        """
+        :return: Stack nel formato "collapsed" (una riga "frame;frame;... campioni" per stack), letto da
+            flamegraph.pl e speedscope.
+        """
+        return "".join("%s %d\n" % (stack, count) for stack, count in sorted(self.samples.items()))
@@ -0,0 +1,104 @@
+import random
+import re
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections, DEFAULT_DB_ALIAS
+
+WRITE_QUERIES = re.compile(r"^\s*(INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+
+# Stato della richiesta in corso, impostato da ReadYourWritesMiddleware. Fuori dalle richieste (comandi, lavori in
+# background, shell) non è impostato e tutte le query vanno al database principale.
+request_state = ContextVar('replica_request_state', default=None)
+
+
+class ReplicaRequestState(object):
+    """
+    Stato di una richiesta per il router: se le sue letture possono andare alle repliche e se ha già scritto nel
+    database principale. Le scritture vengono rilevate dalle query eseguite (lo stato è un execute wrapper della
+    connessione al database principale), non da db_for_write, che Django chiama anche solo per assegnare un database
+    agli oggetti creati in memoria.
+    """
+
+    def __init__(self, use_replicas):
+        self.use_replicas = use_replicas
+        self.written = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if WRITE_QUERIES.match(sql):
+            self.written = True
+        return execute(sql, params, many, context)
+
+
+class ReplicaRouter(object):
+    """
+    Router che invia le letture dei modelli delle app del progetto a una delle repliche DATABASE_REPLICAS, scelta a
+    caso, e le scritture al database principale.
+    Le letture vanno alle repliche solo nelle richieste che ReadYourWritesMiddleware ha indicato come sicure: non
+    nelle richieste di scrittura, né dopo la prima scrittura di una richiesta, né per READ_YOUR_WRITES_WINDOW
+    secondi dopo una scrittura dello stesso utente. Così una lettura seguita da una scrittura non usa mai dati non
+    aggiornati, e un utente vede subito ciò che ha pubblicato.
+    """
+    route_app_labels = {'book_management', 'comment_management', 'user_management'}
+
+    def db_for_read(self, model, **hints):
+        state = request_state.get()
+        if state is None or model._meta.app_label not in self.route_app_labels or not settings.DATABASE_REPLICAS:
+            return None
+        if not state.use_replicas or state.written:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label not in self.route_app_labels:
+            return None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """
+        Le repliche contengono gli stessi dati del database principale: gli oggetti letti da una replica possono
+        essere collegati a quelli del database principale.
+        """
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """
+        Le repliche sono copie del database principale (vedi sync_replicas), su cui non vengono eseguite migrazioni.
+        """
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReadYourWritesMiddleware(object):
+    """
+    Middleware che indica a ReplicaRouter quali richieste possono leggere dalle repliche: le richieste GET, HEAD e
+    OPTIONS di utenti che non hanno scritto negli ultimi READ_YOUR_WRITES_WINDOW secondi.
+    Dopo una richiesta che ha scritto nel database viene impostato il cookie READ_YOUR_WRITES_COOKIE, che scade
+    dopo READ_YOUR_WRITES_WINDOW secondi: fino ad allora le letture dell'utente vanno al database principale.
+    Attivo solo se sono configurate delle repliche.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = ReplicaRequestState(request.method in ('GET', 'HEAD', 'OPTIONS') and
+                                    settings.READ_YOUR_WRITES_COOKIE not in request.COOKIES)
+        token = request_state.set(state)
+        try:
+            with connections[DEFAULT_DB_ALIAS].execute_wrapper(state):
+                response = self.get_response(request)
+        finally:
+            request_state.reset(token)
+
+        if state.written:
+            response.set_cookie(settings.READ_YOUR_WRITES_COOKIE, '1', max_age=settings.READ_YOUR_WRITES_WINDOW,
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,179 @@
+import re
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import QuerySet
+
+
+class FullTextIndex(object):
+    """
+    Indice full-text basato su una tabella virtuale FTS5 di SQLite.
+    Ogni riga dell'indice ha come rowid la pk dell'oggetto indicizzato e una colonna per ciascun campo testuale.
+    L'indice viene aggiornato esplicitamente (tramite signals) e interrogato con MATCH, ordinando i risultati
+    per rilevanza (bm25). Tutti i metodi accettano l'alias del database (using) in cui si trova l'indice, ad esempio
+    quello di schema_editor nelle migrazioni.
+    """
+
+    def __init__(self, table, columns):
+        """
+        :param table: Nome della tabella virtuale.
+        :param columns: Nomi delle colonne indicizzate.
+        """
+        self.table = table
+        self.columns = tuple(columns)
+
+    @property
+    def create_sql(self):
+        """
+        :return: Istruzione SQL per la creazione della tabella virtuale. Le lettere accentate vengono indicizzate
+            senza accento e i prefissi di 2 e 3 caratteri hanno un proprio indice per le ricerche "mentre si scrive".
+        """
+        return "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, tokenize='unicode61 remove_diacritics 2', " \
+               "prefix='2 3')" % (self.table, ", ".join(self.columns))
+
+    @property
+    def drop_sql(self):
+        return "DROP TABLE IF EXISTS %s" % self.table
+
+    @property
+    def insert_sql(self):
+        return "INSERT INTO %s (rowid, %s) VALUES (%%s, %s)" % \
+               (self.table, ", ".join(self.columns), ", ".join(["%s"] * len(self.columns)))
+
+    def update(self, pk, document, using=DEFAULT_DB_ALIAS):
+        """
+        Inserisce o sostituisce il documento di un oggetto.
+        :param pk: pk dell'oggetto.
+        :param document: Valori delle colonne, nello stesso ordine di self.columns.
+        """
+        with connections[using].cursor() as cursor:
+            cursor.execute("DELETE FROM %s WHERE rowid = %%s" % self.table, [pk])
+            cursor.execute(self.insert_sql, [pk] + list(document))
+
+    def update_many(self, documents, using=DEFAULT_DB_ALIAS):
+        """
+        Inserisce o sostituisce i documenti di più oggetti con due sole istruzioni.
+        :param documents: Lista di coppie (pk, valori delle colonne).
+        """
+        with connections[using].cursor() as cursor:
+            cursor.executemany("DELETE FROM %s WHERE rowid = %%s" % self.table, [[pk] for pk, _ in documents])
+            cursor.executemany(self.insert_sql, [[pk] + list(document) for pk, document in documents])
+
+    def delete(self, pk, using=DEFAULT_DB_ALIAS):
+        """
+        Rimuove dall'indice il documento di un oggetto.
+        """
+        with connections[using].cursor() as cursor:
+            cursor.execute("DELETE FROM %s WHERE rowid = %%s" % self.table, [pk])
+
+    def rebuild(self, documents, batch_size=1000, using=DEFAULT_DB_ALIAS):
+        """
+        Svuota l'indice e lo ricostruisce.
+        :param documents: Iterabile di coppie (pk, valori delle colonne).
+        :return: Numero di documenti indicizzati.
+        """
+        count = 0
+        batch = []
+        with connections[using].cursor() as cursor:
+            cursor.execute("DELETE FROM %s" % self.table)
+            for pk, document in documents:
+                batch.append([pk] + list(document))
+                if len(batch) >= batch_size:
+                    cursor.executemany(self.insert_sql, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(self.insert_sql, batch)
+                count += len(batch)
+            cursor.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (self.table, self.table))
+        return count
+
+    @staticmethod
+    def match_expression(query):
+        """
+        Converte il testo inserito dall'utente in un'espressione MATCH: ogni parola diventa un prefisso tra
+        virgolette, in modo che la sintassi FTS5 non possa essere iniettata dall'utente.
+        :return: Espressione MATCH, None se il testo non contiene parole.
+        """
+        words = re.findall(r'\w+', query or '')
+        return " ".join('"%s"*' % word for word in words) if words else None
+
+    def filter_sql(self, expression, exclude):
+        """
+        :param exclude: pk dei documenti da escludere: lista, oppure queryset di una sola colonna, usato come
+            sottoquery così che la lista dei pk non venga caricata in memoria.
+        """
+        sql = "FROM %s WHERE %s MATCH %%s" % (self.table, self.table)
+        params = [expression]
+        if isinstance(exclude, QuerySet):
+            subquery, subquery_params = exclude.query.sql_with_params()
+            sql += " AND rowid NOT IN (%s)" % subquery
+            params += list(subquery_params)
+        elif exclude:
+            sql += " AND rowid NOT IN (%s)" % ", ".join(["%s"] * len(exclude))
+            params += list(exclude)
+        return sql, params
+
+    def count(self, query, exclude=(), using=DEFAULT_DB_ALIAS):
+        """
+        :return: Numero di documenti che corrispondono alla ricerca.
+        """
+        expression = self.match_expression(query)
+        if expression is None:
+            return 0
+
+        sql, params = self.filter_sql(expression, exclude)
+        with connections[using].cursor() as cursor:
+            cursor.execute("SELECT count(*) " + sql, params)
+            return cursor.fetchone()[0]
+
+    def search(self, query, offset=0, limit=20, exclude=(), using=DEFAULT_DB_ALIAS):
+        """
+        :return: pk dei documenti che corrispondono alla ricerca, in ordine di rilevanza.
+        """
+        expression = self.match_expression(query)
+        if expression is None:
+            return []
+
+        sql, params = self.filter_sql(expression, exclude)
+        with connections[using].cursor() as cursor:
+            cursor.execute("SELECT rowid " + sql + " ORDER BY rank, rowid LIMIT %s OFFSET %s",
+                           params + [limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class SearchResults(object):
+    """
+    Risultati di una ricerca full-text, utilizzabili con il Paginator di Django: il conteggio e ciascuna pagina
+    vengono letti dall'indice solo quando richiesti, e solo gli oggetti della pagina vengono caricati dal database.
+    """
+
+    def __init__(self, index, query, queryset, exclude=()):
+        """
+        :param index: Oggetto FullTextIndex.
+        :param query: Testo della ricerca.
+        :param queryset: Queryset con cui caricare gli oggetti trovati.
+        :param exclude: pk degli oggetti da escludere dai risultati, lista o queryset di una sola colonna.
+        """
+        self.index = index
+        self.query = query
+        self.queryset = queryset
+        self.exclude = exclude if isinstance(exclude, QuerySet) else list(exclude)
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.index.count(self.query, self.exclude)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else self.count()
+        pks = self.index.search(self.query, offset=start, limit=max(stop - start, 0), exclude=self.exclude)
+        objects = self.queryset.in_bulk(pks)
+        return [objects[pk] for pk in pks if pk in objects]
@@ -45,12 +45,16 @@ INSTALLED_APPS = [
     'crispy_forms',
     'tinymce',
     "sekizai",
+    'books_base_folder',
     'book_management.apps.BooksManagementConfig',
     'user_management.apps.UserManagementConfig',
     'comment_management.apps.CommentManagementConfig',
 ]
 
 MIDDLEWARE = [
+    'books_base_folder.instrumentation.QueryInstrumentationMiddleware',
+    'books_base_folder.profiling.ProfilingMiddleware',
+    'books_base_folder.replicas.ReadYourWritesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,13 +90,78 @@ WSGI_APPLICATION = 'books_base_folder.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
+# Backend SQLite con opzioni per più processi (vedi books_base_folder.sqlite_backend):
+#   - timeout: attesa massima (in secondi) di un lock prima dell'errore "database is locked" (busy_timeout)
+#   - transaction_mode: le transazioni acquisiscono il lock di scrittura all'inizio (BEGIN IMMEDIATE)
+#   - init_command: WAL (le letture non bloccano le scritture e viceversa), sincronizzazione su disco solo ai
+#     checkpoint del WAL, 256 MB di database letti in memory-map e 64 MB di cache delle pagine per connessione
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'books_base_folder.sqlite_backend',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA mmap_size=268435456; '
+                            'PRAGMA cache_size=-65536',
+        },
     }
 }
 
+# Repliche in sola lettura del database principale, ad esempio ['replica_1', 'replica_2']: le letture delle richieste
+# GET vengono distribuite tra le repliche, le scritture vanno sempre al database principale (vedi
+# books_base_folder.replicas). In locale le repliche sono copie del file del database, aggiornate con il comando
+# sync_replicas.
+DATABASE_REPLICAS = []
+
+for replica in DATABASE_REPLICAS:
+    DATABASES[replica] = {
+        'ENGINE': 'books_base_folder.sqlite_backend',
+        'NAME': BASE_DIR / 'replicas' / ('%s.sqlite3' % replica),
+        'OPTIONS': {
+            'timeout': 20,
+            'init_command': 'PRAGMA query_only=1; PRAGMA mmap_size=268435456; PRAGMA cache_size=-65536',
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    }
+
+DATABASE_ROUTERS = ['books_base_folder.replicas.ReplicaRouter']
+
+# Cache condivisa da tutti i processi del server: le invalidazioni (riepilogo del bookshelf, versioni dei frammenti
+# delle card dei topic) devono raggiungere ogni worker, cosa che la cache in memoria di ciascun processo (LocMemCache,
+# il default di Django) non fa. La cache su file non aggiunge scritture al database SQLite; con più server va
+# sostituita da una cache di rete (ad esempio memcached). A ogni scrittura vengono contati i file della cache, per
+# eliminarne una parte oltre MAX_ENTRIES.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+# Intervallo (in secondi) tra la fine di una copia delle repliche e l'inizio della successiva (sync_replicas), e
+# durata massima prevista di una copia (sync_replicas segnala le copie più lente).
+REPLICA_SYNC_INTERVAL = 4
+
+REPLICA_SYNC_MAX_DURATION = 3
+
+# Ritardo massimo delle repliche rispetto al database principale: una scrittura appena successiva all'inizio di una
+# copia arriva alle repliche con la copia seguente. Va sempre calcolato da REPLICA_SYNC_INTERVAL e
+# REPLICA_SYNC_MAX_DURATION, che vanno mantenuti allineati all'esecuzione di sync_replicas (o della replicazione del
+# database che lo sostituisce).
+REPLICA_MAX_LAG = REPLICA_SYNC_INTERVAL + 2 * REPLICA_SYNC_MAX_DURATION
+
+# Durata (in secondi) per cui le letture di un utente vengono servite dal database principale dopo una sua scrittura,
+# così che veda subito ciò che ha pubblicato anche se le repliche non sono ancora aggiornate: almeno REPLICA_MAX_LAG.
+READ_YOUR_WRITES_WINDOW = REPLICA_MAX_LAG
+
+READ_YOUR_WRITES_COOKIE = 'read_primary'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -150,4 +219,147 @@ LOGIN_REDIRECT_URL = 'home'
 
 LOGOUT_REDIRECT_URL = '/user/login'
 
-SITE_ID = 1
\ No newline at end of file
+SITE_ID = 1
+
+# Feed della homepage: oltre questo numero di follower i topic di un profilo
+# vengono letti al momento della richiesta invece di essere distribuiti nei feed.
+FEED_FAN_OUT_MAX_FOLLOWERS = 5000
+
+FEED_BACKFILL_SIZE = 100
+
+FEED_BATCH_SIZE = 1000
+
+# Numero di posizioni di ciascuna classifica della pagina delle statistiche.
+LEADERBOARD_SIZE = 5
+
+# Numero di risultati per pagina della ricerca di libri e profili.
+SEARCH_PAGE_SIZE = 20
+
+# Cache locale dei metadati dei libri: provider, durata dei dati (in secondi) e durata dei "non trovato".
+ISBN_METADATA_PROVIDER = 'book_management.isbn.IsbnlibProvider'
+
+ISBN_METADATA_TTL = 60 * 60 * 24 * 30
+
+ISBN_METADATA_NOT_FOUND_TTL = 60 * 60 * 24
+
+# Tempo massimo (in secondi) per la ricerca parallela di metadati e copertina, e thread dedicati alle ricerche.
+ISBN_METADATA_DEADLINE = 5
+
+ISBN_METADATA_WORKERS = 8
+
+# Coda dei lavori in background (comando run_jobs): tentativi massimi, attesa prima del secondo tentativo
+# (raddoppiata a ogni tentativo successivo) e secondi dopo cui un lavoro in esecuzione viene ripreso.
+BACKGROUND_JOB_MAX_ATTEMPTS = 5
+
+BACKGROUND_JOB_RETRY_DELAY = 60
+
+BACKGROUND_JOB_LEASE = 600
+
+BOOK_COVER_DOWNLOAD_TIMEOUT = 10
+
+BOOK_COVER_MAX_SIZE = 5 * 1024 * 1024
+
+# Archivio dei file indirizzato per contenuto: durata della cache dei file (immutabili) e secondi dopo cui
+# collect_media può eliminare un file senza riferimenti.
+# In sviluppo i file vengono serviti dalla view content_addressed_media. In produzione MEDIA_ROOT/cas/ va servita
+# dal web server con gli stessi header, ad esempio con nginx:
+#   location /media/cas/ { alias <MEDIA_ROOT>/cas/; add_header Cache-Control "public, max-age=31536000, immutable"; }
+CONTENT_ADDRESSED_MEDIA_MAX_AGE = 60 * 60 * 24 * 365
+
+MEDIA_GC_GRACE_PERIOD = 60 * 60 * 24
+
+# Larghezze (in pixel) delle miniature delle copertine, create in WebP e JPEG.
+BOOK_COVER_THUMBNAIL_SIZES = [64, 128, 256]
+
+# Lato (in pixel) dell'immagine quadrata dei profili e larghezze delle sue varianti ridotte.
+PROFILE_PICTURE_SIZE = 300
+
+PROFILE_PICTURE_VARIANT_SIZES = [64, 128]
+
+# Durata (in secondi) in cache del riepilogo del bookshelf dei profili, invalidato a ogni modifica del bookshelf.
+BOOKSHELF_SUMMARY_CACHE_TTL = 60 * 60 * 24
+
+# Durata (in secondi) in cache delle parti delle card dei topic che non dipendono dall'utente che le visualizza.
+# Le parti non aggiornate non vengono più lette, perché la chiave cambia a ogni modifica di topic, autore o libro.
+TOPIC_CARD_CACHE_TTL = 60 * 60 * 24
+
+# Numero massimo di operazioni accettate da una singola richiesta di modifica multipla del bookshelf.
+BOOKSHELF_BATCH_MAX_OPERATIONS = 500
+
+# Misura di numero di query, tempo nel database e query ripetute di ogni richiesta (vedi
+# books_base_folder.instrumentation). In modalità debug le misure vengono restituite negli header della risposta;
+# con QUERY_INSTRUMENTATION vengono anche scritte, per ogni richiesta, in QUERY_LOG_FILE, anche in produzione.
+# Disattivato di default: il log ha un costo per ogni richiesta, e va attivato per raccogliere le misure per view.
+QUERY_INSTRUMENTATION = False
+
+# Numero massimo di query ripetute elencate nel log per ogni richiesta.
+QUERY_INSTRUMENTATION_DUPLICATES_LIMIT = 5
+
+QUERY_LOG_FILE = os.path.join(BASE_DIR, 'queries.log')
+
+# Durata (in millisecondi) oltre la quale una query viene scritta, con la view che l'ha eseguita e il suo piano di
+# esecuzione, in SLOW_QUERY_LOG_FILE (vedi il comando slow_query_report), indipendentemente da DEBUG e da
+# QUERY_INSTRUMENTATION. Con None le query lente non vengono registrate.
+SLOW_QUERY_THRESHOLD = 100
+
+SLOW_QUERY_LOG_FILE = os.path.join(BASE_DIR, 'slow_queries.log')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'timestamped': {
+            'format': '%(asctime)s %(message)s',
+        },
+        'message': {
+            'format': '%(message)s',
+        },
+    },
+    'handlers': {
+        'queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': QUERY_LOG_FILE,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 3,
+            'delay': True,
+            'formatter': 'timestamped',
+        },
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_QUERY_LOG_FILE,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 3,
+            'delay': True,
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'books_base_folder.instrumentation': {
+            'handlers': ['queries'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'books_base_folder.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+# Profilazione a campionamento delle richieste (vedi books_base_folder.profiling e il comando profile_report):
+# viene profilata una frazione casuale delle richieste e ogni richiesta con l'header firmato
+# REQUEST_PROFILING_HEADER. I profili vengono salvati in REQUEST_PROFILING_DIR, uno per nome dell'URL.
+REQUEST_PROFILING = False
+
+REQUEST_PROFILING_SAMPLE_RATE = 0.01
+
+REQUEST_PROFILING_HEADER = 'X-Profile-Request'
+
+# Validità (in secondi) dei valori firmati dell'header generati da profile_report --token.
+REQUEST_PROFILING_TOKEN_MAX_AGE = 60 * 60
+
+# Intervallo di campionamento degli stack (in secondi).
+REQUEST_PROFILING_INTERVAL = 0.005
+
+REQUEST_PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
@@ -0,0 +1,23 @@
+import sqlite3
+
+
+def backup_database(connection, path):
+    """
+    Copia in path il database SQLite della connessione, con l'API di backup di SQLite, che funziona anche con il
+    database in uso da altri processi.
+    :param connection: Connessione di Django al database da copiare.
+    """
+    connection.ensure_connection()
+    if connection.in_atomic_block:
+        # Il backup attenderebbe la fine della transazione in corso (ad esempio nei test): il database viene invece
+        # serializzato dalla stessa connessione, comprese le modifiche non ancora confermate (serialize richiede
+        # Python 3.11, vedi Pipfile).
+        with open(path, 'wb') as file:
+            file.write(connection.connection.serialize())
+        return
+
+    copy = sqlite3.connect(path)
+    try:
+        connection.connection.backup(copy)
+    finally:
+        copy.close()
@@ -0,0 +1,42 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ['DEFERRED', 'IMMEDIATE', 'EXCLUSIVE']
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Backend SQLite per l'uso con più processi, che riconosce due opzioni (OPTIONS di DATABASES) oltre a quelle del
+    backend sqlite3 di Django:
+        - init_command: istruzioni PRAGMA, separate da punto e virgola, eseguite a ogni nuova connessione (ad
+          esempio journal_mode=WAL, con cui le letture non bloccano le scritture)
+        - transaction_mode: modalità di BEGIN delle transazioni (DEFERRED, IMMEDIATE o EXCLUSIVE)
+    Con IMMEDIATE una transazione acquisisce il lock di scrittura all'inizio, attendendo per al più timeout secondi
+    le altre scritture. Con DEFERRED, il comportamento predefinito di SQLite, una transazione che prima legge e poi
+    scrive non può attendere il lock di un'altra transazione (andrebbe in stallo) e fallisce subito con "database is
+    locked", anche con un timeout.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        options = self.settings_dict['OPTIONS']
+        self.init_command = options.get('init_command', '')
+        self.transaction_mode = options.get('transaction_mode', 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured("transaction_mode deve essere uno tra %s." % ", ".join(TRANSACTION_MODES))
+
+    def get_connection_params(self):
+        params = super(DatabaseWrapper, self).get_connection_params()
+        params.pop('init_command', None)
+        params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super(DatabaseWrapper, self).get_new_connection(conn_params)
+        for statement in self.init_command.split(';'):
+            if statement.strip():
+                connection.execute(statement)
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN %s" % self.transaction_mode)
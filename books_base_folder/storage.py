@@ -0,0 +1,152 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+import time
+
+from PIL import Image
+from django.core.files.storage import FileSystemStorage
+
+CONTENT_ADDRESSED_PREFIX = 'cas/'
+
+
+def is_content_addressed(name):
+    """
+    :return: True se il file è memorizzato nell'archivio indirizzato per contenuto, False altrimenti.
+    """
+    return bool(name) and name.startswith(CONTENT_ADDRESSED_PREFIX)
+
+
+def derivative_name(name, suffix, extension):
+    """
+    I file derivati (ad esempio le miniature) vengono memorizzati accanto al file originale, con il suo hash
+    seguito da un suffisso: come l'originale non cambiano mai, e vengono eliminati insieme a esso.
+    :param name: Nome del file originale nell'archivio.
+    :param suffix: Suffisso che identifica il derivato, ad esempio la larghezza.
+    :param extension: Estensione del derivato, senza punto.
+    :return: Nome del file derivato.
+    """
+    return "%s-%s.%s" % (posixpath.splitext(name)[0], suffix, extension)
+
+
+def is_derivative(name):
+    """
+    :return: True se il nome è quello di un file derivato o di un file temporaneo, False altrimenti.
+    """
+    return '-' in posixpath.basename(name)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Storage che memorizza ogni file con il nome dato dall'hash SHA-256 del suo contenuto, ignorando il nome
+    proposto (ne viene mantenuta solo l'estensione, ricavata dal formato se il file è un'immagine).
+    File con lo stesso contenuto vengono salvati una sola volta e condivisi, quindi non possono essere eliminati
+    insieme all'oggetto che li usa: i riferimenti vengono contati da StoredFile e i file non più utilizzati
+    vengono rimossi dal comando collect_media.
+    Essendo immutabili, i file possono essere serviti con header di cache di lunga durata.
+    """
+
+    @staticmethod
+    def content_name(content, name):
+        """
+        :param content: Contenuto del file.
+        :param name: Nome proposto per il file.
+        :return: Nome del file nell'archivio, del tipo cas/ab/cd/abcd...<estensione>.
+        """
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+
+        extension = os.path.splitext(name)[1].lower()
+        try:
+            content.seek(0)
+            image_format = Image.open(content).format
+            extension = '.jpg' if image_format == 'JPEG' else '.%s' % image_format.lower()
+        except (IOError, AttributeError):
+            pass
+        finally:
+            content.seek(0)
+
+        return posixpath.join(CONTENT_ADDRESSED_PREFIX.rstrip('/'), digest[:2], digest[2:4], digest + extension)
+
+    def get_available_name(self, name, max_length=None):
+        """
+        Il nome definitivo viene calcolato dal contenuto in _save: il nome proposto non deve essere reso unico.
+        """
+        return name
+
+    def _save(self, name, content):
+        """
+        Scrive il file solo se non esiste già un file con lo stesso contenuto. Il file viene scritto in un file
+        temporaneo e poi rinominato, così che salvataggi concorrenti dello stesso contenuto non producano mai file
+        parziali. Se il file esiste già ne viene aggiornata la data di modifica, in modo che collect_media non lo
+        elimini mentre viene riutilizzato.
+        """
+        name = self.content_name(content, name)
+        path = self.path(name)
+
+        if os.path.exists(path):
+            os.utime(path)
+            return name
+
+        self.write(path, content)
+        return name
+
+    def save_derivative(self, name, content):
+        """
+        Scrive un file derivato con il nome indicato (vedi derivative_name).
+        :param content: Contenuto del file.
+        """
+        self.write(self.path(name), content)
+
+    def write(self, path, content):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary_path, self.file_permissions_mode)
+            os.replace(temporary_path, path)
+        except Exception:
+            os.remove(temporary_path)
+            raise
+
+    def is_expired(self, name, grace_period):
+        """
+        :return: True se il file non è stato scritto né riutilizzato da almeno grace_period secondi.
+        """
+        try:
+            return os.path.getmtime(self.path(name)) < time.time() - grace_period
+        except FileNotFoundError:
+            return True
+
+    def delete(self, name):
+        """
+        Elimina il file e, se appartiene all'archivio, i suoi file derivati.
+        """
+        if is_content_addressed(name) and not is_derivative(name):
+            base = posixpath.splitext(posixpath.basename(name))[0] + '-'
+            directory = os.path.dirname(self.path(name))
+            if os.path.isdir(directory):
+                for file in os.listdir(directory):
+                    if file.startswith(base):
+                        os.remove(os.path.join(directory, file))
+        super(ContentAddressedStorage, self).delete(name)
+
+    def list_content_addressed(self):
+        """
+        :return: Generatore dei nomi di tutti i file originali presenti nell'archivio (esclusi i derivati).
+        """
+        root = self.path(CONTENT_ADDRESSED_PREFIX)
+        for directory, _, files in os.walk(root):
+            for file in files:
+                if not file.startswith('.upload-') and not is_derivative(file):
+                    relative = os.path.relpath(os.path.join(directory, file), self.location)
+                    yield relative.replace(os.sep, '/')
+
+
+content_storage = ContentAddressedStorage()
@@ -0,0 +1,30 @@
+"""
+Impostazioni usate dai test (python manage.py test): le stesse del progetto, con una cache in memoria del processo
+dei test, così che i test non leggano né svuotino la cache su file condivisa con il server di sviluppo, e con i
+database su file usati dai test del backend SQLite e delle repliche.
+"""
+import os
+import tempfile
+
+from books_base_folder.settings import *  # noqa: F401,F403
+from books_base_folder.settings import DATABASES
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Database su file per i test del backend SQLite, che aprono più connessioni concorrenti allo stesso database (il
+# database dei test di default è in memoria). Viene creato e distrutto dal test runner solo per i test che lo usano.
+DATABASES['sqlite_backend_test'] = dict(DATABASES['default'], TEST={
+    'NAME': os.path.join(tempfile.gettempdir(), 'bookcamp_sqlite_backend_test.sqlite3'),
+    'MIGRATE': False,
+})
+
+# Replica usata dai test del router delle repliche (che la attivano con DATABASE_REPLICAS = ['replica']): una copia su
+# file del database dei test, fatta dai test stessi, e quindi non aggiornata dopo la copia.
+DATABASES['replica'] = dict(DATABASES['default'], TEST={
+    'NAME': os.path.join(tempfile.gettempdir(), 'bookcamp_replica_test.sqlite3'),
+    'MIGRATE': False,
+})
@@ -0,0 +1,467 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction, OperationalError
+from django.db.migrations.autodetector import MigrationAutodetector
+from django.db.migrations.loader import MigrationLoader
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from book_management.models import Book, Author, BookStats
+from books_base_folder.instrumentation import QueryBudgetMixin, QueryRecorder, fingerprint, explained_plans
+from books_base_folder.profiling import StackSampler, ViewProfile, make_token
+from books_base_folder.sqlite_backend.backup import backup_database
+from comment_management.models import Topic, Comment, Like, Bookmark
+from user_management.models import Profile, ProfileBook, FollowRelation
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    """
+    Test del numero massimo di query delle pagine principali. Ogni pagina mostra più oggetti per lista, così che
+    una query aggiunta per ciascun oggetto (N+1) faccia superare il budget. Le richieste vengono eseguite con la
+    cache vuota, quindi i budget sono quelli del caso peggiore.
+    """
+
+    def setUp(self):
+        """
+        Setup di un ambiente di test. Crea i seguenti oggetti a scopo di test:
+            - Tre utenti con profilo, il primo dei quali segue gli altri due
+            - Tre libri con autore, nel bookshelf di tutti i profili
+            - Un topic di ciascun utente per ciascun libro, con un commento, un like e un bookmark del primo utente
+        """
+        self.users = [get_user_model().objects.create_user('user%d' % i, 'user%d@mail.com' % i, 'password')
+                      for i in range(3)]
+        profiles = [Profile.objects.create(first_name="Nome %d" % i, last_name="Cognome", user=user)
+                    for i, user in enumerate(self.users)]
+        for profile in profiles[1:]:
+            FollowRelation.objects.create(user_following=self.users[0], profile_followed=profile)
+
+        statuses = [ProfileBook.READ, ProfileBook.READING, ProfileBook.MUST_READ]
+        self.books = []
+        for i in range(3):
+            book = Book.objects.create(title="Libro %d" % i, isbn_10="", isbn_13="")
+            book.authors.add(Author.objects.create(name="Autore %d" % i))
+            self.books.append(book)
+            for j, profile in enumerate(profiles):
+                ProfileBook.objects.create(profile_owner=profile, book=book, status=statuses[(i + j) % 3], rating=60)
+
+        self.topics = []
+        for user in self.users:
+            for book in self.books:
+                topic = Topic.objects.create(user_owner=user, book=book, title="Topic", message="<p>Messaggio</p>")
+                Comment.objects.create(user_owner=self.users[0], topic=topic, message="Commento")
+                Like.objects.create(user_owner=self.users[0], topic=topic)
+                Bookmark.objects.create(user_owner=self.users[0], topic=topic)
+                self.topics.append(topic)
+
+        self.client.login(username='user0', password='password')
+
+    def assertQueryBudget(self, budget, url, method='get', **kwargs):
+        cache.clear()
+        response = super(QueryBudgetTest, self).assertQueryBudget(budget, url, method, **kwargs)
+        self.assertEquals(response.status_code, 200)
+        return response
+
+    def test_homepage_query_budget(self):
+        self.assertQueryBudget(25, reverse('home'))
+
+    def test_book_page_query_budget(self):
+        self.assertQueryBudget(26, reverse('view-public-book', kwargs={'pk': self.books[0].pk}))
+
+    def test_topic_page_query_budget(self):
+        self.assertQueryBudget(16, reverse('comment_management:view-topic', kwargs={'pk': self.topics[0].pk}))
+
+    def test_profile_query_budget(self):
+        self.assertQueryBudget(22, reverse('user_management:view-profile', kwargs={'pk': self.users[1].pk}))
+        self.assertQueryBudget(66, reverse('user_management:view-profile', kwargs={'pk': self.users[0].pk}))
+
+    def test_bookshelf_query_budget(self):
+        self.assertQueryBudget(20, reverse('user_management:bookshelf', kwargs={'pk': self.users[1].pk}))
+
+    def test_search_query_budget(self):
+        self.assertQueryBudget(18, reverse('search') + '?search=Libro')
+
+    def test_statistics_query_budget(self):
+        self.assertQueryBudget(10, reverse('statistics'))
+
+
+class QueryInstrumentationTest(TestCase):
+    """
+    Test della misura delle query delle richieste.
+    """
+
+    def setUp(self):
+        self.book = Book.objects.create(title="Libro di prova", isbn_10="", isbn_13="")
+        self.book.authors.add(Author.objects.create(name="Autore 1"), Author.objects.create(name="Autore 2"))
+
+    def test_fingerprint(self):
+        """
+        Test dell'impronta delle query, uguale per la stessa query eseguita con valori diversi.
+        """
+        self.assertEquals(fingerprint('SELECT * FROM "book" WHERE "id" IN (%s, %s, %s) AND "title" = \'a\''),
+                          fingerprint('SELECT * FROM "book"  WHERE "id" IN (%s, %s) AND "title" = \'b\''))
+
+        with QueryRecorder() as recorder:
+            for author in Author.objects.all():
+                list(author.book_authors.all())
+        self.assertEquals(recorder.count, 3)
+        self.assertEquals(recorder.duplicates_count, 1)
+
+    @override_settings(DEBUG=True, QUERY_INSTRUMENTATION=True)
+    def test_middleware(self):
+        """
+        Test degli header della risposta in modalità debug e del log raggruppabile per nome dell'URL.
+        """
+        with self.assertLogs('books_base_folder.instrumentation', 'INFO') as logs:
+            response = self.client.get(reverse('view-public-book', kwargs={'pk': self.book.pk}))
+
+        self.assertGreater(int(response['X-Query-Count']), 0)
+        self.assertIn('X-Query-Time', response)
+        self.assertIn('X-Duplicate-Queries', response)
+        self.assertIn("GET view-public-book: %s query" % response['X-Query-Count'], logs.output[0])
+
+    def test_middleware_switches(self):
+        """
+        Test delle impostazioni indipendenti di header e log: gli header solo in modalità debug, il log solo con
+        QUERY_INSTRUMENTATION, anche fuori dalla modalità debug.
+        """
+        url = reverse('view-public-book', kwargs={'pk': self.book.pk})
+        with override_settings(DEBUG=True, QUERY_INSTRUMENTATION=False):
+            with self.assertNoLogs('books_base_folder.instrumentation', 'INFO'):
+                response = Client().get(url)
+            self.assertIn('X-Query-Count', response)
+
+        with override_settings(DEBUG=False, QUERY_INSTRUMENTATION=True):
+            with self.assertLogs('books_base_folder.instrumentation', 'INFO'):
+                response = Client().get(url)
+            self.assertNotIn('X-Query-Count', response)
+
+        with override_settings(DEBUG=False, QUERY_INSTRUMENTATION=False, SLOW_QUERY_THRESHOLD=None):
+            with self.assertNoLogs('books_base_folder', 'INFO'):
+                Client().get(url)
+
+    @override_settings(DEBUG=False, QUERY_INSTRUMENTATION=False, SLOW_QUERY_THRESHOLD=0)
+    def test_slow_queries(self):
+        """
+        Test del log delle query lente (con soglia nulla tutte le query sono lente), attivo anche fuori dalla
+        modalità debug e senza QUERY_INSTRUMENTATION, e del report che le classifica per tempo totale, con il piano
+        di esecuzione.
+        """
+        explained_plans.clear()
+        url = reverse('view-public-book', kwargs={'pk': self.book.pk})
+        with self.assertLogs('books_base_folder.slow_queries', 'WARNING') as logs:
+            self.client.get(url)
+            self.client.get(url)
+
+        records = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertTrue(all(record['view'] == 'view-public-book' for record in records))
+        book_query = next(record for record in records if '"book_management_book"."id" = %s' in record['sql'])
+        self.assertTrue(any(row.startswith('SEARCH') for row in book_query['plan']))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'slow_queries.log')
+            with open(path, 'w') as file:
+                file.writelines(record.getMessage() + '\n' for record in logs.records)
+            output = StringIO()
+            call_command('slow_query_report', file=path, view='view-public-book', limit=100, stdout=output)
+
+        self.assertIn("2 esecuzioni", output.getvalue())
+        self.assertIn(book_query['fingerprint'], output.getvalue())
+
+
+class BenchmarkTest(TestCase):
+    """
+    Test della generazione dei dati sintetici e del benchmark delle pagine principali.
+    """
+
+    def test_seed_and_run_bench(self):
+        """
+        Test dei volumi generati, della coerenza dei dati ricostruiti dopo gli inserimenti bulk e del report JSON
+        del benchmark, eseguito in un solo processo.
+        """
+        call_command('seed_bench', users=6, books=10, authors=4, follows=2, shelf=4, topics=12, comments=30,
+                     likes=30, stdout=StringIO())
+
+        self.assertEquals(Profile.objects.filter(user__username__startswith='bench_').count(), 6)
+        self.assertEquals(Book.objects.count(), 10)
+        self.assertEquals(Topic.objects.count(), 12)
+        self.assertEquals(Comment.objects.count(), 30)
+        self.assertEquals(sum(Topic.objects.values_list('num_comments', flat=True)), 30)
+        stats = sorted(BookStats.objects.values_list('book_id', 'read_count', 'reading_count', 'must_read_count'))
+        BookStats.rebuild()
+        self.assertEquals(stats, sorted(BookStats.objects.values_list('book_id', 'read_count', 'reading_count',
+                                                                      'must_read_count')))
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            call_command('run_bench', requests=2, processes=1, warmup=0, output=output, stdout=StringIO())
+            with open(output) as file:
+                report = json.load(file)
+
+        self.assertEquals(set(report['views']), {'home', 'view-public-book', 'comment_management:view-topic',
+                                                 'user_management:view-profile', 'user_management:bookshelf',
+                                                 'search', 'statistics'})
+        for view in report['views'].values():
+            self.assertEquals(view['requests'], 2)
+            self.assertEquals(view['errors'], 0)
+            self.assertLessEqual(view['p50'], view['p99'])
+
+    def test_advise_indexes(self):
+        """
+        Test del consigliere di indici su un carico di lavoro registrato da run_bench: gli indici non usati dal
+        carico vengono scartati, quelli consigliati finiscono nella migrazione generata.
+        """
+        call_command('seed_bench', users=6, books=10, authors=4, follows=2, shelf=4, topics=12, comments=30,
+                     likes=30, stdout=StringIO())
+
+        with tempfile.TemporaryDirectory() as directory:
+            workload = os.path.join(directory, 'workload.jsonl')
+            call_command('run_bench', requests=2, processes=1, warmup=0, capture=workload, stdout=StringIO())
+            output = StringIO()
+            call_command('advise_indexes', workload, repeat=1, min_gain=-100, write_migrations=True,
+                         migrations_dir=directory, stdout=output,
+                         candidate=['user_management.ProfileBook:profile_owner,status',
+                                    'comment_management.Comment:user_owner,creation_date_time',
+                                    'comment_management.Topic:title'])
+            migrations = [name for name in os.listdir(directory) if name.endswith('.py')]
+            with open(os.path.join(directory, migrations[0])) as file:
+                migration = file.read()
+
+        self.assertIn("user_management.ProfileBook(profile_owner, status): già presente", output.getvalue())
+        self.assertIn("comment_management.Topic(title): non usato dal carico di lavoro", output.getvalue())
+        leaves = MigrationLoader(None, ignore_no_migrations=True).graph.leaf_nodes('comment_management')
+        number = max(MigrationAutodetector.parse_number(name) or 0 for _, name in leaves) + 1
+        self.assertEquals(migrations, ['%04d_advised_indexes.py' % number])
+        self.assertIn("migrations.AddIndex(", migration)
+        self.assertIn("fields=['user_owner', 'creation_date_time']", migration)
+
+
+def busy_loop(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class RequestProfilingTest(TestCase):
+    """
+    Test della profilazione delle richieste e del report per view.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.book = Book.objects.create(title="Libro di prova", isbn_10="", isbn_13="")
+        self.url = reverse('view-public-book', kwargs={'pk': self.book.pk})
+
+    def profiling_settings(self, sample_rate=0):
+        return override_settings(REQUEST_PROFILING=True, REQUEST_PROFILING_SAMPLE_RATE=sample_rate,
+                                 REQUEST_PROFILING_DIR=self.directory.name, REQUEST_PROFILING_INTERVAL=0.001)
+
+    def test_stack_sampler(self):
+        """
+        Test del campionamento: la funzione in esecuzione è la più costosa del profilo.
+        """
+        with StackSampler(0.001) as sampler:
+            busy_loop(0.1)
+
+        profile = ViewProfile('test', [{'duration': 100, 'samples': sampler.samples}])
+        self.assertGreater(profile.samples_count, 0)
+        function, own, total = profile.hottest(1)[0]
+        self.assertTrue(function.endswith(':busy_loop'))
+        self.assertLessEqual(own, total)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in profile.collapsed().splitlines()))
+
+    def test_signed_header(self):
+        """
+        Test delle richieste con l'header di profilazione: vengono profilate solo quelle con un valore firmato
+        valido.
+        """
+        with self.profiling_settings():
+            Client().get(self.url, HTTP_X_PROFILE_REQUEST='profile:invalid')
+            Client().get(self.url)
+            self.assertEquals(ViewProfile.load_all(), [])
+
+            Client().get(self.url, HTTP_X_PROFILE_REQUEST=make_token())
+            profiles = ViewProfile.load_all()
+
+        self.assertEquals([profile.view_name for profile in profiles], ['view-public-book'])
+        self.assertEquals(profiles[0].requests, 1)
+
+    def test_profile_report(self):
+        """
+        Test del report per view e dell'esportazione degli stack in formato collapsed.
+        """
+        with self.profiling_settings(sample_rate=1):
+            client = Client()
+            for _ in range(3):
+                client.get(self.url)
+
+            output = StringIO()
+            collapsed = os.path.join(self.directory.name, 'collapsed')
+            call_command('profile_report', view='view-public-book', collapsed=collapsed, stdout=output)
+            self.assertIn("view-public-book: 3 richieste", output.getvalue())
+            self.assertTrue(os.path.exists(os.path.join(collapsed, 'view-public-book.collapsed')))
+
+            call_command('profile_report', clear=True, stdout=StringIO())
+            self.assertEquals(ViewProfile.load_all(), [])
+
+
+class SQLiteBackendTest(TransactionTestCase):
+    """
+    Test del backend SQLite per più processi, sul database su file sqlite_backend_test (il database dei test è in
+    memoria, vedi test_settings).
+    """
+    databases = {'default', 'sqlite_backend_test'}
+
+    def test_connection_options(self):
+        """
+        Test dei PRAGMA eseguiti a ogni nuova connessione e dell'attesa dei lock.
+        """
+        with connections['sqlite_backend_test'].cursor() as cursor:
+            pragmas = {}
+            for pragma in ['journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size']:
+                cursor.execute("PRAGMA %s" % pragma)
+                pragmas[pragma] = cursor.fetchone()[0]
+
+        self.assertEquals(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 20000,
+                                    'mmap_size': 268435456, 'cache_size': -65536})
+
+    def test_immediate_transactions(self):
+        """
+        Test delle transazioni IMMEDIATE: transaction.atomic inizia le transazioni con BEGIN IMMEDIATE, e più thread
+        che leggono e poi aggiornano lo stesso contatore attendono il lock di scrittura invece di fallire con
+        "database is locked", senza che nessun aggiornamento vada perso.
+        """
+        database = connections['sqlite_backend_test']
+        with database.cursor() as cursor:
+            cursor.execute("CREATE TABLE counter (value INTEGER)")
+            cursor.execute("INSERT INTO counter VALUES (0)")
+        self.addCleanup(database.cursor().execute, "DROP TABLE counter")
+
+        def increment():
+            with transaction.atomic(using='sqlite_backend_test'):
+                with connections['sqlite_backend_test'].cursor() as cursor:
+                    cursor.execute("SELECT value FROM counter")
+                    value = cursor.fetchone()[0]
+                    # Lascia agli altri thread il tempo di leggere il contatore prima dell'aggiornamento.
+                    time.sleep(0.001)
+                    cursor.execute("UPDATE counter SET value = %s", [value + 1])
+
+        with CaptureQueriesContext(database) as queries:
+            increment()
+        self.assertEquals(queries[0]['sql'], "BEGIN IMMEDIATE")
+
+        errors = []
+
+        def run_increments():
+            try:
+                for _ in range(25):
+                    increment()
+            except OperationalError as error:
+                errors.append(error)
+            finally:
+                connections['sqlite_backend_test'].close()
+
+        threads = [threading.Thread(target=run_increments) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with database.cursor() as cursor:
+            cursor.execute("SELECT value FROM counter")
+            self.assertEquals(cursor.fetchone()[0], 101)
+        self.assertEquals(errors, [])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(TransactionTestCase):
+    """
+    Test del router delle repliche, con una copia del database come replica (vedi test_settings).
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        """
+        Setup di un ambiente di test. Crea un utente con profilo e un topic, poi copia il database nella replica.
+        """
+        self.user = get_user_model().objects.create_user('user', 'user@mail.com', 'password')
+        Profile.objects.create(first_name="Nome", last_name="Cognome", user=self.user)
+        book = Book.objects.create(title="Libro di prova", isbn_10="", isbn_13="")
+        self.topic = Topic.objects.create(user_owner=self.user, book=book, title="Topic", message="<p>Messaggio</p>")
+        self.topic_url = reverse('comment_management:view-topic', kwargs={'pk': self.topic.pk})
+
+        connections['replica'].close()
+        backup_database(connection, connections['replica'].settings_dict['NAME'])
+        cache.clear()
+
+        self.client.login(username='user', password='password')
+
+    def get_topic(self, client):
+        """
+        :return: Risposta alla richiesta della pagina del topic e insieme dei database interrogati per il topic.
+        """
+        with QueryRecorder(0) as recorder:
+            response = client.get(self.topic_url)
+        return response, {alias for alias, sql, _, _, _ in recorder.slow if 'FROM "comment_management_topic"' in sql}
+
+    def test_reads_from_replica(self):
+        """
+        Test delle letture: le richieste GET leggono dalla replica, le query fuori dalle richieste dal database
+        principale.
+        """
+        response, aliases = self.get_topic(self.client)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(aliases, {'replica'})
+        self.assertNotIn(settings.READ_YOUR_WRITES_COOKIE, response.cookies)
+        self.assertEquals(Topic.objects.all().db, 'default')
+
+    def test_read_your_writes(self):
+        """
+        Test della consistenza read-your-writes: dopo aver messo like a un topic l'utente legge dal database
+        principale e vede subito il like, mentre un'altra sessione legge ancora dalla replica non aggiornata.
+        """
+        response = self.client.post(reverse('comment_management:ajax-save-like'),
+                                    {'topic_primary_key': self.topic.pk})
+        self.assertEquals(response.json()['likes_count'], 1)
+        self.assertEquals(response.cookies[settings.READ_YOUR_WRITES_COOKIE]['max-age'],
+                          settings.READ_YOUR_WRITES_WINDOW)
+
+        response, aliases = self.get_topic(self.client)
+        self.assertEquals(response.context['topic'].likes_count, 1)
+        self.assertEquals(aliases, {'default'})
+
+        other_client = Client()
+        other_client.login(username='user', password='password')
+        response, aliases = self.get_topic(other_client)
+        self.assertEquals(response.context['topic'].likes_count, 0)
+        self.assertEquals(aliases, {'replica'})
+
+    def test_caches_not_filled_from_replica(self):
+        """
+        Test delle cache riempite dalle richieste servite dalla replica: il riepilogo del bookshelf e le parti delle
+        card dei topic modificate da poco vengono letti dal database principale, non dalla replica non aggiornata.
+        """
+        profile = self.user.profile
+        profile.first_name = "Modificato"
+        profile.save()
+        ProfileBook.objects.create(profile_owner=profile, book=self.topic.book)
+
+        other_client = Client()
+        other_client.login(username='user', password='password')
+        response, aliases = self.get_topic(other_client)
+        self.assertEquals(aliases, {'replica'})
+        self.assertContains(response, "Modificato Cognome")
+
+        response = other_client.get(reverse('user_management:bookshelf', kwargs={'pk': self.user.pk}))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(cache.get(Profile.bookshelf_summary_cache_key(profile.pk))['total'], 1)
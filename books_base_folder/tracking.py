@@ -0,0 +1,45 @@
+class LoadedValuesMixin(object):
+    """
+    Mixin per model che memorizza i valori dei campi letti dal database, così che al salvataggio si possa sapere
+    quali campi sono cambiati senza rileggere l'oggetto.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(LoadedValuesMixin, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super(LoadedValuesMixin, self).refresh_from_db(using, fields)
+        deferred_fields = self.get_deferred_fields()
+        self.refresh_loaded_values(fields or [field.attname for field in self._meta.concrete_fields
+                                              if field.attname not in deferred_fields])
+
+    def loaded_value(self, field_name, default=None):
+        """
+        :return: Valore del campo letto dal database, default se l'oggetto non è stato letto dal database o il
+            campo non è stato caricato.
+        """
+        return getattr(self, '_loaded_values', {}).get(self._meta.get_field(field_name).attname, default)
+
+    def field_changed(self, field_name):
+        """
+        :return: True se il valore del campo è diverso da quello letto dal database. Per un oggetto non letto dal
+            database o un campo non caricato il valore precedente non è noto e il campo viene considerato cambiato.
+        """
+        field = self._meta.get_field(field_name)
+        loaded_values = getattr(self, '_loaded_values', {})
+        if field.attname not in loaded_values:
+            return True
+        return loaded_values[field.attname] != field.get_prep_value(getattr(self, field.attname))
+
+    def refresh_loaded_values(self, field_names):
+        """
+        Aggiorna i valori memorizzati dei campi dopo un salvataggio.
+        """
+        if not hasattr(self, '_loaded_values'):
+            self._loaded_values = {}
+        for field_name in field_names:
+            field = self._meta.get_field(field_name)
+            self._loaded_values[field.attname] = field.get_prep_value(getattr(self, field.attname))
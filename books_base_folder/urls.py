@@ -37,6 +37,10 @@ urlpatterns = [
 ]
 
 if settings.DEBUG:
+    urlpatterns += [
+        path('%scas/<path:path>' % settings.MEDIA_URL.lstrip('/'), views.content_addressed_media,
+             name='content-addressed-media'),
+    ]
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 else:
     urlpatterns += staticfiles_urlpatterns()
\ No newline at end of file
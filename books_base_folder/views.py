@@ -1,14 +1,18 @@
-from django.contrib.auth import get_user_model
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.paginator import Paginator
 from django.utils.decorators import method_decorator
 from django.views.generic import ListView, TemplateView, FormView
 from django.views.generic.detail import SingleObjectMixin
+from django.views.static import serve
 
 from book_management.decorators import profile_book_exists_only
 from book_management.models import Book
 from books_base_folder.forms import SearchCrispyForm
-from comment_management.models import Topic
+from books_base_folder.pagination import KeysetPaginationMixin
+from books_base_folder.storage import CONTENT_ADDRESSED_PREFIX
+from comment_management.models import Topic, FeedEntry, ActivityCounter, LeaderboardEntry
 from user_management.decorators import has_profile_only
 from user_management.models import Profile, ProfileBook
 
@@ -16,32 +20,41 @@ from user_management.models import Profile, ProfileBook
 class SearchMixin(object):
     """
     Mixin per la ricerca di dati tramite query di ricerca.
+    La ricerca usa gli indici full-text di libri e profili: i risultati sono ordinati per rilevanza e paginati
+    separatamente (parametri GET 'books_page' e 'profiles_page').
     """
+    search_profiles = True
+
+    def get_excluded_books(self):
+        """
+        :return: pk dei libri da escludere dai risultati, lista o queryset.
+        """
+        return []
+
     def get_context_data(self, **kwargs):
         """
-        Scarica i libri e i profili corrispondenti alla query di ricerca. Non vengono scaricati utenti che non hanno
+        Cerca i libri e i profili corrispondenti alla query di ricerca. Non vengono cercati utenti che non hanno
         ancora completato il proprio profilo.
-        :return: libri e profili corrispondenti alla ricerca e query inserita dall'utente.
+        :return: pagina di libri e profili corrispondenti alla ricerca, numero totale dei risultati e query inserita
+            dall'utente.
         """
         context = super(SearchMixin, self).get_context_data(**kwargs)
 
         search_query = self.request.GET.get('search')
 
         if search_query:
-            books = (Book.objects.filter(title__icontains=search_query) |
-                     Book.objects.filter(authors__name__icontains=search_query)).distinct()
-
-            users = (get_user_model().objects.filter(username__icontains=search_query) |
-                     get_user_model().objects.filter(email__icontains=search_query)) \
-                .exclude(pk=self.request.user.pk).exclude(is_superuser=True).exclude(is_active=False) \
-                .exclude(profile=None)
-            profiles = (Profile.objects.filter(user__in=users) |
-                        Profile.objects.filter(first_name__icontains=search_query) |
-                        Profile.objects.filter(last_name__icontains=search_query)) \
-                .exclude(user_id=self.request.user.pk)
-
+            books = Paginator(Book.search(search_query, exclude=self.get_excluded_books()),
+                              settings.SEARCH_PAGE_SIZE).get_page(self.request.GET.get('books_page'))
             context['books'] = books
-            context['profiles'] = profiles
+            context['books_count'] = books.paginator.count
+
+            if self.search_profiles:
+                own_profile = Profile.objects.filter(user_id=self.request.user.pk).values_list('pk', flat=True)
+                profiles = Paginator(Profile.search(search_query, exclude=own_profile),
+                                     settings.SEARCH_PAGE_SIZE).get_page(self.request.GET.get('profiles_page'))
+                context['profiles'] = profiles
+                context['profiles_count'] = profiles.paginator.count
+
             context['search_query'] = search_query
         else:
             context['books'] = None
@@ -51,24 +64,32 @@ class SearchMixin(object):
         return context
 
 
-class HomepageView(ListView):
+class HomepageView(KeysetPaginationMixin, ListView):
     """
     View della Homepage.
     """
     template_name = 'homepage.html'
+    fragment_template_name = 'comment_management/topics_page.html'
+    model = Topic
+    queryset = Topic.objects.select_related('book')
+    extra_context = {'show_book': True}
 
-    def get_queryset(self):
+    def get_keyset_page(self, queryset, cursor, page_size):
         """
-        :return: 20 topic pubblicati più di recente dai profili seguiti dall'utente.
+        :return: Pagina di topic pubblicati più di recente dai profili seguiti dall'utente, letti dal feed
+            materializzato. Per gli utenti anonimi, pagina degli ultimi topic pubblicati.
         """
         if self.request.user.is_authenticated:
-            followings = self.request.user.followed_profiles.all()
-            users = get_user_model().objects.filter(profile__in=followings)
-            topics = Topic.objects.filter(user_owner__in=users)[:20]
-        else:
-            topics = Topic.objects.all()[:20]
+            return FeedEntry.get_feed(self.request.user, before=cursor[0] if cursor else None, limit=page_size)
+        return super(HomepageView, self).get_keyset_page(queryset, cursor, page_size)
 
-        return topics
+    def get_context_data(self, **kwargs):
+        """
+        Carica like e bookmark dell'utente per l'intera pagina di topic.
+        """
+        context = super(HomepageView, self).get_context_data(**kwargs)
+        context['object_list'] = Topic.load_viewer_state(context['object_list'], self.request.user)
+        return context
 
 
 class GrassView(TemplateView):
@@ -103,46 +124,57 @@ class StatisticsView(TemplateView):
 
     def get_context_data(self, **kwargs):
         """
-        Recupera i libri popolari e i profili popolari, per numero di topic e numero di commenti pubblicati.
-        :return: libri e profili popolari.
+        Legge le classifiche materializzate dei libri popolari e dei profili popolari, per numero di topic e numero
+        di commenti pubblicati, nella finestra temporale richiesta (parametro GET 'window').
+        :return: libri e profili popolari, finestre temporali disponibili e finestra selezionata.
         """
         context = super(StatisticsView, self).get_context_data(**kwargs)
 
-        popular_books = Book.get_top_5()
+        window = self.request.GET.get('window', LeaderboardEntry.ALL)
+        if window not in LeaderboardEntry.WINDOW_DAYS:
+            window = LeaderboardEntry.ALL
 
-        popular_users_by_topics = get_user_model().get_popular_by_topics()
-        popular_profiles_by_topics = [user.profile for user in popular_users_by_topics]
+        leaderboards = LeaderboardEntry.get_leaderboards(window)
 
-        popular_users_by_comments = get_user_model().get_popular_by_comments()
-        popular_profiles_by_comments = [user.profile for user in popular_users_by_comments]
+        def profiles(board):
+            result = []
+            for entry in leaderboards[board]:
+                entry.user.profile.leaderboard_score = entry.score
+                result.append(entry.user.profile)
+            return result
 
-        context['popular_books'] = popular_books
-        context['popular_profiles_by_topics'] = popular_profiles_by_topics
-        context['popular_profiles_by_comments'] = popular_profiles_by_comments
+        context['popular_books'] = [entry.book for entry in leaderboards[ActivityCounter.BOOKS_BY_TOPICS]]
+        context['popular_profiles_by_topics'] = profiles(ActivityCounter.USERS_BY_TOPICS)
+        context['popular_profiles_by_comments'] = profiles(ActivityCounter.USERS_BY_COMMENTS)
+        context['windows'] = LeaderboardEntry.WINDOW_CHOICES
+        context['window'] = window
         return context
 
 
-class PublicBookPageView(SingleObjectMixin, ListView):
+class PublicBookPageView(KeysetPaginationMixin, SingleObjectMixin, ListView):
     """
-    View della pagina per la visualizzazione di un libro e dei topic relativi.
+    View della pagina per la visualizzazione di un libro e dei topic relativi, paginati per pk decrescente.
     """
     template_name = 'view_public_book.html'
+    fragment_template_name = 'comment_management/topics_page.html'
     model = Topic
 
     def get(self, request, *args, **kwargs):
         """
         Recupera l'oggetto libro.
         """
-        self.object = Book.objects.get(pk=self.kwargs['pk'])
+        self.object = Book.objects.select_related('stats').get(pk=self.kwargs['pk'])
         return super().get(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
         """
-        Salva l'oggetto libro recuperato nel context.
+        Salva l'oggetto libro recuperato nel context e carica like e bookmark dell'utente per l'intera
+        pagina di topic.
         :return: Oggetto libro.
         """
         context = super(PublicBookPageView, self).get_context_data(**kwargs)
         context['book'] = self.object
+        context['object_list'] = Topic.load_viewer_state(context['object_list'], self.request.user)
         return context
 
     def get_queryset(self):
@@ -162,7 +194,7 @@ class PrivateBookPageView(TemplateView):
         Recupera l'oggetto Book.
         """
         context = super(PrivateBookPageView, self).get_context_data(**kwargs)
-        context['book'] = Book.objects.get(pk=self.kwargs['pk'])
+        context['book'] = Book.objects.select_related('stats').get(pk=self.kwargs['pk'])
         context['profile_book'] = \
             ProfileBook.objects.get(book_id=self.kwargs['pk'], profile_owner_id=self.request.user.profile.pk)
         return context
@@ -171,3 +203,19 @@ class PrivateBookPageView(TemplateView):
 @method_decorator([login_required, has_profile_only], name='dispatch')
 class NotificationsView(TemplateView):
     template_name = 'notifications.html'
+
+
+def content_addressed_media(request, path):
+    """
+    Restituisce un file dell'archivio indirizzato per contenuto. Il nome del file è l'hash del suo contenuto,
+    quindi il file non cambia mai e può essere memorizzato dal browser e dai proxy senza scadenza.
+    Usata solo in sviluppo (DEBUG), come static(): in produzione MEDIA_ROOT/cas/ viene servita dal web server con
+    gli stessi header (vedi CONTENT_ADDRESSED_MEDIA_MAX_AGE).
+    :param path: Percorso del file all'interno dell'archivio.
+    :return: Contenuto del file, con header di cache immutabile.
+    """
+    response = serve(request, CONTENT_ADDRESSED_PREFIX + path, document_root=settings.MEDIA_ROOT)
+    if response.status_code in (200, 304):
+        response['Cache-Control'] = 'public, max-age=%d, immutable' % settings.CONTENT_ADDRESSED_MEDIA_MAX_AGE
+        response['ETag'] = '"%s"' % path.rsplit('/', 1)[-1].split('.')[0]
+    return response
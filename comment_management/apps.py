@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class CommentManagementConfig(AppConfig):
     name = 'comment_management'
+
+    def ready(self):
+        import comment_management.signals
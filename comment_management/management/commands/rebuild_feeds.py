@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from comment_management.models import FeedEntry, Topic
+from user_management.models import FollowRelation, Profile
+
+
+class Command(BaseCommand):
+    """
+    Ricostruisce da zero i feed materializzati di tutti gli utenti.
+    """
+    help = "Ricostruisce i feed della homepage di tutti gli utenti."
+
+    def handle(self, *args, **options):
+        """
+        Ricalcola quali profili vengono distribuiti in lettura, svuota i feed e li ripopola in blocco:
+        per ogni profilo seguito vengono letti una sola volta i suoi ultimi topic, poi inseriti nei feed
+        di tutti i suoi follower.
+        """
+        with transaction.atomic():
+            fan_out_on_read = Profile.objects.annotate(num_followers=Count('follower_relations'))\
+                .filter(num_followers__gt=settings.FEED_FAN_OUT_MAX_FOLLOWERS).values_list('pk', flat=True)
+            fan_out_on_read = list(fan_out_on_read)
+            Profile.objects.filter(pk__in=fan_out_on_read).update(feed_fan_out_on_read=True)
+            Profile.objects.exclude(pk__in=fan_out_on_read).update(feed_fan_out_on_read=False)
+
+            FeedEntry.objects.all().delete()
+
+            followers_by_profile = {}
+            relations = FollowRelation.objects.exclude(profile_followed_id__in=fan_out_on_read)\
+                .values_list('profile_followed__user_id', 'user_following_id')
+            for author_id, follower_id in relations.iterator():
+                followers_by_profile.setdefault(author_id, []).append(follower_id)
+
+            entries = []
+            entries_count = 0
+            for author_id, followers in followers_by_profile.items():
+                topics = Topic.objects.filter(user_owner_id=author_id)\
+                    .values_list('pk', flat=True)[:settings.FEED_BACKFILL_SIZE]
+                for topic_id in topics:
+                    entries.extend(FeedEntry(user_owner_id=follower_id, topic_id=topic_id)
+                                   for follower_id in followers)
+
+                if len(entries) >= settings.FEED_BATCH_SIZE:
+                    FeedEntry.objects.bulk_create(entries, batch_size=settings.FEED_BATCH_SIZE)
+                    entries_count += len(entries)
+                    entries = []
+
+            FeedEntry.objects.bulk_create(entries, batch_size=settings.FEED_BATCH_SIZE)
+            entries_count += len(entries)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Feed ricostruiti: %d elementi, %d profili distribuiti in lettura." % (entries_count, len(fan_out_on_read))))
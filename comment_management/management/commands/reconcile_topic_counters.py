@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+
+from comment_management.models import Topic
+
+
+class Command(BaseCommand):
+    """
+    Riallinea i contatori denormalizzati dei topic con i like, bookmark e commenti presenti nel database.
+    """
+    help = "Ricalcola i contatori di like, bookmark e commenti dei topic che non sono allineati."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Numero di topic aggiornati per ogni UPDATE.")
+
+    def handle(self, *args, **options):
+        """
+        Individua con una sola query i topic con almeno un contatore disallineato e li aggiorna a blocchi
+        con un UPDATE per blocco.
+        """
+        expressions = {'real_%s' % name: expression for name, expression in Topic.counters_expressions().items()}
+        drifted = Topic.objects.annotate(**expressions)\
+            .filter(~Q(num_likes=F('real_num_likes')) | ~Q(num_bookmarks=F('real_num_bookmarks')) |
+                    ~Q(num_comments=F('real_num_comments')))\
+            .values_list('pk', flat=True)
+        drifted = list(drifted)
+
+        batch_size = options['batch_size']
+        for start in range(0, len(drifted), batch_size):
+            with transaction.atomic():
+                Topic.objects.filter(pk__in=drifted[start:start + batch_size]).update(**Topic.counters_expressions())
+
+        self.stdout.write(self.style.SUCCESS("Topic riallineati: %d." % len(drifted)))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from comment_management.models import ActivityCounter, LeaderboardEntry
+
+
+class Command(BaseCommand):
+    """
+    Ricalcola le classifiche della pagina delle statistiche. Va eseguito periodicamente (ad esempio una volta
+    al giorno) per far scorrere le finestre temporali degli ultimi 30 e 7 giorni.
+    """
+    help = "Ricalcola le classifiche di libri e utenti per tutte le finestre temporali."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild-counters', action='store_true',
+                            help="Ricalcola anche i contatori giornalieri a partire da topic e commenti.")
+
+    def handle(self, *args, **options):
+        if options['rebuild_counters']:
+            ActivityCounter.rebuild()
+            self.stdout.write("Contatori giornalieri ricalcolati.")
+
+        LeaderboardEntry.refresh_all()
+        self.stdout.write(self.style.SUCCESS("Classifiche aggiornate."))
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('comment_management', '0003_auto_20201028_1650'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='comment_management.topic')),
+                ('user_owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user_owner', 'topic')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comment_management', '0004_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['topic', 'creation_date_time'], name='comment_topic_creation_idx'),
+        ),
+    ]
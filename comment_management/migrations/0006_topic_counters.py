@@ -0,0 +1,48 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:43
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    """
+    Inizializza i contatori dei topic esistenti.
+    """
+    Topic = apps.get_model('comment_management', 'Topic')
+
+    def count_subquery(model_name):
+        model = apps.get_model('comment_management', model_name)
+        counts = model.objects.filter(topic=OuterRef('pk')).order_by().values('topic')\
+            .annotate(count=Count('pk')).values('count')
+        return Coalesce(Subquery(counts, output_field=models.IntegerField()), 0)
+
+    Topic.objects.update(num_likes=count_subquery('Like'),
+                         num_bookmarks=count_subquery('Bookmark'),
+                         num_comments=count_subquery('Comment'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comment_management', '0005_auto_20261018_1142'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='num_bookmarks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='num_comments',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='num_likes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
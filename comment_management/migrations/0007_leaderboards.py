@@ -0,0 +1,97 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:49
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def populate_leaderboards(apps, schema_editor):
+    """
+    Inizializza i contatori giornalieri e le classifiche a partire da topic e commenti esistenti.
+    """
+    Topic = apps.get_model('comment_management', 'Topic')
+    Comment = apps.get_model('comment_management', 'Comment')
+    ActivityCounter = apps.get_model('comment_management', 'ActivityCounter')
+    LeaderboardEntry = apps.get_model('comment_management', 'LeaderboardEntry')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+
+    sources = [
+        ('BOOKTOPICS', Topic.objects.exclude(book=None), 'book_id'),
+        ('USERTOPICS', Topic.objects.all(), 'user_owner_id'),
+        ('USERCOMMENTS', Comment.objects.all(), 'user_owner_id'),
+    ]
+    for board, queryset, field in sources:
+        rows = queryset.annotate(day=TruncDate('creation_date_time')).order_by()\
+            .values(field, 'day').annotate(count=Count('pk'))
+        ActivityCounter.objects.bulk_create([ActivityCounter(board=board, day=row['day'], subject_id=row[field],
+                                                             count=row['count']) for row in rows])
+
+    for board, _, _ in sources:
+        for window, days in (('ALL', None), ('MONTH', 30), ('WEEK', 7)):
+            counters = ActivityCounter.objects.filter(board=board)
+            if days is not None:
+                counters = counters.filter(day__gte=timezone.localdate() - timedelta(days=days - 1))
+            if board != 'BOOKTOPICS':
+                counters = counters.filter(subject_id__in=User.objects.exclude(profile=None).values('pk'))
+            scores = counters.order_by().values('subject_id').annotate(score=Sum('count'))\
+                .filter(score__gt=0).order_by('-score', 'subject_id')[:settings.LEADERBOARD_SIZE]
+
+            field = 'book_id' if board == 'BOOKTOPICS' else 'user_id'
+            LeaderboardEntry.objects.bulk_create([LeaderboardEntry(board=board, window=window, score=row['score'],
+                                                                   **{field: row['subject_id']})
+                                                  for row in scores])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book_management', '0004_bookstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('comment_management', '0006_topic_counters'),
+        ('user_management', '0031_profile_feed_fan_out_on_read'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(choices=[('BOOKTOPICS', 'Libri con più topic'), ('USERTOPICS', 'Utenti con più topic'), ('USERCOMMENTS', 'Utenti con più commenti')], max_length=12)),
+                ('day', models.DateField()),
+                ('subject_id', models.PositiveIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(choices=[('BOOKTOPICS', 'Libri con più topic'), ('USERTOPICS', 'Utenti con più topic'), ('USERCOMMENTS', 'Utenti con più commenti')], max_length=12)),
+                ('window', models.CharField(choices=[('ALL', 'Sempre'), ('MONTH', 'Ultimi 30 giorni'), ('WEEK', 'Ultimi 7 giorni')], max_length=5)),
+                ('score', models.IntegerField(default=0)),
+                ('book', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to='book_management.book')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-score', 'pk'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='activitycounter',
+            index=models.Index(fields=['board', 'day'], name='activity_board_day_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='activitycounter',
+            unique_together={('board', 'subject_id', 'day')},
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['window', 'board'], name='leaderboard_window_board_idx'),
+        ),
+        migrations.RunPython(populate_leaderboards, migrations.RunPython.noop),
+    ]
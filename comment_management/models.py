@@ -1,9 +1,17 @@
+from datetime import timedelta
+
 import bleach as bleach
 
 from django.conf import settings
-from django.db import models
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models, transaction, DEFAULT_DB_ALIAS
+from django.db.models import F, Count, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
 
-from book_management.models import Book
+from book_management.models import Book, Author
+from books_base_folder.fragments import FragmentVersions
 from tinymce import models as tinymce_models
 
 
@@ -20,6 +28,17 @@ class Topic(models.Model):
     creation_date_time = models.DateTimeField(auto_now_add=True)
     last_modified_date_time = models.DateTimeField(auto_now=True)
 
+    # Contatori denormalizzati, aggiornati con espressioni F() alla creazione ed eliminazione di
+    # like, bookmark e commenti (vedi comment_management.signals).
+    num_likes = models.PositiveIntegerField(default=0)
+    num_bookmarks = models.PositiveIntegerField(default=0)
+    num_comments = models.PositiveIntegerField(default=0)
+
+    # Versioni degli autori (per pk dell'utente) e dei libri mostrati nelle card dei topic, aggiornate tramite
+    # signals: insieme a last_modified_date_time formano la chiave delle parti della card salvate in cache.
+    author_versions = FragmentVersions('topic_author')
+    book_versions = FragmentVersions('topic_book')
+
     def __str__(self):
         return "%s di %s" % (self.title, self.user_owner.username)
 
@@ -28,21 +47,54 @@ class Topic(models.Model):
         """
         :return: Numero di like del topic.
         """
-        return self.likes.all().count()
+        return self.num_likes
 
     @property
     def bookmarks_count(self):
         """
         :return: Numero di salvataggi del topic.
         """
-        return self.bookmarks.all().count()
+        return self.num_bookmarks
 
     @property
     def comments_count(self):
         """
         :return: Numero di commenti del topic.
         """
-        return self.comments.all().count()
+        return self.num_comments
+
+    @staticmethod
+    def counters_expressions():
+        """
+        :return: Espressioni che ricalcolano dal database i contatori di like, bookmark e commenti di un topic.
+        """
+        def count_subquery(model):
+            counts = model.objects.filter(topic=OuterRef('pk')).order_by().values('topic')\
+                .annotate(count=Count('pk')).values('count')
+            return Coalesce(Subquery(counts, output_field=models.IntegerField()), 0)
+
+        return {
+            'num_likes': count_subquery(Like),
+            'num_bookmarks': count_subquery(Bookmark),
+            'num_comments': count_subquery(Comment),
+        }
+
+    @staticmethod
+    def update_counter(topic_id, counter, delta):
+        """
+        Incrementa o decrementa in modo atomico un contatore del topic, senza leggerne il valore.
+        Un contatore non scende mai sotto zero.
+        :param topic_id: pk del topic.
+        :param counter: Nome del campo contatore (num_likes, num_bookmarks, num_comments).
+        :param delta: Variazione del contatore.
+        """
+        if topic_id is None:
+            return
+
+        topics = Topic.objects.filter(pk=topic_id)
+        if delta < 0:
+            topics = topics.filter(**{'%s__gte' % counter: -delta})
+        topics.update(**{counter: F(counter) + delta})
 
     @property
     def comments_set(self):
@@ -51,6 +103,70 @@ class Topic(models.Model):
         """
         return self.comments.all()
 
+    @staticmethod
+    def load_viewer_state(topics, user):
+        """
+        Carica per un'intera pagina di topic se l'utente che visualizza ha messo like o salvato ciascun topic,
+        con una query per i like e una per i bookmark. Il risultato viene salvato sugli oggetti Topic negli
+        attributi viewer_likes e viewer_saved, letti dai filtri user_likes_topic e user_saved_topic.
+        :param topics: Lista o queryset di topic.
+        :param user: Utente che visualizza la pagina.
+        :return: Lista dei topic con lo stato dell'utente.
+        """
+        topics = list(topics)
+        liked = saved = set()
+
+        if user.is_authenticated and topics:
+            topic_ids = [topic.pk for topic in topics]
+            liked = set(Like.objects.filter(user_owner=user, topic_id__in=topic_ids)
+                        .values_list('topic_id', flat=True))
+            saved = set(Bookmark.objects.filter(user_owner=user, topic_id__in=topic_ids)
+                        .values_list('topic_id', flat=True))
+
+        for topic in topics:
+            topic.viewer_likes = topic.pk in liked
+            topic.viewer_saved = topic.pk in saved
+
+        Topic.load_card_versions(topics)
+        return topics
+
+    @staticmethod
+    def load_card_versions(topics):
+        """
+        Calcola la versione della card di ciascun topic, a partire dalla data di ultima modifica del topic e dalle
+        versioni del suo autore e del suo libro, lette dalla cache con una richiesta per ciascun tipo.
+        Il risultato viene salvato nell'attributo card_version, letto dal tag topic_card_version.
+        :param topics: Lista di topic.
+        """
+        authors = Topic.author_versions.get_many({topic.user_owner_id for topic in topics})
+        books = Topic.book_versions.get_many({topic.book_id for topic in topics if topic.book_id is not None})
+
+        for topic in topics:
+            topic.card_version = "%s-%s-%s" % (topic.last_modified_date_time.timestamp(),
+                                               authors[topic.user_owner_id], books.get(topic.book_id, ""))
+
+        # Le parti della card di un topic letto da una replica vengono salvate in cache con dati letti dalla replica:
+        # se la versione dell'autore o del libro è recente la replica può non contenere ancora la modifica che l'ha
+        # creata, e autore e libro vengono riletti dal database principale, così che la cache non venga mai riempita
+        # con dati precedenti alla versione.
+        replica_topics = [topic for topic in topics if topic._state.db in settings.DATABASE_REPLICAS]
+        author_ids = {topic.user_owner_id for topic in replica_topics
+                      if FragmentVersions.is_recent(authors[topic.user_owner_id])}
+        book_ids = {topic.book_id for topic in replica_topics
+                    if topic.book_id is not None and FragmentVersions.is_recent(books[topic.book_id])}
+        if author_ids:
+            users = get_user_model().objects.using(DEFAULT_DB_ALIAS).select_related('profile').in_bulk(author_ids)
+            for topic in replica_topics:
+                if topic.user_owner_id in users:
+                    topic.user_owner = users[topic.user_owner_id]
+        if book_ids:
+            fresh_books = Book.objects.using(DEFAULT_DB_ALIAS)\
+                .prefetch_related(Prefetch('authors', queryset=Author.objects.using(DEFAULT_DB_ALIAS)))\
+                .in_bulk(book_ids)
+            for topic in replica_topics:
+                if topic.book_id in fresh_books:
+                    topic.book = fresh_books[topic.book_id]
+
     def clean(self):
         """
         Pulisce il campo message da tag non autorizzati. Questo previene eventuali errori in visualizzazione
@@ -96,6 +212,14 @@ class Comment(models.Model):
     def __str__(self):
         return self.user_owner.username
 
+    class Meta:
+        """
+        Indice per la lettura paginata (keyset) dei commenti di un topic in ordine di pubblicazione.
+        """
+        indexes = [
+            models.Index(fields=['topic', 'creation_date_time'], name='comment_topic_creation_idx'),
+        ]
+
 
 class Like(models.Model):
     """
@@ -131,4 +255,317 @@ class Bookmark(models.Model):
         """
         Un utente può salvare un topic al più una volta.
         """
-        unique_together = ["user_owner", "topic"]
\ No newline at end of file
+        unique_together = ["user_owner", "topic"]
+
+
+class FeedEntry(models.Model):
+    """
+    Model che contiene un elemento del feed materializzato di un utente (fan-out on write).
+    Ogni riga associa all'utente un topic pubblicato da un profilo che segue. L'eliminazione di un topic
+    elimina a cascata i relativi elementi dei feed.
+    """
+    user_owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                                   related_name="feed_entries")
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name="feed_entries")
+
+    def __str__(self):
+        return "%s - %s" % (self.user_owner.username, self.topic.title)
+
+    @staticmethod
+    def fan_out(topic):
+        """
+        Inserisce il topic nei feed di tutti gli utenti che seguono il profilo dell'autore.
+        I profili con troppi follower non vengono distribuiti in scrittura: i loro topic vengono letti
+        direttamente in fase di lettura del feed (fan-out on read).
+        :param topic: Oggetto Topic appena pubblicato.
+        """
+        try:
+            profile = topic.user_owner.profile
+        except ObjectDoesNotExist:
+            return
+
+        if profile.feed_fan_out_on_read:
+            return
+
+        followers = profile.follower_relations.values_list('user_following_id', flat=True)
+        FeedEntry.objects.bulk_create([FeedEntry(user_owner_id=user_id, topic=topic) for user_id in followers],
+                                      batch_size=settings.FEED_BATCH_SIZE, ignore_conflicts=True)
+
+    @staticmethod
+    def backfill(user_id, profile):
+        """
+        Inserisce nel feed dell'utente gli ultimi topic del profilo che ha iniziato a seguire.
+        :param user_id: pk dell'utente che ha iniziato a seguire.
+        :param profile: Oggetto Profile seguito.
+        """
+        if profile.feed_fan_out_on_read:
+            return
+
+        topics = Topic.objects.filter(user_owner_id=profile.user_id)\
+            .values_list('pk', flat=True)[:settings.FEED_BACKFILL_SIZE]
+        FeedEntry.objects.bulk_create([FeedEntry(user_owner_id=user_id, topic_id=topic_id) for topic_id in topics],
+                                      batch_size=settings.FEED_BATCH_SIZE, ignore_conflicts=True)
+
+    @staticmethod
+    def prune(user_id, profile_id):
+        """
+        Rimuove dal feed dell'utente i topic del profilo che ha smesso di seguire.
+        :param user_id: pk dell'utente che ha smesso di seguire.
+        :param profile_id: pk del profilo non più seguito.
+        """
+        FeedEntry.objects.filter(user_owner_id=user_id, topic__user_owner__profile=profile_id).delete()
+
+    @staticmethod
+    def get_feed(user, before=None, limit=20):
+        """
+        Legge il feed dell'utente con un'unica scansione dell'indice (user_owner, topic) e vi unisce i topic
+        dei profili seguiti che vengono distribuiti in lettura.
+        :param user: Oggetto PlatformUser.
+        :param before: pk del topic da cui proseguire (esclusa), None per la prima pagina.
+        :param limit: Numero massimo di topic.
+        :return: Lista dei topic più recenti del feed, in ordine decrescente di pk.
+        """
+        entries = FeedEntry.objects.filter(user_owner=user)
+        fan_out_on_read_topics = Topic.objects.select_related('book').filter(
+            user_owner__profile__in=user.followed_profiles.filter(feed_fan_out_on_read=True))
+        if before is not None:
+            entries = entries.filter(topic_id__lt=before)
+            fan_out_on_read_topics = fan_out_on_read_topics.filter(pk__lt=before)
+
+        topics = {entry.topic_id: entry.topic
+                  for entry in entries.select_related('topic__book').order_by('-topic_id')[:limit]}
+        for topic in fan_out_on_read_topics[:limit]:
+            topics[topic.pk] = topic
+
+        return [topics[pk] for pk in sorted(topics, reverse=True)[:limit]]
+
+    class Meta:
+        """
+        Un topic compare al più una volta nel feed di un utente.
+        L'indice univoco (user_owner, topic) serve anche la lettura del feed in ordine di topic.
+        """
+        unique_together = ["user_owner", "topic"]
+
+
+class ActivityCounter(models.Model):
+    """
+    Model che contiene il numero di topic o commenti pubblicati in un giorno da un utente, o il numero di topic
+    pubblicati in un giorno su un libro. È la base da cui vengono calcolate le classifiche (LeaderboardEntry).
+    """
+    BOOKS_BY_TOPICS = 'BOOKTOPICS'
+    USERS_BY_TOPICS = 'USERTOPICS'
+    USERS_BY_COMMENTS = 'USERCOMMENTS'
+
+    BOARD_CHOICES = [
+        (BOOKS_BY_TOPICS, "Libri con più topic"),
+        (USERS_BY_TOPICS, "Utenti con più topic"),
+        (USERS_BY_COMMENTS, "Utenti con più commenti"),
+    ]
+
+    board = models.CharField(max_length=12, choices=BOARD_CHOICES)
+    day = models.DateField()
+    subject_id = models.PositiveIntegerField()
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "%s - %s - %s" % (self.board, self.subject_id, self.day)
+
+    @staticmethod
+    def record(board, subject_id, moment, delta):
+        """
+        Aggiorna il contatore giornaliero e le classifiche in cui il soggetto compare o può entrare.
+        :param board: Classifica interessata.
+        :param subject_id: pk del libro o dell'utente.
+        :param moment: Data e ora di pubblicazione del topic o del commento.
+        :param delta: +1 alla pubblicazione, -1 all'eliminazione.
+        """
+        if subject_id is None:
+            return
+
+        day = timezone.localdate(moment)
+        with transaction.atomic():
+            if delta > 0:
+                ActivityCounter.objects.bulk_create(
+                    [ActivityCounter(board=board, day=day, subject_id=subject_id)], ignore_conflicts=True)
+            ActivityCounter.objects.filter(board=board, day=day, subject_id=subject_id)\
+                .update(count=F('count') + delta)
+            LeaderboardEntry.update_subject(board, subject_id, day, delta)
+
+    @staticmethod
+    def rebuild():
+        """
+        Ricalcola da zero tutti i contatori a partire dai topic e dai commenti pubblicati.
+        """
+        sources = [
+            (ActivityCounter.BOOKS_BY_TOPICS, Topic.objects.exclude(book=None), 'book_id'),
+            (ActivityCounter.USERS_BY_TOPICS, Topic.objects.all(), 'user_owner_id'),
+            (ActivityCounter.USERS_BY_COMMENTS, Comment.objects.all(), 'user_owner_id'),
+        ]
+
+        counters = []
+        for board, queryset, field in sources:
+            rows = queryset.annotate(day=TruncDate('creation_date_time')).order_by()\
+                .values(field, 'day').annotate(count=Count('pk'))
+            counters += [ActivityCounter(board=board, day=row['day'], subject_id=row[field], count=row['count'])
+                         for row in rows]
+
+        with transaction.atomic():
+            ActivityCounter.objects.all().delete()
+            ActivityCounter.objects.bulk_create(counters, batch_size=settings.FEED_BATCH_SIZE)
+
+    class Meta:
+        """
+        Un solo contatore per classifica, soggetto e giorno. L'indice (board, day) serve il calcolo delle
+        classifiche sulle finestre temporali.
+        """
+        unique_together = ["board", "subject_id", "day"]
+        indexes = [
+            models.Index(fields=['board', 'day'], name='activity_board_day_idx'),
+        ]
+
+
+class LeaderboardEntry(models.Model):
+    """
+    Model che contiene una posizione di una classifica materializzata, per una delle finestre temporali:
+    sempre, ultimi 30 giorni, ultimi 7 giorni. Ogni classifica contiene al più LEADERBOARD_SIZE righe.
+    Le classifiche vengono aggiornate a ogni pubblicazione o eliminazione di topic e commenti; lo scorrimento
+    delle finestre temporali viene applicato dal comando refresh_leaderboards, da eseguire periodicamente.
+    """
+    ALL = 'ALL'
+    MONTH = 'MONTH'
+    WEEK = 'WEEK'
+
+    WINDOW_CHOICES = [
+        (ALL, "Sempre"),
+        (MONTH, "Ultimi 30 giorni"),
+        (WEEK, "Ultimi 7 giorni"),
+    ]
+
+    WINDOW_DAYS = {
+        ALL: None,
+        MONTH: 30,
+        WEEK: 7,
+    }
+
+    board = models.CharField(max_length=12, choices=ActivityCounter.BOARD_CHOICES)
+    window = models.CharField(max_length=5, choices=WINDOW_CHOICES)
+    score = models.IntegerField(default=0)
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name="leaderboard_entries", null=True, blank=True)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE,
+                             related_name="leaderboard_entries", null=True, blank=True)
+
+    def __str__(self):
+        return "%s - %s - %s" % (self.board, self.window, self.score)
+
+    @staticmethod
+    def subject_field(board):
+        """
+        :return: Nome del campo che contiene il soggetto della classifica.
+        """
+        return 'book_id' if board == ActivityCounter.BOOKS_BY_TOPICS else 'user_id'
+
+    @staticmethod
+    def window_start(window):
+        """
+        :return: Primo giorno della finestra temporale, None se la finestra comprende tutto lo storico.
+        """
+        days = LeaderboardEntry.WINDOW_DAYS[window]
+        return timezone.localdate() - timedelta(days=days - 1) if days is not None else None
+
+    @staticmethod
+    def scores(board, window):
+        """
+        :return: Punteggi positivi dei soggetti della classifica nella finestra temporale, in ordine decrescente.
+            Le classifiche degli utenti comprendono solo gli utenti con un profilo.
+        """
+        counters = ActivityCounter.objects.filter(board=board)
+        start = LeaderboardEntry.window_start(window)
+        if start is not None:
+            counters = counters.filter(day__gte=start)
+        if board != ActivityCounter.BOOKS_BY_TOPICS:
+            counters = counters.filter(subject_id__in=get_user_model().objects.exclude(profile=None).values('pk'))
+
+        return counters.order_by().values('subject_id').annotate(score=Sum('count'))\
+            .filter(score__gt=0).order_by('-score', 'subject_id')
+
+    @staticmethod
+    def refresh(board, window):
+        """
+        Ricalcola una classifica a partire dai contatori giornalieri.
+        """
+        field = LeaderboardEntry.subject_field(board)
+        entries = [LeaderboardEntry(board=board, window=window, score=row['score'], **{field: row['subject_id']})
+                   for row in LeaderboardEntry.scores(board, window)[:settings.LEADERBOARD_SIZE]]
+
+        with transaction.atomic():
+            LeaderboardEntry.objects.filter(board=board, window=window).delete()
+            LeaderboardEntry.objects.bulk_create(entries)
+
+    @staticmethod
+    def refresh_all():
+        """
+        Ricalcola tutte le classifiche, applicando lo scorrimento delle finestre temporali.
+        """
+        for board, _ in ActivityCounter.BOARD_CHOICES:
+            for window, _ in LeaderboardEntry.WINDOW_CHOICES:
+                LeaderboardEntry.refresh(board, window)
+
+    @staticmethod
+    def update_subject(board, subject_id, day, delta):
+        """
+        Aggiorna le classifiche dopo la variazione del contatore di un soggetto, leggendo solo le righe
+        della classifica. Il ricalcolo completo serve solo quando un soggetto in classifica perde punti e
+        potrebbe essere superato da uno che ne è fuori.
+        :param board: Classifica interessata.
+        :param subject_id: pk del libro o dell'utente.
+        :param day: Giorno del contatore modificato.
+        :param delta: Variazione del contatore.
+        """
+        field = LeaderboardEntry.subject_field(board)
+        for window, _ in LeaderboardEntry.WINDOW_CHOICES:
+            start = LeaderboardEntry.window_start(window)
+            if start is not None and day < start:
+                continue
+
+            entries = list(LeaderboardEntry.objects.filter(board=board, window=window))
+            entry = next((e for e in entries if getattr(e, field) == subject_id), None)
+
+            if entry is not None and (delta > 0 or len(entries) < settings.LEADERBOARD_SIZE):
+                if entry.score + delta > 0:
+                    LeaderboardEntry.objects.filter(pk=entry.pk).update(score=F('score') + delta)
+                else:
+                    LeaderboardEntry.objects.filter(pk=entry.pk).delete()
+            elif entry is not None:
+                LeaderboardEntry.refresh(board, window)
+            elif delta > 0:
+                score = LeaderboardEntry.scores(board, window).filter(subject_id=subject_id).first()
+                if score is None:
+                    continue
+                if len(entries) < settings.LEADERBOARD_SIZE:
+                    LeaderboardEntry.objects.create(board=board, window=window, score=score['score'],
+                                                    **{field: subject_id})
+                else:
+                    last = min(entries, key=lambda e: e.score)
+                    if score['score'] > last.score:
+                        LeaderboardEntry.objects.filter(pk=last.pk).delete()
+                        LeaderboardEntry.objects.create(board=board, window=window, score=score['score'],
+                                                        **{field: subject_id})
+
+    @staticmethod
+    def get_leaderboards(window=ALL):
+        """
+        Legge con un'unica query tutte le classifiche della finestra temporale, con profili e libri già caricati.
+        :return: Dizionario del tipo {board: [Lista di LeaderboardEntry in ordine di punteggio decrescente]}
+        """
+        leaderboards = {board: [] for board, _ in ActivityCounter.BOARD_CHOICES}
+        for entry in LeaderboardEntry.objects.filter(window=window).select_related('user__profile', 'book'):
+            leaderboards[entry.board].append(entry)
+        return leaderboards
+
+    class Meta:
+        ordering = ['-score', 'pk', ]
+        indexes = [
+            models.Index(fields=['window', 'board'], name='leaderboard_window_board_idx'),
+        ]
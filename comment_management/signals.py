@@ -0,0 +1,182 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from book_management.models import Book
+from comment_management.models import Topic, FeedEntry, Like, Bookmark, Comment, ActivityCounter
+from user_management.models import FollowRelation, Profile
+
+
+def start_following(user_id, profile):
+    """
+    Aggiorna il feed dell'utente che ha iniziato a seguire il profilo. Se il profilo supera il limite di follower
+    serviti con fan-out on write, viene marcato per essere letto in fase di richiesta del feed.
+    """
+    if not profile.feed_fan_out_on_read and profile.has_too_many_followers_for_fan_out:
+        Profile.objects.filter(pk=profile.pk).update(feed_fan_out_on_read=True)
+        return
+    FeedEntry.backfill(user_id, profile)
+
+
+@receiver(post_save, sender=Topic)
+def fan_out_new_topic(sender, instance, created, **kwargs):
+    """
+    Distribuisce il topic appena pubblicato nei feed dei follower dell'autore.
+    """
+    if created:
+        FeedEntry.fan_out(instance)
+
+
+@receiver(post_save, sender=FollowRelation)
+def backfill_feed_on_follow(sender, instance, created, **kwargs):
+    """
+    Aggiorna il feed quando una relazione di follow viene creata direttamente.
+    """
+    if created:
+        start_following(instance.user_following_id, instance.profile_followed)
+
+
+@receiver(m2m_changed, sender=FollowRelation)
+def backfill_feed_on_followers_add(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Aggiorna il feed quando le relazioni di follow vengono create tramite Profile.followers
+    (o PlatformUser.followed_profiles), che non invia post_save.
+    """
+    if action != 'post_add' or not pk_set:
+        return
+
+    if reverse:
+        for profile in Profile.objects.filter(pk__in=pk_set):
+            start_following(instance.pk, profile)
+    else:
+        for user_id in get_user_model().objects.filter(pk__in=pk_set).values_list('pk', flat=True):
+            start_following(user_id, instance)
+
+
+@receiver(post_delete, sender=FollowRelation)
+def prune_feed_on_unfollow(sender, instance, **kwargs):
+    """
+    Rimuove dal feed dell'utente i topic del profilo che ha smesso di seguire.
+    """
+    FeedEntry.prune(instance.user_following_id, instance.profile_followed_id)
+
+
+TOPIC_COUNTERS = {
+    Like: 'num_likes',
+    Bookmark: 'num_bookmarks',
+    Comment: 'num_comments',
+}
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_save, sender=Bookmark)
+@receiver(post_save, sender=Comment)
+def increment_topic_counter(sender, instance, created, **kwargs):
+    """
+    Incrementa il contatore del topic alla creazione di un like, bookmark o commento.
+    """
+    if created:
+        Topic.update_counter(instance.topic_id, TOPIC_COUNTERS[sender], 1)
+
+
+@receiver(post_delete, sender=Like)
+@receiver(post_delete, sender=Bookmark)
+@receiver(post_delete, sender=Comment)
+def decrement_topic_counter(sender, instance, **kwargs):
+    """
+    Decrementa il contatore del topic all'eliminazione di un like, bookmark o commento, comprese le eliminazioni
+    a cascata (ad esempio quella di un utente).
+    """
+    Topic.update_counter(instance.topic_id, TOPIC_COUNTERS[sender], -1)
+
+
+def leaderboard_subjects(instance):
+    """
+    :return: Coppie (classifica, pk del soggetto) a cui contribuisce un topic o un commento.
+    """
+    if isinstance(instance, Topic):
+        return [(ActivityCounter.USERS_BY_TOPICS, instance.user_owner_id),
+                (ActivityCounter.BOOKS_BY_TOPICS, instance.book_id)]
+    return [(ActivityCounter.USERS_BY_COMMENTS, instance.user_owner_id)]
+
+
+@receiver(post_save, sender=Topic)
+@receiver(post_save, sender=Comment)
+def increment_leaderboards(sender, instance, created, **kwargs):
+    """
+    Aggiorna le classifiche alla pubblicazione di un topic o di un commento.
+    """
+    if created:
+        for board, subject_id in leaderboard_subjects(instance):
+            ActivityCounter.record(board, subject_id, instance.creation_date_time, 1)
+
+
+@receiver(post_delete, sender=Topic)
+@receiver(post_delete, sender=Comment)
+def decrement_leaderboards(sender, instance, **kwargs):
+    """
+    Aggiorna le classifiche all'eliminazione di un topic o di un commento.
+    """
+    for board, subject_id in leaderboard_subjects(instance):
+        ActivityCounter.record(board, subject_id, instance.creation_date_time, -1)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def touch_author_topic_cards(sender, instance, update_fields, **kwargs):
+    """
+    Invalida le card dei topic di un utente quando ne cambia lo username. I salvataggi parziali che non toccano
+    lo username (ad esempio l'aggiornamento di last_login a ogni accesso) vengono ignorati.
+    """
+    if update_fields and 'username' not in update_fields:
+        return
+    Topic.author_versions.touch(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def touch_profile_topic_cards(sender, instance, **kwargs):
+    """
+    Invalida le card dei topic dell'utente quando ne cambiano nome o immagine del profilo.
+    """
+    Topic.author_versions.touch(instance.user_id)
+
+
+@receiver(post_save, sender=Book)
+def touch_book_topic_cards(sender, instance, **kwargs):
+    """
+    Invalida le card dei topic relativi a un libro quando il libro viene modificato.
+    """
+    Topic.book_versions.touch(instance.pk)
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def touch_book_authors_topic_cards(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalida le card dei topic relativi a un libro quando ne cambiano gli autori.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    book_ids = (pk_set or []) if reverse else [instance.pk]
+    for book_id in book_ids:
+        Topic.book_versions.touch(book_id)
+
+
+@receiver(pre_delete, sender=Book)
+def clear_book_activity(sender, instance, **kwargs):
+    """
+    Elimina i contatori di un libro prima della sua eliminazione, così che l'eliminazione a cascata dei suoi
+    topic non lo reinserisca in classifica.
+    """
+    ActivityCounter.objects.filter(board=ActivityCounter.BOOKS_BY_TOPICS, subject_id=instance.pk).delete()
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def clear_user_activity(sender, instance, **kwargs):
+    """
+    Elimina i contatori di un utente prima della sua eliminazione, così che l'eliminazione a cascata dei suoi
+    topic e commenti non lo reinserisca in classifica.
+    """
+    ActivityCounter.objects.filter(board__in=[ActivityCounter.USERS_BY_TOPICS, ActivityCounter.USERS_BY_COMMENTS],
+                                   subject_id=instance.pk).delete()
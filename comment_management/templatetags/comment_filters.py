@@ -1,31 +1,57 @@
+from django.conf import settings
 from django.template.defaulttags import register
 from django.utils.text import Truncator
 
-from comment_management.models import Like, Bookmark, Comment
+from comment_management.models import Like, Bookmark, Comment, Topic
 
 
 @register.filter
 def user_likes_topic(topic, user):
     """
-    Verifica se all'utente piace il topic.
+    Verifica se all'utente piace il topic. Usa lo stato caricato da Topic.load_viewer_state se presente.
     :param topic: Oggetto Topic.
     :param user: Oggetto PlatformUser.
     :return: True se l'utente ha messo like al topic, False altrimenti.
     """
+    if hasattr(topic, 'viewer_likes'):
+        return topic.viewer_likes
     return Like.objects.filter(topic_id=topic.pk, user_owner_id=user.pk).exists()
 
 
 @register.filter
 def user_saved_topic(topic, user):
     """
-    Verifica se l'utente ha salvato il topic.
+    Verifica se l'utente ha salvato il topic. Usa lo stato caricato da Topic.load_viewer_state se presente.
     :param topic: Oggetto Topic.
     :param user: Oggetto PlatformUser.
     :return: True se l'utente ha salvato il topic, False altrimenti.
     """
+    if hasattr(topic, 'viewer_saved'):
+        return topic.viewer_saved
     return Bookmark.objects.filter(topic_id=topic.pk, user_owner_id=user.pk).exists()
 
 
+@register.simple_tag
+def topic_card_version(topic):
+    """
+    Versione della card del topic, usata come chiave delle sue parti salvate in cache. Usa la versione caricata
+    da Topic.load_card_versions se presente.
+    :param topic: Oggetto Topic.
+    :return: Versione della card.
+    """
+    if not hasattr(topic, 'card_version'):
+        Topic.load_card_versions([topic])
+    return topic.card_version
+
+
+@register.simple_tag
+def topic_card_cache_ttl():
+    """
+    :return: Durata in cache delle parti delle card dei topic.
+    """
+    return settings.TOPIC_CARD_CACHE_TTL
+
+
 @register.filter
 def filter_by_user(objects, user):
     """
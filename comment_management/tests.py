@@ -1,11 +1,20 @@
+from datetime import timedelta
+from io import StringIO
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.core.management import call_command
+from django.template.loader import render_to_string
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.utils.timezone import now
 
 from book_management.models import Book, Author
+from books_base_folder.fragments import check_shared_cache
 from comment_management.forms import InsertCommentCrispyForm
-from comment_management.models import Topic, Comment
+from comment_management.models import Topic, Comment, FeedEntry, Like, Bookmark, ActivityCounter, LeaderboardEntry
+from comment_management.templatetags.comment_filters import user_likes_topic, user_saved_topic
+from user_management.models import Profile
 
 
 class TopicPageViewTest(TestCase):
@@ -108,6 +117,7 @@ class TopicPageViewTest(TestCase):
         self.assertEquals(response.status_code, 302)
 
         self.assertEquals(Comment.objects.filter(topic_id=self.topic.pk).count(), 1)
+        self.topic.refresh_from_db()
         self.assertEquals(self.topic.comments_count, 1)
         self.assertEquals(Comment.objects.get(message='Commento di prova POST').user_owner, self.user)
 
@@ -126,6 +136,31 @@ class TopicPageViewTest(TestCase):
         self.assertEquals(self.topic.comments_count, 0)
         self.assertEquals(Comment.objects.filter(message='Commento di prova POST').count(), 0)
 
+    def test_topic_page_view_comments_keyset_pagination_GET(self):
+        """
+        Test della paginazione a cursore dei commenti e della richiesta Ajax "Carica altri".
+        """
+        for i in range(25):
+            Comment.objects.create(user_owner=self.user, topic=self.topic, message="Commento %d" % i)
+
+        response = self.client.get(reverse('comment_management:view-topic', kwargs={'pk': self.topic.pk}))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([c.message for c in response.context['object_list']],
+                          ["Commento %d" % i for i in range(20)])
+        self.assertIsNotNone(response.context['next_cursor'])
+
+        response = self.client.get(reverse('comment_management:view-topic', kwargs={'pk': self.topic.pk}),
+                                   data={'cursor': response.context['next_cursor']},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEquals(response.status_code, 200)
+        self.assertIsNone(response.json()['next_cursor'])
+        self.assertIn("Commento 24", response.json()['html'])
+        self.assertNotIn("Commento 19", response.json()['html'])
+
+        response = self.client.get(reverse('comment_management:view-topic', kwargs={'pk': self.topic.pk}),
+                                   data={'cursor': 'cursore-non-valido'})
+        self.assertEquals(response.status_code, 400)
+
 
 class AjaxSaveLikeTest(TestCase):
     """
@@ -175,8 +210,15 @@ class AjaxSaveLikeTest(TestCase):
         response = self.client.post(reverse('comment_management:ajax-save-like'), data=data)
 
         self.assertEquals(response.status_code, 200)
+        self.topic.refresh_from_db()
         self.assertEquals(Topic.objects.get(pk=self.topic.pk).likes.count(), self.topic.likes_count)
         self.assertEquals(self.topic.likes_count, 1)
+        self.assertEquals(response.json()['likes_count'], 1)
+
+        response = self.client.post(reverse('comment_management:ajax-save-like'), data=data)
+        self.topic.refresh_from_db()
+        self.assertEquals(self.topic.likes_count, 0)
+        self.assertEquals(response.json()['likes_count'], 0)
 
     def test_ajax_save_like_user_not_logged_in_POST(self):
         """
@@ -191,3 +233,292 @@ class AjaxSaveLikeTest(TestCase):
         self.assertEquals(response.status_code, 302)
         self.assertEquals(Topic.objects.get(pk=self.topic.pk).likes.count(), self.topic.likes_count)
         self.assertEquals(self.topic.likes_count, 0)
+
+    def test_load_viewer_state(self):
+        """
+        Test del caricamento dello stato like/bookmark dell'utente per una pagina di topic: una query per i topic,
+        una per i like e una per i bookmark, indipendentemente dal numero di topic.
+        """
+        other_topic = Topic.objects.create(user_owner=self.user, book=self.book, title="Altro topic")
+        Like.objects.create(user_owner=self.user, topic=self.topic)
+        Bookmark.objects.create(user_owner=self.user, topic=other_topic)
+
+        with self.assertNumQueries(3):
+            topics = Topic.load_viewer_state(Topic.objects.all(), self.user)
+            self.assertEquals([(t.viewer_likes, t.viewer_saved) for t in topics], [(False, True), (True, False)])
+
+        with self.assertNumQueries(0):
+            self.assertTrue(user_likes_topic(topics[1], self.user))
+            self.assertTrue(user_saved_topic(topics[0], self.user))
+
+    def test_counters_cascade_and_reconcile(self):
+        """
+        Test dei contatori del topic: decremento nelle eliminazioni a cascata e riallineamento con il comando
+        reconcile_topic_counters.
+        """
+        user = get_user_model().objects.create_user('utente', 'utente@mail.com', 'utentepassword')
+        Like.objects.create(user_owner=user, topic=self.topic)
+        Bookmark.objects.create(user_owner=user, topic=self.topic)
+        Comment.objects.create(user_owner=user, topic=self.topic, message="Commento")
+        self.topic.refresh_from_db()
+        self.assertEquals((self.topic.likes_count, self.topic.bookmarks_count, self.topic.comments_count), (1, 1, 1))
+
+        user.delete()
+        self.topic.refresh_from_db()
+        self.assertEquals((self.topic.likes_count, self.topic.bookmarks_count, self.topic.comments_count), (0, 0, 0))
+
+        Like.objects.bulk_create([Like(user_owner=self.user, topic=self.topic)])
+        call_command('reconcile_topic_counters', stdout=StringIO())
+        self.topic.refresh_from_db()
+        self.assertEquals(self.topic.likes_count, 1)
+
+
+class FeedEntryTest(TestCase):
+    """
+    Test del feed materializzato della homepage.
+    """
+
+    def setUp(self):
+        """
+        Setup di un ambiente di test. Crea i seguenti oggetti a scopo di test:
+            - Utente autore con profilo
+            - Utente follower
+            - Libro
+            - Topic dell'autore
+        """
+        self.client = Client()
+        self.author = get_user_model().objects.create_user('john', 'lennon@thebeatles.com', 'johnpassword')
+        self.follower = get_user_model().objects.create_user('paul', 'mccartney@thebeatles.com', 'paulpassword')
+        self.profile = Profile.objects.create(first_name="John", last_name="Lennon", user=self.author)
+        self.book = Book.objects.create(
+            title="Libro di prova",
+            isbn_10="1234567890",
+            isbn_13="1234567890123",
+        )
+        self.old_topic = Topic.objects.create(user_owner=self.author, book=self.book, title="Topic precedente")
+
+    def test_follow_backfills_feed(self):
+        """
+        Iniziare a seguire un profilo inserisce nel feed i suoi topic già pubblicati.
+        """
+        self.profile.followers.add(self.follower)
+
+        self.assertEquals(FeedEntry.get_feed(self.follower), [self.old_topic])
+
+    def test_new_topic_fan_out(self):
+        """
+        Un nuovo topic viene inserito nel feed dei follower e la homepage lo legge dal feed.
+        """
+        self.profile.followers.add(self.follower)
+        topic = Topic.objects.create(user_owner=self.author, book=self.book, title="Topic nuovo")
+
+        self.assertEquals(FeedEntry.get_feed(self.follower), [topic, self.old_topic])
+
+        self.client.login(username='paul', password='paulpassword')
+        response = self.client.get(reverse('home'))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(list(response.context['object_list']), [topic, self.old_topic])
+
+    def test_unfollow_prunes_feed(self):
+        """
+        Smettere di seguire un profilo rimuove i suoi topic dal feed; eliminare un topic lo rimuove dai feed.
+        """
+        self.profile.followers.add(self.follower)
+        self.old_topic.delete()
+        self.assertEquals(FeedEntry.objects.filter(user_owner=self.follower).count(), 0)
+
+        Topic.objects.create(user_owner=self.author, book=self.book, title="Topic nuovo")
+        self.profile.followers.remove(self.follower)
+        self.assertEquals(FeedEntry.get_feed(self.follower), [])
+
+    @override_settings(FEED_FAN_OUT_MAX_FOLLOWERS=0)
+    def test_fan_out_on_read(self):
+        """
+        I topic dei profili con troppi follower vengono letti al momento della richiesta del feed.
+        """
+        self.profile.followers.add(self.follower)
+        self.profile.refresh_from_db()
+        topic = Topic.objects.create(user_owner=self.author, book=self.book, title="Topic nuovo")
+
+        self.assertTrue(self.profile.feed_fan_out_on_read)
+        self.assertEquals(FeedEntry.objects.filter(user_owner=self.follower).count(), 0)
+        self.assertEquals(FeedEntry.get_feed(self.follower), [topic, self.old_topic])
+
+
+@override_settings(LEADERBOARD_SIZE=2)
+class LeaderboardTest(TestCase):
+    """
+    Test delle classifiche materializzate della pagina delle statistiche.
+    """
+
+    def setUp(self):
+        """
+        Setup di un ambiente di test. Crea i seguenti oggetti a scopo di test:
+            - Tre utenti con profilo
+            - Due libri
+        """
+        self.client = Client()
+        self.users = []
+        for username in ('john', 'paul', 'george'):
+            user = get_user_model().objects.create_user(username, '%s@thebeatles.com' % username, 'password')
+            Profile.objects.create(first_name=username, last_name="Beatle", user=user)
+            self.users.append(user)
+
+        self.books = [Book.objects.create(title="Libro %d" % i, isbn_10="123456789%d" % i,
+                                          isbn_13="123456789012%d" % i) for i in range(2)]
+
+    def create_topics(self, user, book, number):
+        return [Topic.objects.create(user_owner=user, book=book, title="Topic", message="Messaggio")
+                for _ in range(number)]
+
+    def board(self, board, window=LeaderboardEntry.ALL):
+        field = LeaderboardEntry.subject_field(board)
+        return [(getattr(entry, field), entry.score)
+                for entry in LeaderboardEntry.objects.filter(board=board, window=window)]
+
+    def test_incremental_update(self):
+        """
+        Test dell'aggiornamento delle classifiche alla pubblicazione e all'eliminazione di topic.
+        """
+        john_topics = self.create_topics(self.users[0], self.books[0], 3)
+        self.create_topics(self.users[1], self.books[1], 2)
+        self.create_topics(self.users[2], self.books[1], 1)
+
+        self.assertEquals(self.board(ActivityCounter.USERS_BY_TOPICS),
+                          [(self.users[0].pk, 3), (self.users[1].pk, 2)])
+        self.assertEquals(self.board(ActivityCounter.BOOKS_BY_TOPICS),
+                          [(self.books[0].pk, 3), (self.books[1].pk, 3)])
+        self.assertEquals(self.board(ActivityCounter.USERS_BY_TOPICS, LeaderboardEntry.WEEK),
+                          self.board(ActivityCounter.USERS_BY_TOPICS))
+
+        for topic in john_topics[:2]:
+            topic.delete()
+        self.assertEquals(self.board(ActivityCounter.USERS_BY_TOPICS),
+                          [(self.users[1].pk, 2), (self.users[0].pk, 1)])
+
+        self.books[0].delete()
+        self.assertEquals(self.board(ActivityCounter.BOOKS_BY_TOPICS), [(self.books[1].pk, 3)])
+        self.assertEquals(self.board(ActivityCounter.USERS_BY_TOPICS),
+                          [(self.users[1].pk, 2), (self.users[2].pk, 1)])
+
+    def test_refresh_leaderboards(self):
+        """
+        Test del comando refresh_leaderboards: esclusione dalle finestre temporali dei topic meno recenti.
+        """
+        old_topics = self.create_topics(self.users[0], self.books[0], 2)
+        Topic.objects.filter(pk__in=[topic.pk for topic in old_topics])\
+            .update(creation_date_time=now() - timedelta(days=10))
+        self.create_topics(self.users[1], self.books[1], 1)
+
+        call_command('refresh_leaderboards', '--rebuild-counters', stdout=StringIO())
+        self.assertEquals(self.board(ActivityCounter.USERS_BY_TOPICS),
+                          [(self.users[0].pk, 2), (self.users[1].pk, 1)])
+        self.assertEquals(self.board(ActivityCounter.USERS_BY_TOPICS, LeaderboardEntry.MONTH),
+                          [(self.users[0].pk, 2), (self.users[1].pk, 1)])
+        self.assertEquals(self.board(ActivityCounter.USERS_BY_TOPICS, LeaderboardEntry.WEEK),
+                          [(self.users[1].pk, 1)])
+
+    def test_statistics_view(self):
+        """
+        Test della pagina delle statistiche: lettura delle classifiche con un'unica query.
+        """
+        self.create_topics(self.users[0], self.books[0], 2)
+        topic = self.create_topics(self.users[1], self.books[1], 1)[0]
+        Comment.objects.create(user_owner=self.users[2], topic=topic, message="Commento")
+
+        with self.assertNumQueries(1):
+            leaderboards = LeaderboardEntry.get_leaderboards()
+            profiles = [entry.user.profile for entry in leaderboards[ActivityCounter.USERS_BY_COMMENTS]]
+            books = [entry.book for entry in leaderboards[ActivityCounter.BOOKS_BY_TOPICS]]
+        self.assertEquals(profiles, [self.users[2].profile])
+        self.assertEquals(books, self.books)
+
+        response = self.client.get(reverse('statistics'), {'window': LeaderboardEntry.WEEK})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.context['popular_profiles_by_topics'],
+                          [self.users[0].profile, self.users[1].profile])
+        self.assertEquals(response.context['popular_profiles_by_topics'][0].leaderboard_score, 2)
+
+
+class TopicCardCacheTest(TestCase):
+    """
+    Test delle parti delle card dei topic salvate in cache.
+    """
+
+    def setUp(self):
+        """
+        Setup di un ambiente di test. Crea i seguenti oggetti a scopo di test:
+            - Due utenti, il primo con profilo
+            - Libro con autore
+            - Topic del primo utente sul libro
+        """
+        cache.clear()
+        self.user = get_user_model().objects.create_user('john', 'lennon@thebeatles.com', 'johnpassword')
+        self.other_user = get_user_model().objects.create_user('paul', 'paul@thebeatles.com', 'paulpassword')
+        self.profile = Profile.objects.create(first_name="John", last_name="Lennon", user=self.user)
+        self.book = Book.objects.create(title="Libro di prova", isbn_10="", isbn_13="")
+        self.book.authors.add(Author.objects.create(name="Autore di prova"))
+        self.topic = Topic.objects.create(user_owner=self.user, book=self.book, title="Topic di prova",
+                                          message="<p>Messaggio di prova</p>")
+
+    def render(self, user):
+        """
+        :return: Card del topic, letto di nuovo dal database, vista dall'utente.
+        """
+        topic = Topic.load_viewer_state([Topic.objects.get(pk=self.topic.pk)], user)[0]
+        return render_to_string('comment_management/base_topic.html', {'topic': topic, 'user': user,
+                                                                        'show_book': True})
+
+    def test_topic_card_shared_between_users(self):
+        """
+        Test del riutilizzo delle parti in cache da parte di un altro utente, con il menu del proprietario e lo
+        stato di like e bookmark calcolati per ciascun utente.
+        """
+        Like.objects.create(user_owner=self.other_user, topic=self.topic)
+        html = self.render(self.user)
+        self.assertIn("Autore di prova", html)
+        self.assertIn("Lennon", html)
+        self.assertIn("Modifica", html)
+        self.assertIn("like-deselected", html)
+
+        with self.assertNumQueries(3):
+            html = self.render(self.other_user)
+        self.assertIn("Autore di prova", html)
+        self.assertNotIn("Modifica", html)
+        self.assertIn("like-selected", html)
+
+    def test_topic_card_invalidation(self):
+        """
+        Test dell'invalidazione delle parti in cache alla modifica di topic, profilo dell'autore, username e libro.
+        """
+        self.render(self.user)
+
+        self.topic.message = "<p>Messaggio modificato</p>"
+        self.topic.save()
+        self.assertIn("Messaggio modificato", self.render(self.user))
+
+        self.profile.last_name = "McCartney"
+        self.profile.save()
+        self.assertIn("McCartney", self.render(self.user))
+
+        self.user.username = "johnny"
+        self.user.save()
+        self.assertIn("johnny", self.render(self.user))
+
+        self.book.title = "Titolo modificato"
+        self.book.save()
+        self.assertIn("Titolo modificato", self.render(self.user))
+
+        self.book.authors.add(Author.objects.create(name="Secondo autore"))
+        self.assertIn("Secondo autore", self.render(self.user))
+
+    def test_shared_cache_check(self):
+        """
+        Test del controllo di deploy sulla cache: una cache privata di ciascun processo non invaliderebbe le card
+        negli altri worker.
+        """
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEquals([warning.id for warning in check_shared_cache(None)], ['books_base_folder.W001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                                   'LOCATION': '/tmp/cache'}}):
+            self.assertEquals(check_shared_cache(None), [])
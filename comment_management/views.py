@@ -1,5 +1,6 @@
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import transaction
 from django.http import JsonResponse, HttpResponseRedirect
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
@@ -9,6 +10,7 @@ from django.views.generic import CreateView, DeleteView, ListView, UpdateView, V
 from django.views.generic.detail import SingleObjectMixin
 
 from book_management.models import Book
+from books_base_folder.pagination import KeysetPaginationMixin
 from comment_management.decorators import topic_owner_only, comment_owner_only
 from comment_management.forms import NewTopicCrispyForm, UpdateTopicCrispyForm, InsertCommentCrispyForm
 from comment_management.models import Comment, Like, Bookmark, Topic
@@ -28,15 +30,16 @@ def ajax_save_like(request):
     topic_id = request.POST.get('topic_primary_key')
     selected = False
 
-    if Like.objects.filter(topic=topic_id, user_owner_id=request.user.pk).exists():
-        Like.objects.get(topic=topic_id, user_owner_id=request.user.pk).delete()
-    else:
-        topic_obj = Topic.objects.get(pk=topic_id)
-        like = Like(user_owner_id=request.user.pk, topic=topic_obj)
-        like.save()
-        selected = True
+    with transaction.atomic():
+        if Like.objects.filter(topic=topic_id, user_owner_id=request.user.pk).exists():
+            Like.objects.get(topic=topic_id, user_owner_id=request.user.pk).delete()
+        else:
+            topic_obj = Topic.objects.get(pk=topic_id)
+            like = Like(user_owner_id=request.user.pk, topic=topic_obj)
+            like.save()
+            selected = True
 
-    likes_count = Like.objects.filter(topic=topic_id).count()
+        likes_count = Topic.objects.get(pk=topic_id).likes_count
 
     data = {
         'selected': selected,
@@ -61,13 +64,14 @@ def ajax_save_bookmark(request):
     topic_id = request.POST.get('topic_primary_key')
     selected = False
 
-    if Bookmark.objects.filter(topic=topic_id, user_owner_id=request.user.pk).exists():
-        Bookmark.objects.get(topic=topic_id, user_owner_id=request.user.pk).delete()
-    else:
-        topic_obj = Topic.objects.get(pk=topic_id)
-        bookmark = Bookmark(user_owner_id=request.user.pk, topic=topic_obj)
-        bookmark.save()
-        selected = True
+    with transaction.atomic():
+        if Bookmark.objects.filter(topic=topic_id, user_owner_id=request.user.pk).exists():
+            Bookmark.objects.get(topic=topic_id, user_owner_id=request.user.pk).delete()
+        else:
+            topic_obj = Topic.objects.get(pk=topic_id)
+            bookmark = Bookmark(user_owner_id=request.user.pk, topic=topic_obj)
+            bookmark.save()
+            selected = True
 
     data = {
         'selected': selected
@@ -90,7 +94,7 @@ class NewTopicView(LoginRequiredMixin, CreateView):
         :return: Oggetto Book.
         """
         context = super(NewTopicView, self).get_context_data(**kwargs)
-        context['book'] = Book.objects.get(pk=self.kwargs['pk'])
+        context['book'] = Book.objects.select_related('stats').get(pk=self.kwargs['pk'])
 
         return context
 
@@ -129,7 +133,7 @@ class UpdateTopicView(LoginRequiredMixin, UpdateView):
         """
         context = super(UpdateTopicView, self).get_context_data(**kwargs)
         book_pk = Topic.objects.get(pk=self.kwargs['pk']).book_id
-        context['book'] = Book.objects.get(pk=book_pk)
+        context['book'] = Book.objects.select_related('stats').get(pk=book_pk)
 
         return context
 
@@ -169,7 +173,8 @@ class TopicNewComment(LoginRequiredMixin, CreateView):
         self.object = form.save(commit=False)
         self.object.user_owner_id = self.request.user.pk
         self.object.topic_id = self.kwargs['pk']
-        self.object.save()
+        with transaction.atomic():
+            self.object.save()
 
         return super().form_valid(form)
 
@@ -180,12 +185,14 @@ class TopicNewComment(LoginRequiredMixin, CreateView):
         return reverse_lazy('comment_management:view-topic', kwargs={'pk': self.kwargs['pk']})
 
 
-class CommentsList(SingleObjectMixin, ListView):
+class CommentsList(KeysetPaginationMixin, SingleObjectMixin, ListView):
     """
-    View per la visualizzazione della lista di commenti di un topic.
+    View per la visualizzazione della lista di commenti di un topic, paginati in ordine di pubblicazione.
     """
     template_name = 'comment_management/view_topic.html'
+    fragment_template_name = 'comment_management/comments_page.html'
     model = Comment
+    keyset = ('creation_date_time', 'pk')
 
     def get(self, request, *args, **kwargs):
         """
@@ -200,7 +207,7 @@ class CommentsList(SingleObjectMixin, ListView):
         Salva l'oggetto topic e il form nel context.
         """
         context = super(CommentsList, self).get_context_data(**kwargs)
-        context['topic'] = self.object
+        context['topic'] = Topic.load_viewer_state([self.object], self.request.user)[0]
         context['form'] = InsertCommentCrispyForm
         return context
 
@@ -36,13 +36,13 @@ $(function () {
     $('[data-toggle="tooltip"]').tooltip(); // Setup dei tooltip nella pagina.
 
     /** Event listener on click dell'icona like. */
-    $('.like-icon').on('click', function () {
+    $(document).on('click', '.like-icon', function () {
         let pk = $(this).attr('data-post-id');
         ajaxSaveLike(pk, $(this));
     });
 
     /** Event listener on click dell'icona bookmark. */
-    $('.bookmark-icon').on('click', function () {
+    $(document).on('click', '.bookmark-icon', function () {
         let pk = $(this).attr('data-post-id');
         ajaxSaveBookmark(pk, $(this));
     });
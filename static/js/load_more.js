@@ -0,0 +1,44 @@
+/**
+ * Richiesta Ajax per caricare la pagina successiva di una lista paginata a cursore.
+ * success: aggiunge il frammento HTML ricevuto alla lista e aggiorna il cursore del pulsante.
+ * @param $button Pulsante "Carica altri" premuto dall'utente.
+ */
+function ajaxLoadMore($button) {
+    $.ajax({
+        type: 'GET',
+        url: window.location.pathname,
+        data: {
+            'cursor': $button.attr('data-cursor'),
+        },
+        dataType: 'json',
+        beforeSend: function() {
+            $button.hide();
+            $button.after('<div class="spinner-border" role="status"><span class="sr-only">Loading...</span></div>');
+        },
+        complete: function() {
+            $button.siblings('.spinner-border').remove();
+        },
+        success: function(data) {
+            let $list = $($button.attr('data-list'));
+            $list.append(data.html);
+            $list.find('[data-toggle="tooltip"]').tooltip();
+
+            if (data.next_cursor) {
+                $button.attr('data-cursor', data.next_cursor);
+                $button.show();
+            } else {
+                $button.closest('div').remove();
+            }
+        },
+        error: function() {
+            $button.show();
+        }
+    });
+}
+
+$(function () {
+    /** Event listener on click del pulsante Carica altri. */
+    $(document).on('click', '.load-more', function () {
+        ajaxLoadMore($(this));
+    });
+});
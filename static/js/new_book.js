@@ -16,8 +16,8 @@ function fillBookData(data) {
         $('.book-found').show();
 
         if (data.has_cover_image) {
-            date = new Date(); // Necessario per forzare l'aggiornamento  dell'immagine
-            bookCoverImage.attr('src', '/static/img/book.jpeg?' + date.getTime());
+            bookCoverImage.attr('src', data.book_cover_url);
+            bookCoverImage.show();
         }
         else {
             bookCoverImage.hide();
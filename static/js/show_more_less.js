@@ -1,6 +1,6 @@
 $(function () {
     /** Event listener on click del pulsante Leggi tutto di un testo troncato. */
-    $('.text-show-more').on('click', function () {
+    $(document).on('click', '.text-show-more', function () {
         $(this).hide();
         let $box = $(this).closest('.text-box');
         $box.find('.text-show-less').show()
@@ -12,7 +12,7 @@ $(function () {
     });
 
     /** Event listenere on click del pulsante Mostra meno di un testo troncato. */
-    $('.text-show-less').on('click', function () {
+    $(document).on('click', '.text-show-less', function () {
         $(this).hide();
         let $box = $(this).closest('.text-box');
         $box.find('.text-show-more').show();
@@ -7,17 +7,71 @@ function bookshelfOperationSuccess(data, $row) {
     let books_count = $('#books_count')
     books_count.text(parseInt(books_count.text()) - 1);
 
-    let operation_message = "";
-    if (data.status === "deleted")
-        operation_message = '<h6 class="font-6 site-red-text">' +
-                            '<i class="fas fa-times"></i>&nbsp;Eliminato' +
-                            '</h6>'
-    else
-        operation_message = '<h6 class="font-6 text-success">' +
-                            '<i class="fas fa-check"></i>&nbsp;' + data.status +
-                            '</h6>'
-
-    $row.html(operation_message);
+    $row.html(operationMessage(data.status));
+    updateSelection();
+}
+
+/**
+ * @param status Status del libro dopo l'operazione, "deleted" se è stato eliminato.
+ * @return Messaggio da mostrare nella riga del libro al termine di un'operazione.
+ */
+function operationMessage(status) {
+    if (status === "deleted")
+        return '<h6 class="font-6 site-red-text">' +
+               '<i class="fas fa-times"></i>&nbsp;Eliminato' +
+               '</h6>'
+    return '<h6 class="font-6 text-success">' +
+           '<i class="fas fa-check"></i>&nbsp;' + status +
+           '</h6>'
+}
+
+/**
+ * Funzione chiamata onSuccess della richiesta Ajax di modifica multipla del bookshelf.
+ * Aggiorna il conteggio dei libri della categoria e mostra il risultato dell'operazione in ciascuna riga.
+ * @param data Dati ritornati da Ajax.
+ * @param $rows Righe dei libri coinvolti, indicizzate per chiave primaria del libro.
+ */
+function bookshelfBatchSuccess(data, $rows) {
+    let status = $('#update-bookshelf-list').attr('data-status');
+    $('#books_count').text(data.counts[status]);
+
+    $.each(data.results, function(index, result) {
+        let $row = $rows[result.book];
+        if ($row === undefined)
+            return;
+        if (result.error)
+            $row.html('<h6 class="font-6 site-red-text"><i class="fas fa-exclamation"></i>&nbsp;Errore</h6>');
+        else
+            $row.html(operationMessage(result.status));
+    });
+    updateSelection();
+}
+
+/**
+ * Abilita le azioni multiple e aggiorna il numero di libri selezionati.
+ */
+function updateSelection() {
+    let selected = $('.select-book-checkbox:checked').length;
+    $('#selected-books-count').text(selected);
+    $('.bulk-action-button').prop('disabled', selected === 0);
+    $('#select-all-books').prop('checked', selected > 0 && selected === $('.select-book-checkbox').length);
+}
+
+/**
+ * Invia con un'unica richiesta la stessa operazione per tutti i libri selezionati.
+ * @param action Operazione da applicare, "move" o "delete".
+ * @param move_to Stringa rappresentante la categoria in cui spostare i libri, null per l'eliminazione.
+ */
+function updateSelectedBooks(action, move_to) {
+    let operations = [];
+    let $rows = {};
+    $('.select-book-checkbox:checked').each(function () {
+        let pk = $(this).attr('data-post-id');
+        operations.push({'action': action, 'book': pk, 'status': move_to});
+        $rows[pk] = $(this).closest('.bookshelf-element');
+    });
+    if (operations.length > 0)
+        ajaxUpdateBookshelf(operations, $rows);
 }
 
 $(function () {
@@ -47,6 +101,35 @@ $(function () {
         ajaxMoveBook(pk, "MUSTREAD", $(this));
     });
 
+    /** Event listener al cambio della selezione di un libro */
+    $('.select-book-checkbox').on('change', updateSelection);
+
+    /** Event listener al cambio di Seleziona tutti */
+    $('#select-all-books').on('change', function () {
+        $('.select-book-checkbox').prop('checked', $(this).prop('checked'));
+        updateSelection();
+    });
+
+    /** Event listener on click di Elimina dei libri selezionati */
+    $('.bulk-delete-books').on('click', function () {
+        updateSelectedBooks("delete", null);
+    });
+
+    /** Event listener on click di Sposta in libri in lettura dei libri selezionati */
+    $('.bulk-move-book-reading').on('click', function () {
+        updateSelectedBooks("move", "READING");
+    });
+
+    /** Event listener on click di Sposta in libri letti dei libri selezionati */
+    $('.bulk-move-book-read').on('click', function () {
+        updateSelectedBooks("move", "READ");
+    });
+
+    /** Event listener on click di Sposta in libri da leggere dei libri selezionati */
+    $('.bulk-move-book-must-read').on('click', function () {
+        updateSelectedBooks("move", "MUSTREAD");
+    });
+
     /** Event listener on click di Nuovo libro in lettura */
     $('.new-book-reading').on('click', function () {
         let pk = $(this).attr('data-post-id');
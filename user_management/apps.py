@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class UserManagementConfig(AppConfig):
     name = 'user_management'
+
+    def ready(self):
+        import user_management.signals
+        import user_management.jobs
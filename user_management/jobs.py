@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from book_management.jobs import register, register_source
+from book_management.models import BackgroundJob, StoredFile
+from book_management.thumbnails import create_thumbnails
+from books_base_folder.storage import content_storage
+from comment_management.models import Topic
+from user_management.models import Profile
+
+
+@register_source(BackgroundJob.PROFILE_PICTURE)
+def pending_profile_pictures():
+    """
+    :return: Immagini caricate dai profili e non ancora elaborate. La chiave del lavoro è il nome dell'immagine
+        nell'archivio, quindi la stessa immagine caricata da più profili viene elaborata una sola volta.
+    """
+    return Profile.objects.exclude(pending_picture=None).values_list('pending_picture', flat=True).distinct()
+
+
+@register(BackgroundJob.PROFILE_PICTURE)
+def process_profile_picture(uploaded):
+    """
+    Elabora un'immagine caricata da uno o più profili (pending_picture): crea l'immagine quadrata di
+    PROFILE_PICTURE_SIZE pixel e le sue varianti ridotte (PROFILE_PICTURE_VARIANT_SIZES), poi le sostituisce
+    all'immagine precedente di ciascun profilo con un UPDATE, solo se nel frattempo non è stata caricata un'altra
+    immagine, e aggiorna i riferimenti (StoredFile). L'originale caricato non viene mai registrato e viene
+    eliminato da collect_media.
+    """
+    if not Profile.objects.filter(pending_picture=uploaded).exists():
+        return
+
+    with content_storage.open(uploaded) as picture:
+        avatar = content_storage.save('profile.jpg', ContentFile(
+            Profile.square_picture(picture, settings.PROFILE_PICTURE_SIZE)))
+    variants = create_thumbnails(avatar, settings.PROFILE_PICTURE_VARIANT_SIZES)
+
+    for profile in Profile.objects.filter(pending_picture=uploaded).only('picture', 'user'):
+        with transaction.atomic():
+            if Profile.objects.filter(pk=profile.pk, pending_picture=uploaded, picture=profile.picture.name)\
+                    .update(picture=avatar, picture_variants=variants, pending_picture=None):
+                StoredFile.replace_reference(profile.picture.name, avatar)
+                Topic.author_versions.touch(profile.user_id)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from book_management.models import Book
+from user_management.models import Profile
+
+
+class Command(BaseCommand):
+    """
+    Ricostruisce gli indici full-text della ricerca di libri e profili.
+    """
+    help = "Ricostruisce gli indici full-text di libri e profili."
+
+    def handle(self, *args, **options):
+        books = Book.rebuild_search_index()
+        profiles = Profile.rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS("Indicizzati %d libri e %d profili." % (books, profiles)))
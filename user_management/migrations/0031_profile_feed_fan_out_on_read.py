@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_management', '0030_auto_20201031_1718'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='feed_fan_out_on_read',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:02
+
+from django.db import migrations
+
+from books_base_folder.search import FullTextIndex
+
+
+PROFILE_INDEX = FullTextIndex('user_management_profile_fts', ['username', 'first_name', 'last_name'])
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Crea la tabella FTS5 dell'indice full-text dei profili e indicizza i profili esistenti.
+    """
+    Profile = apps.get_model('user_management', 'Profile')
+
+    schema_editor.execute(PROFILE_INDEX.create_sql)
+
+    using = schema_editor.connection.alias
+    profiles = Profile.objects.using(using).filter(user__is_active=True, user__is_superuser=False)\
+        .values_list('pk', 'user__username', 'first_name', 'last_name')
+    PROFILE_INDEX.rebuild(((row[0], row[1:]) for row in profiles), using=using)
+
+
+def drop_search_index(apps, schema_editor):
+    schema_editor.execute(PROFILE_INDEX.drop_sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_management', '0031_profile_feed_fan_out_on_read'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:05
+
+import books_base_folder.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_management', '0032_profile_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='picture',
+            field=models.ImageField(blank=True, default='profiles/default/default_profile_image.jpg', null=True, storage=books_base_folder.storage.ContentAddressedStorage(), upload_to='profiles/images/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_management', '0033_profile_picture_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='picture_variants',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
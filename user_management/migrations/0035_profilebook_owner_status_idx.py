@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_management', '0034_profile_picture_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='profilebook',
+            index=models.Index(fields=['profile_owner', 'status'], name='profilebook_owner_status_idx'),
+        ),
+    ]
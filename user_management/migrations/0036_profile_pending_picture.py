@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_management', '0035_profilebook_owner_status_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='pending_picture',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(condition=models.Q(pending_picture__isnull=False), fields=['pending_picture'], name='profile_pending_picture_idx'),
+        ),
+    ]
@@ -1,17 +1,25 @@
 from datetime import datetime, date
+from io import BytesIO
 
-from PIL import Image
+from PIL import Image, ImageOps
 from django.conf import settings
 from django.contrib.auth.models import User, AbstractUser
+from django.core.cache import cache
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.core.validators import MaxValueValidator
-from django.db import models
+from django.db import models, transaction, DEFAULT_DB_ALIAS
 from django.db.models import Count
+from django.utils import timezone
+from django.utils.functional import cached_property
 
 from django.utils.translation import gettext_lazy as _
 
-from book_management.models import Book
-from comment_management.models import Topic, Bookmark
+from book_management.models import Book, BookStats, StoredFile
+from book_management.thumbnails import THUMBNAIL_FORMATS, thumbnail_name
+from books_base_folder.search import FullTextIndex, SearchResults
+from books_base_folder.storage import content_storage
+from books_base_folder.tracking import LoadedValuesMixin
+from comment_management.models import Topic, Bookmark, ActivityCounter, LeaderboardEntry
 
 
 class PlatformUser(AbstractUser):
@@ -115,18 +123,20 @@ class PlatformUser(AbstractUser):
     @staticmethod
     def get_popular_by_topics():
         """
-        :return: 5 utenti più popolari sulla base dei topic pubblicati.
+        :return: 5 utenti più popolari sulla base dei topic pubblicati, letti dalla classifica materializzata.
         """
-        return PlatformUser.objects.all().annotate(num_topics=Count('topics')).order_by('-num_topics')\
-            .exclude(profile=None)[:5]
+        return PlatformUser.objects.filter(leaderboard_entries__board=ActivityCounter.USERS_BY_TOPICS,
+                                           leaderboard_entries__window=LeaderboardEntry.ALL)\
+            .select_related('profile').order_by('-leaderboard_entries__score')[:5]
 
     @staticmethod
     def get_popular_by_comments():
         """
-        :return: 5 utenti più popolari sulla base dei commenti pubblicati.
+        :return: 5 utenti più popolari sulla base dei commenti pubblicati, letti dalla classifica materializzata.
         """
-        return PlatformUser.objects.all().annotate(num_comments=Count('comments')).order_by('-num_comments')\
-            .exclude(profile=None)[:5]
+        return PlatformUser.objects.filter(leaderboard_entries__board=ActivityCounter.USERS_BY_COMMENTS,
+                                           leaderboard_entries__window=LeaderboardEntry.ALL)\
+            .select_related('profile').order_by('-leaderboard_entries__score')[:5]
 
     @property
     def get_followed_profiles(self):
@@ -144,25 +154,74 @@ class PlatformUser(AbstractUser):
     #         raise ValidationError(_('È necessario accettare i termini di servizio per proseguire.'))
 
 
-class Profile(models.Model):
+class Profile(LoadedValuesMixin, models.Model):
     """
     Model contenente i profili.
     """
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
     description = models.TextField(max_length=10000, blank=True, null=True)
-    picture = models.ImageField(upload_to='profiles/images/%Y/%m/%d',
+    picture = models.ImageField(upload_to='profiles/images/',
                                 default="profiles/default/default_profile_image.jpg",
-                                blank=True, null=True)
+                                blank=True, null=True, storage=content_storage)
+    picture_variants = models.JSONField(default=list, blank=True, editable=False)
+    pending_picture = models.CharField(max_length=100, blank=True, null=True, editable=False)
 
     followers = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name="followed_profiles",
                                        through="FollowRelation")
+    feed_fan_out_on_read = models.BooleanField(default=False)
 
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="profile")
 
+    search_index = FullTextIndex('user_management_profile_fts', ['username', 'first_name', 'last_name'])
+
     def __str__(self):
         return "%s (%s)" % (self.get_name, self.user.username)
 
+    @property
+    def is_searchable(self):
+        """
+        :return: True se il profilo può comparire nei risultati di ricerca: non vengono mostrati i profili
+            di utenti disattivati e degli amministratori.
+        """
+        return self.user.is_active and not self.user.is_superuser
+
+    @property
+    def search_document(self):
+        """
+        :return: Valori indicizzati per la ricerca full-text: username, nome e cognome.
+        """
+        return [self.user.username, self.first_name, self.last_name]
+
+    def update_search_index(self):
+        """
+        Aggiorna il documento del profilo nell'indice full-text, o lo rimuove se il profilo non è ricercabile.
+        """
+        if self.is_searchable:
+            Profile.search_index.update(self.pk, self.search_document)
+        else:
+            Profile.search_index.delete(self.pk)
+
+    @staticmethod
+    def search(query, exclude=()):
+        """
+        Ricerca full-text dei profili per username, nome e cognome.
+        :param query: Testo della ricerca.
+        :param exclude: pk dei profili da escludere.
+        :return: Oggetto SearchResults con i profili in ordine di rilevanza, da paginare.
+        """
+        return SearchResults(Profile.search_index, query, Profile.objects.select_related('user'), exclude)
+
+    @staticmethod
+    def rebuild_search_index():
+        """
+        Ricostruisce l'indice full-text dei profili ricercabili.
+        :return: Numero di profili indicizzati.
+        """
+        profiles = Profile.objects.filter(user__is_active=True, user__is_superuser=False)\
+            .values_list('pk', 'user__username', 'first_name', 'last_name')
+        return Profile.search_index.rebuild((row[0], row[1:]) for row in profiles.iterator())
+
     @property
     def get_name(self):
         """
@@ -170,12 +229,56 @@ class Profile(models.Model):
         """
         return f"{self.first_name} {self.last_name}"
 
+    @property
+    def has_too_many_followers_for_fan_out(self):
+        """
+        :return: True se il profilo ha più follower di quanti ne possano essere serviti con fan-out on write.
+        """
+        return self.follower_relations.count() > settings.FEED_FAN_OUT_MAX_FOLLOWERS
+
     @property
     def books_count(self):
         """
         :return: Numero di libri nel bookshelf dell'utente.
         """
-        return self.books.all().count()
+        return self.bookshelf_summary['total']
+
+    @staticmethod
+    def bookshelf_summary_cache_key(profile_id):
+        return 'bookshelf_summary:%d' % profile_id
+
+    @cached_property
+    def bookshelf_summary(self):
+        """
+        Numero di libri del bookshelf per ciascuno status, letto con un'unica query GROUP BY status e memorizzato
+        in cache. La cache viene invalidata (signals) a ogni salvataggio o eliminazione di un ProfileBook.
+        I conteggi vengono letti dal database principale anche nelle richieste servite dalle repliche: una replica
+        non ancora aggiornata salverebbe in cache i conteggi precedenti all'ultima invalidazione.
+        :return: Dizionario con le chiavi 'reading', 'read', 'must_read' e 'total'.
+        """
+        key = Profile.bookshelf_summary_cache_key(self.pk)
+        summary = cache.get(key)
+        if summary is None:
+            counts = dict(self.books.using(DEFAULT_DB_ALIAS).exclude(book=None).order_by().values_list('status')
+                          .annotate(count=Count('pk')))
+            summary = {
+                'reading': counts.get(ProfileBook.READING, 0),
+                'read': counts.get(ProfileBook.READ, 0),
+                'must_read': counts.get(ProfileBook.MUST_READ, 0),
+            }
+            summary['total'] = sum(summary.values())
+            cache.set(key, summary, settings.BOOKSHELF_SUMMARY_CACHE_TTL)
+        return summary
+
+    @staticmethod
+    def invalidate_bookshelf_summary(profile_id):
+        """
+        Elimina dalla cache il riepilogo del bookshelf di un profilo, subito e di nuovo al termine della transazione
+        corrente, così che una richiesta concorrente non possa memorizzare i conteggi precedenti alla modifica.
+        """
+        key = Profile.bookshelf_summary_cache_key(profile_id)
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key))
 
     @property
     def books_set(self):
@@ -186,7 +289,7 @@ class Profile(models.Model):
                     3. data di ultima modifica decrescente
         """
         books = self.books.all()
-        return Book.objects.filter(profile_books__in=books).\
+        return Book.objects.select_related('stats').filter(profile_books__in=books).\
             order_by('-profile_books__end_reading_date',
                      '-profile_books__start_reading_date', '-profile_books__last_update_date_time')
 
@@ -200,60 +303,122 @@ class Profile(models.Model):
                         3. data di ultima modifica decrescente
         """
         books = self.books.all().exclude(book__cover_image_file__exact=Book._meta.get_field('cover_image_file').default)
-        return Book.objects.filter(profile_books__in=books).\
+        return Book.objects.select_related('stats').filter(profile_books__in=books).\
             order_by('-profile_books__end_reading_date', '-profile_books__start_reading_date',
                      '-profile_books__last_update_date_time')
 
     @property
     def reading_books_set(self):
         books = self.books.filter(status='READING')
-        return Book.objects.filter(profile_books__in=books).order_by('-profile_books__start_reading_date')
+        return Book.objects.select_related('stats').filter(profile_books__in=books)\
+            .order_by('-profile_books__start_reading_date')
 
     @property
     def read_books_set(self):
         books = self.books.filter(status='READ')
-        return Book.objects.filter(profile_books__in=books).order_by('-profile_books__end_reading_date')
+        return Book.objects.select_related('stats').filter(profile_books__in=books)\
+            .order_by('-profile_books__end_reading_date')
 
     @property
     def must_read_books_set(self):
         books = self.books.filter(status='MUSTREAD')
-        return Book.objects.filter(profile_books__in=books).order_by('-profile_books__last_update_date_time')
+        return Book.objects.select_related('stats').filter(profile_books__in=books)\
+            .order_by('-profile_books__last_update_date_time')
+
+    @property
+    def picture_srcset(self):
+        """
+        Property utilizzata nei template per l'attributo srcset delle immagini del profilo.
+        :return: Dizionario del tipo {estensione: srcset} con le varianti ridotte e l'immagine a dimensione
+            piena, vuoto se l'immagine non è ancora stata elaborata.
+        """
+        if not self.picture_variants:
+            return {}
+        srcset = {extension: ", ".join("%s %dw" % (content_storage.url(thumbnail_name(self.picture.name, width,
+                                                                                       extension)), width)
+                                       for width in self.picture_variants)
+                  for extension, __, __ in THUMBNAIL_FORMATS}
+        srcset['jpg'] += ", %s %dw" % (self.picture.url, settings.PROFILE_PICTURE_SIZE)
+        return srcset
+
+    @staticmethod
+    def square_picture(picture, size):
+        """
+        Ritaglia l'immagine in modo da renderla un quadrato e la riduce a size x size pixel se più grande.
+        Le immagini JPEG vengono decodificate in modalità draft, direttamente alla scala ridotta più vicina alla
+        dimensione finale: una foto da diversi megapixel non viene mai decodificata per intero.
+        :param picture: File dell'immagine caricata.
+        :return: Contenuto dell'immagine elaborata, in formato JPEG.
+        """
+        img = Image.open(picture)
+        img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        width, height = img.size
+
+        if height < width:
+            left = (width - height) / 2
+            right = (width + height) / 2
+            top = 0
+            bottom = height
+            img = img.crop((left, top, right, bottom))
+
+        elif width < height:
+            left = 0
+            right = width
+            top = 0
+            bottom = width
+            img = img.crop((left, top, right, bottom))
+
+        if width > size and height > size:
+            img.thumbnail((size, size), Image.LANCZOS)
+
+        output = BytesIO()
+        img.save(output, format='JPEG', quality=85)
+        return output.getvalue()
 
     def save(self, *args, **kwargs):
         """
-        Completa il salvataggio modificando l'immagine del profilo in modo da renderla un quadrato.
         Se non è presente nessuna immagine setta quella di default (utile in caso di eliminazione
         dell'immagine in fase di update).
+        L'immagine caricata viene scritta nell'archivio così com'è e registrata in pending_picture, con l'unica
+        scrittura nel database del salvataggio del profilo: fino all'elaborazione in background
+        (BackgroundJob.PROFILE_PICTURE, vedi user_management.jobs) il profilo continua a mostrare l'immagine
+        precedente, e la richiesta non deve decodificare l'immagine.
+        Negli altri casi aggiorna i riferimenti all'immagine (StoredFile) nella stessa transazione.
         """
-        super().save()
-        if self.picture:
-            img = Image.open(self.picture.path)
-            width, height = img.size
-
-            if width > 300 and height > 300:
-                img.thumbnail((width, height))
-
-            if height < width:
-                left = (width - height) / 2
-                right = (width + height) / 2
-                top = 0
-                bottom = height
-                img = img.crop((left, top, right, bottom))
-
-            elif width < height:
-                left = 0
-                right = width
-                top = 0
-                bottom = width
-                img = img.crop((left, top, right, bottom))
+        if not self.picture:
+            self.picture = self._meta.get_field('picture').get_default()
 
-            if width > 300 and height > 300:
-                img.thumbnail((300, 300))
+        tracked = StoredFile.is_tracked_save(self, 'picture', kwargs.get('update_fields'))
+        if tracked and not self.picture._committed:
+            self.picture.save(self.picture.name, self.picture.file, save=False)
+            self.pending_picture = self.picture.name
+            self.picture = StoredFile.saved_name(self, 'picture') or self._meta.get_field('picture').get_default()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'pending_picture'}
+
+        with transaction.atomic():
+            old_picture = StoredFile.saved_name(self, 'picture') if tracked else None
+            picture_changed = tracked and old_picture != self.picture.name
+            if picture_changed:
+                self.picture_variants = []
+                if kwargs.get('update_fields') is not None:
+                    kwargs['update_fields'] = set(kwargs['update_fields']) | {'picture_variants'}
+            super().save(*args, **kwargs)
+            if picture_changed:
+                StoredFile.replace_reference(old_picture, self.picture.name)
+        self.refresh_loaded_values(['picture', 'first_name', 'last_name'])
 
-            img.save(self.picture.path)
-        else:
-            self.picture = self._meta.get_field('picture').get_default()
-            self.save()
+    class Meta:
+        """
+        L'indice parziale su pending_picture serve la ricerca delle immagini caricate da elaborare.
+        """
+        indexes = [
+            models.Index(fields=['pending_picture'], name='profile_pending_picture_idx',
+                         condition=models.Q(pending_picture__isnull=False)),
+        ]
 
 
 class FollowRelation(models.Model):
@@ -297,9 +462,21 @@ class ProfileBook(models.Model):
     status = models.CharField(max_length=8, choices=BOOK_STATUS_CHOICES, default=READ)
     rating = models.PositiveSmallIntegerField(blank=True, null=True, validators=[MaxValueValidator(100)])
 
+    def __init__(self, *args, **kwargs):
+        super(ProfileBook, self).__init__(*args, **kwargs)
+        deferred = self.get_deferred_fields() & {'book', 'book_id', 'status', 'rating'}
+        self._saved_state = self.stats_state if self.pk is not None and not deferred else None
+
     def __str__(self):
         return "%s - %s" % (self.profile_owner.user.username, self.book.title)
 
+    @property
+    def stats_state(self):
+        """
+        :return: Valori dell'oggetto che contribuiscono alle statistiche del libro (BookStats).
+        """
+        return self.book_id, self.status, self.rating
+
     @property
     def get_verbose_status(self):
         """
@@ -312,9 +489,10 @@ class ProfileBook(models.Model):
         if self.status == 'MUSTREAD':
             return _("Da leggere")
 
-    def save(self, *args, **kwargs):
+    def apply_status_rules(self):
         """
-        Esegue una serie di verifiche sull'oggetto salvato ed effettua eventuali modifiche se necessario.
+        Adegua rating e date di lettura allo status del libro: il rating è ammesso solo per i libri letti, e le date
+        vengono impostate o rimosse in base alla categoria.
         """
         if self.status != 'READ':
             self.rating = None
@@ -334,11 +512,134 @@ class ProfileBook(models.Model):
             if self.start_reading_date > self.end_reading_date:
                 self.start_reading_date = self.end_reading_date
 
-        super(ProfileBook, self).save(*args, **kwargs)
+    def save(self, *args, **kwargs):
+        """
+        Esegue una serie di verifiche sull'oggetto salvato ed effettua eventuali modifiche se necessario.
+        Aggiorna in modo incrementale le statistiche del libro nella stessa transazione.
+        """
+        self.apply_status_rules()
+
+        with transaction.atomic():
+            super(ProfileBook, self).save(*args, **kwargs)
+            BookStats.apply_changes([(self._saved_state, self.stats_state)])
+        self._saved_state = self.stats_state
+
+    @staticmethod
+    def apply_operations(profile, operations):
+        """
+        Applica al bookshelf di un profilo una lista di operazioni, in un'unica transazione e con query bulk: una
+        lettura dei ProfileBook e dei libri coinvolti, poi un DELETE, un UPDATE e un INSERT complessivi.
+        Le operazioni vengono applicate in ordine (ad esempio un libro aggiunto può essere spostato nella stessa
+        lista) con le stesse regole di save. Le statistiche dei libri spostati o aggiunti e il riepilogo del
+        bookshelf vengono aggiornati una sola volta, quelle dei libri eliminati dai segnali di post_delete.
+        Le operazioni non valide vengono ignorate e segnalate nel risultato.
+        :param profile: Profilo proprietario del bookshelf.
+        :param operations: Lista di dizionari {'action': 'add' | 'move' | 'delete', 'book': pk del libro,
+            'status': categoria di destinazione, non necessaria per 'delete'}.
+        :return: Lista dei risultati, uno per operazione e nello stesso ordine: {'book', 'status'}, con lo status
+            human readable oppure 'deleted', se l'operazione è stata applicata, {'book', 'error'} altrimenti.
+        """
+        statuses = dict(ProfileBook.BOOK_STATUS_CHOICES)
+        parsed = []
+        for operation in operations:
+            if not isinstance(operation, dict):
+                parsed.append((None, None, None))
+                continue
+            try:
+                book_id = int(operation.get('book'))
+            except (TypeError, ValueError):
+                book_id = None
+            parsed.append((operation.get('action'), book_id, operation.get('status')))
+
+        book_ids = {book_id for _, book_id, _ in parsed if book_id is not None}
+        added_ids = {book_id for action, book_id, _ in parsed if action == 'add' and book_id is not None}
+
+        with transaction.atomic():
+            saved = {profile_book.book_id: profile_book for profile_book in
+                     ProfileBook.objects.filter(profile_owner=profile, book_id__in=book_ids).order_by()}
+            books = set(Book.objects.filter(pk__in=added_ids).values_list('pk', flat=True)) if added_ids else set()
+
+            current = dict(saved)
+            moved = set()
+            results = []
+            for action, book_id, status in parsed:
+                if book_id is None or action not in ('add', 'move', 'delete') or \
+                        (action != 'delete' and status not in statuses):
+                    results.append({'book': book_id, 'error': 'invalid'})
+                    continue
+
+                profile_book = current.get(book_id)
+                if action == 'add':
+                    if profile_book is not None:
+                        results.append({'book': book_id, 'error': 'already_exists'})
+                        continue
+                    if book_id not in books:
+                        results.append({'book': book_id, 'error': 'not_found'})
+                        continue
+                    profile_book = current[book_id] = ProfileBook(profile_owner=profile, book_id=book_id)
+                elif profile_book is None:
+                    results.append({'book': book_id, 'error': 'not_found'})
+                    continue
+
+                if action == 'delete':
+                    current[book_id] = None
+                    results.append({'book': book_id, 'status': 'deleted'})
+                    continue
+
+                profile_book.status = status
+                profile_book.apply_status_rules()
+                moved.add(book_id)
+                results.append({'book': book_id, 'status': profile_book.get_verbose_status})
+
+            deleted = {book_id: profile_book.pk for book_id, profile_book in saved.items()
+                       if current[book_id] is not profile_book}
+            now = timezone.now()
+            updated, created = [], []
+            for book_id in moved:
+                profile_book = current[book_id]
+                if profile_book is None:
+                    continue
+                if profile_book.pk is None:
+                    created.append(profile_book)
+                else:
+                    profile_book.last_update_date_time = now
+                    updated.append(profile_book)
+
+            # L'eliminazione invia post_delete per ogni ProfileBook, che ne rimuove il contributo dalle statistiche e
+            # invalida il riepilogo: qui sotto vengono aggiornate solo le statistiche dei libri rimasti o aggiunti.
+            if deleted:
+                ProfileBook.objects.filter(pk__in=deleted.values()).delete()
+            if updated:
+                ProfileBook.objects.bulk_update(updated, ['status', 'rating', 'start_reading_date', 'end_reading_date',
+                                                          'last_update_date_time'])
+            if created:
+                ProfileBook.objects.bulk_create(created)
+
+            changes = []
+            for book_id in set(saved) | set(current):
+                old_state = saved[book_id]._saved_state if book_id in saved and book_id not in deleted else None
+                new_state = current[book_id].stats_state if current.get(book_id) is not None else None
+                if old_state != new_state:
+                    changes.append((old_state, new_state))
+            BookStats.apply_changes(changes)
+
+            for profile_book in updated:
+                profile_book._saved_state = profile_book.stats_state
+
+            if deleted or updated or created:
+                Profile.invalidate_bookshelf_summary(profile.pk)
+                profile.__dict__.pop('bookshelf_summary', None)
+
+        return results
 
     class Meta:
         """
         Un utente può leggere un libro al più una volta.
+        L'indice (profile_owner, status) serve i conteggi e gli elenchi del bookshelf per stato (vedi il comando
+        advise_indexes).
         """
         unique_together = ["profile_owner", "book"]
-        ordering = ['-last_update_date_time', ]
\ No newline at end of file
+        ordering = ['-last_update_date_time', ]
+        indexes = [
+            models.Index(fields=['profile_owner', 'status'], name='profilebook_owner_status_idx'),
+        ]
\ No newline at end of file
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from book_management.models import BookStats, StoredFile
+from user_management.models import Profile, ProfileBook
+
+
+@receiver(post_delete, sender=ProfileBook)
+def profile_book_deleted(sender, instance, **kwargs):
+    """
+    Rimuove il contributo del libro eliminato dal bookshelf dalle statistiche del libro.
+    """
+    BookStats.apply_changes([(instance._saved_state, None)])
+
+
+@receiver(post_save, sender=ProfileBook)
+@receiver(post_delete, sender=ProfileBook)
+def invalidate_bookshelf_summary(sender, instance, **kwargs):
+    """
+    Invalida il riepilogo in cache del bookshelf del profilo quando un libro viene aggiunto, modificato o rimosso.
+    """
+    Profile.invalidate_bookshelf_summary(instance.profile_owner_id)
+
+
+@receiver(post_save, sender=Profile)
+def index_profile(sender, instance, created, **kwargs):
+    """
+    Aggiorna l'indice full-text al salvataggio di un profilo, se sono cambiati i campi indicizzati.
+    """
+    if created or instance.field_changed('first_name') or instance.field_changed('last_name'):
+        instance.update_search_index()
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def index_user_profile(sender, instance, created, update_fields, **kwargs):
+    """
+    Aggiorna l'indice full-text del profilo quando cambiano username o stato dell'utente. I salvataggi parziali
+    che non toccano questi campi (ad esempio l'aggiornamento di last_login a ogni accesso) vengono ignorati.
+    """
+    if created or (update_fields and not {'username', 'is_active', 'is_superuser'} & set(update_fields)):
+        return
+
+    try:
+        profile = instance.profile
+    except ObjectDoesNotExist:
+        return
+    profile.update_search_index()
+
+
+@receiver(post_delete, sender=Profile)
+def unindex_profile(sender, instance, **kwargs):
+    """
+    Rimuove il profilo eliminato dall'indice full-text.
+    """
+    Profile.search_index.delete(instance.pk)
+
+
+@receiver(post_delete, sender=Profile)
+def release_profile_picture(sender, instance, **kwargs):
+    """
+    Rimuove il riferimento all'immagine del profilo eliminato.
+    """
+    StoredFile.replace_reference(instance.picture.name, None)
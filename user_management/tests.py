@@ -1,3 +1,145 @@
+import json
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+
+from book_management.models import Book, BookStats
+from user_management.models import Profile, ProfileBook
+
+
+class BookshelfSummaryTest(TestCase):
+    """
+    Test del riepilogo del bookshelf dei profili.
+    """
+
+    def setUp(self):
+        """
+        Setup di un ambiente di test. Crea i seguenti oggetti a scopo di test:
+            - Utente con profilo
+            - Tre libri, due dei quali nel bookshelf del profilo
+        """
+        cache.clear()
+        user = get_user_model().objects.create_user('john', 'lennon@thebeatles.com', 'johnpassword')
+        self.profile = Profile.objects.create(first_name="John", last_name="Lennon", user=user)
+        self.books = [Book.objects.create(title="Libro %d" % i, isbn_10="", isbn_13="") for i in range(3)]
+        ProfileBook.objects.create(profile_owner=self.profile, book=self.books[0], status=ProfileBook.READING)
+        ProfileBook.objects.create(profile_owner=self.profile, book=self.books[1], status=ProfileBook.READ)
+
+    def get_summary(self):
+        return Profile.objects.get(pk=self.profile.pk).bookshelf_summary
+
+    def test_bookshelf_summary(self):
+        """
+        Test dei conteggi, letti con una sola query e poi dalla cache.
+        """
+        with self.assertNumQueries(2):
+            self.assertEquals(self.get_summary(), {'reading': 1, 'read': 1, 'must_read': 0, 'total': 2})
+        with self.assertNumQueries(1):
+            self.assertEquals(self.get_summary()['total'], 2)
+
+    def test_bookshelf_summary_invalidation(self):
+        """
+        Test dell'invalidazione della cache al salvataggio e all'eliminazione di un ProfileBook.
+        """
+        self.get_summary()
+        profile_book = ProfileBook.objects.create(profile_owner=self.profile, book=self.books[2],
+                                                  status=ProfileBook.MUST_READ)
+        self.assertEquals(self.get_summary(), {'reading': 1, 'read': 1, 'must_read': 1, 'total': 3})
+
+        profile_book.status = ProfileBook.READ
+        profile_book.save()
+        self.assertEquals(self.get_summary(), {'reading': 1, 'read': 2, 'must_read': 0, 'total': 3})
+
+        profile_book.delete()
+        self.assertEquals(self.get_summary(), {'reading': 1, 'read': 1, 'must_read': 0, 'total': 2})
+
+
+class BookshelfBatchTest(TestCase):
+    """
+    Test della modifica multipla del bookshelf.
+    """
+
+    def setUp(self):
+        """
+        Setup di un ambiente di test. Crea i seguenti oggetti a scopo di test:
+            - Utente con profilo
+            - Quattro libri, due dei quali nel bookshelf del profilo (uno letto con voto, uno in lettura)
+        """
+        cache.clear()
+        self.user = get_user_model().objects.create_user('john', 'lennon@thebeatles.com', 'johnpassword')
+        self.profile = Profile.objects.create(first_name="John", last_name="Lennon", user=self.user)
+        self.books = [Book.objects.create(title="Libro %d" % i, isbn_10="", isbn_13="") for i in range(4)]
+        ProfileBook.objects.create(profile_owner=self.profile, book=self.books[0], status=ProfileBook.READ,
+                                   rating=80)
+        ProfileBook.objects.create(profile_owner=self.profile, book=self.books[1], status=ProfileBook.READING)
+
+    def get_stats(self):
+        """
+        :return: Statistiche dei libri, escluse le righe azzerate (che rebuild non ricrea).
+        """
+        return {stats.book_id: (stats.rating_sum, stats.rating_count, stats.reading_count, stats.read_count,
+                                stats.must_read_count) for stats in BookStats.objects.all()
+                if stats.rating_count or stats.reading_count or stats.read_count or stats.must_read_count}
+
+    def test_apply_operations(self):
+        """
+        Test dell'applicazione delle operazioni con una query per tipo sui ProfileBook (più un UPDATE delle
+        statistiche per ogni libro coinvolto e la lettura dei ProfileBook eliminati per i segnali), delle regole di
+        save, dei risultati per operazione e della coerenza delle statistiche dei libri.
+        """
+        operations = [
+            {'action': 'move', 'book': self.books[0].pk, 'status': ProfileBook.MUST_READ},
+            {'action': 'delete', 'book': self.books[1].pk},
+            {'action': 'add', 'book': self.books[2].pk, 'status': ProfileBook.READING},
+            {'action': 'move', 'book': self.books[2].pk, 'status': ProfileBook.READ},
+            {'action': 'add', 'book': self.books[0].pk, 'status': ProfileBook.READ},
+            {'action': 'delete', 'book': self.books[3].pk},
+            {'action': 'add', 'book': 0, 'status': ProfileBook.READ},
+            {'action': 'move', 'book': self.books[0].pk, 'status': 'WRONG'},
+            {'action': 'add', 'book': 'x'},
+        ]
+        with self.assertNumQueries(16):
+            results = ProfileBook.apply_operations(self.profile, operations)
+
+        self.assertEquals([result.get('status', result.get('error')) for result in results],
+                          ["Da leggere", 'deleted', "In lettura", "Letto", 'already_exists', 'not_found',
+                           'not_found', 'invalid', 'invalid'])
+
+        moved = ProfileBook.objects.get(profile_owner=self.profile, book=self.books[0])
+        self.assertIsNone(moved.rating)
+        self.assertIsNone(moved.start_reading_date)
+        self.assertIsNone(moved.end_reading_date)
+        self.assertFalse(ProfileBook.objects.filter(profile_owner=self.profile, book=self.books[1]).exists())
+        added = ProfileBook.objects.get(profile_owner=self.profile, book=self.books[2])
+        self.assertEquals(added.status, ProfileBook.READ)
+        self.assertEquals(added.start_reading_date, date.today())
+        self.assertEquals(added.end_reading_date, date.today())
+
+        stats = self.get_stats()
+        BookStats.rebuild()
+        self.assertEquals(stats, self.get_stats())
+        self.assertEquals(Profile.objects.get(pk=self.profile.pk).bookshelf_summary,
+                          {'reading': 0, 'read': 1, 'must_read': 1, 'total': 2})
+
+    def test_ajax_update_bookshelf(self):
+        """
+        Test della view chiamata da Ajax: risultati, conteggi aggiornati e richieste non valide.
+        """
+        url = reverse('user_management:ajax-update-bookshelf')
+        self.client.login(username='john', password='johnpassword')
+
+        response = self.client.post(url, json.dumps({'operations': [
+            {'action': 'move', 'book': self.books[1].pk, 'status': ProfileBook.READ},
+            {'action': 'delete', 'book': self.books[0].pk},
+        ]}), content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json(), {
+            'results': [{'book': self.books[1].pk, 'status': "Letto"}, {'book': self.books[0].pk, 'status': 'deleted'}],
+            'counts': {ProfileBook.READING: 0, ProfileBook.READ: 1, ProfileBook.MUST_READ: 0},
+        })
 
-# Create your tests here.
+        for body in ('{', json.dumps({'operations': {}}), json.dumps([])):
+            self.assertEquals(self.client.post(url, body, content_type='application/json').status_code, 400)
@@ -32,4 +32,5 @@ urlpatterns = [
     path('ajax-delete-book', views.ajax_delete_book, name='ajax-delete-book'),
     path('ajax-move-book', views.ajax_move_book, name='ajax-move-book'),
     path('ajax-new-book', views.ajax_new_book, name='ajax-new-book'),
+    path('ajax-update-bookshelf', views.ajax_update_bookshelf, name='ajax-update-bookshelf'),
 ]
\ No newline at end of file
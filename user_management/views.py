@@ -1,3 +1,5 @@
+import json
+
 from django.conf import settings
 from django.contrib.auth import login, get_user_model
 from django.contrib.auth.decorators import login_required
@@ -20,6 +22,7 @@ from user_management.forms import UpdateBookInfoCrispyForm
 from book_management.models import Book
 from books_base_folder.forms import SearchCrispyForm
 from books_base_folder.views import SearchMixin
+from comment_management.models import Topic
 from user_management.decorators import has_profile_only, has_not_profile_only
 from user_management.forms import PlatformUserCreationForm, LoginForm, UpdateProfileCrispyForm, CreateProfileCrispyForm, \
     UpdateProfilePictureCrispyForm, SearchBookCrispyForm, UpdatePasswordCrispyForm
@@ -147,9 +150,20 @@ class UserProfileView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         """
         Recupera le informazioni dell'utente e di tutti i libri.
+        Carica like e bookmark dell'utente che visualizza per tutti i topic della pagina.
         """
         context = super(UserProfileView, self).get_context_data(**kwargs)
-        context['user_for_profile'] = get_user_model().objects.get(pk=self.kwargs['pk'])
+        user_for_profile = get_user_model().objects.get(pk=self.kwargs['pk'])
+        context['user_for_profile'] = user_for_profile
+        context['topics'] = Topic.load_viewer_state(user_for_profile.topics_set.select_related('book'),
+                                                    self.request.user)
+
+        if user_for_profile == self.request.user:
+            context['saved_topics'] = Topic.load_viewer_state(user_for_profile.saved_topics_set.select_related('book'),
+                                                              self.request.user)
+            context['liked_topics'] = Topic.load_viewer_state(user_for_profile.liked_topics_set.select_related('book'),
+                                                              self.request.user)
+
         return context
 
 
@@ -344,11 +358,11 @@ class BookshelfNewBook(SearchMixin, FormView):
     """
     template_name = "user_management/bookshelf/bookshelf_new_book.html"
     form_class = SearchBookCrispyForm
+    search_profiles = False
 
     def get_context_data(self, **kwargs):
         """
         Aggiorna lo stile della barra di ricerca del Crispy Form e aggiunge la query come valore di default.
-        Filtra il context rimuovendo i libri già presenti nella libreria dell'utente che sta facendo richiesta.
         """
         context = super(BookshelfNewBook, self).get_context_data(**kwargs)
 
@@ -357,11 +371,14 @@ class BookshelfNewBook(SearchMixin, FormView):
         if context['search_query'] is not None:
             context['form'].fields['search'].widget.attrs.update({'value': context['search_query']})
 
-        if context['books'] is not None:
-            context['books'] = context['books'].exclude(id__in=self.request.user.profile.books_set)
-
         return context
 
+    def get_excluded_books(self):
+        """
+        Esclude dai risultati i libri già presenti nella libreria dell'utente che sta facendo richiesta.
+        """
+        return self.request.user.profile.books.values_list('book_id', flat=True)
+
 
 @method_decorator([login_required, has_profile_only], name='dispatch')
 class UpdateReadingBooks(TemplateView):
@@ -424,7 +441,7 @@ class UpdateBookInfo(UpdateView):
 
     def get_context_data(self, **kwargs):
         context = super(UpdateBookInfo, self).get_context_data(**kwargs)
-        context['book'] = Book.objects.get(pk=self.kwargs['pk'])
+        context['book'] = Book.objects.select_related('stats').get(pk=self.kwargs['pk'])
 
         if self.get_object().status == 'READING':
             context['form'].fields['end_reading_date'].widget.attrs['disabled'] = True
@@ -534,11 +551,9 @@ def ajax_move_book(request):
     profile_book.status = move_to
     profile_book.save()
 
-    status = ProfileBook.objects.get(book_id=book_id, profile_owner_id=request.user.profile.pk).get_verbose_status
-
     return JsonResponse({
             'id': book_id,
-            'status': status,
+            'status': profile_book.get_verbose_status,
         })
 
 
@@ -560,8 +575,37 @@ def ajax_new_book(request):
     )
     profile_book.save()
 
-    status = ProfileBook.objects.get(book_id=book_id, profile_owner_id=request.user.profile.pk).get_verbose_status
-
     return JsonResponse({
-            'status': status,
+            'status': profile_book.get_verbose_status,
         })
+
+
+@login_required
+@require_POST
+@csrf_protect
+def ajax_update_bookshelf(request):
+    """
+    Funzione chiamata da Ajax per applicare più operazioni al bookshelf con un'unica richiesta (selezione multipla).
+    Il corpo della richiesta è un JSON del tipo {"operations": [{"action": "move", "book": 1, "status": "READ"}]},
+    con action uguale ad "add", "move" o "delete" (vedi ProfileBook.apply_operations).
+    :return: risultato di ciascuna operazione e numero aggiornato dei libri del bookshelf per categoria.
+    """
+    try:
+        operations = json.loads(request.body).get('operations')
+    except (ValueError, AttributeError):
+        operations = None
+    if not isinstance(operations, list) or len(operations) > settings.BOOKSHELF_BATCH_MAX_OPERATIONS:
+        return HttpResponseBadRequest()
+
+    profile = request.user.profile
+    results = ProfileBook.apply_operations(profile, operations)
+    summary = profile.bookshelf_summary
+
+    return JsonResponse({
+        'results': results,
+        'counts': {
+            ProfileBook.READING: summary['reading'],
+            ProfileBook.READ: summary['read'],
+            ProfileBook.MUST_READ: summary['must_read'],
+        },
+    })